@@ -1,21 +1,21 @@
-from fastapi import Header
-from sqlalchemy import select
+import hmac
+
+from fastapi import Depends, Header
 from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
 from app.core.errors import AppError
-from app.core.security import hash_token
-from app.db.models import Terminal
 from app.db.session import get_db
+from app.services.terminal_auth import TerminalIdentity, authenticate_terminal
 
 async def get_terminal(
-    db: AsyncSession,
+    db: AsyncSession = Depends(get_db),
     x_terminal_token: str | None = Header(default=None)
-) -> Terminal:
-    if not x_terminal_token:
-        raise AppError("TERMINAL_UNAUTHORIZED", "Не указан токен терминала.", 401)
-    token_hash = hash_token(x_terminal_token)
-    term = (await db.execute(select(Terminal).where(Terminal.api_token_hash == token_hash))).scalar_one_or_none()
-    if not term:
-        raise AppError("TERMINAL_UNAUTHORIZED", "Неверный токен терминала.", 401)
-    if term.status != "ACTIVE":
-        raise AppError("TERMINAL_BLOCKED", "Терминал заблокирован.", 403)
-    return term
+) -> TerminalIdentity:
+    # cached; the session only touches the pool on a cache miss
+    return await authenticate_terminal(db, x_terminal_token)
+
+async def require_admin(x_admin_token: str | None = Header(default=None)) -> None:
+    if not settings.ADMIN_TOKEN:
+        raise AppError("ADMIN_DISABLED", "Администрирование отключено (ADMIN_TOKEN не задан).", 403)
+    if not x_admin_token or not hmac.compare_digest(x_admin_token, settings.ADMIN_TOKEN):
+        raise AppError("ADMIN_UNAUTHORIZED", "Неверный токен администратора.", 401)
@@ -0,0 +1,138 @@
+import secrets
+import uuid
+from datetime import date
+
+from fastapi import APIRouter, Depends
+from sqlalchemy import delete, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.api.deps import require_admin
+from app.core.errors import AppError
+from app.core.security import hash_token
+from app.db.models import CompanyHoliday, Employee, EmployeeAbsence, Terminal
+from app.db.session import get_db
+from app.services.calendar import get_calendar, invalidate_calendar
+from app.services.terminal_auth import invalidate_terminal
+
+router = APIRouter(prefix="/api/admin", dependencies=[Depends(require_admin)])
+
+ABSENCE_TYPES = {"VACATION", "SICK", "OFF"}
+
+def _date(value, field: str) -> date:
+    try:
+        return date.fromisoformat(str(value))
+    except ValueError:
+        raise AppError("BAD_REQUEST", f"Поле {field}: ожидается дата YYYY-MM-DD.")
+
+def _uuid(value, field: str) -> uuid.UUID:
+    try:
+        return uuid.UUID(str(value))
+    except ValueError:
+        raise AppError("BAD_REQUEST", f"Поле {field}: ожидается UUID.")
+
+async def _commit_calendar_change(db: AsyncSession) -> None:
+    # triggers bump calendar_version and clear stored eligibility flags with
+    # the change, so every worker notices it; this one reloads right away
+    await db.commit()
+    invalidate_calendar()
+
+@router.get("/holidays")
+async def list_holidays(year: int | None = None, db: AsyncSession = Depends(get_db)):
+    q = select(CompanyHoliday).order_by(CompanyHoliday.date)
+    if year:
+        q = q.where(CompanyHoliday.date >= date(year, 1, 1), CompanyHoliday.date <= date(year, 12, 31))
+    rows = (await db.execute(q)).scalars().all()
+    return {"ok": True, "data": [{"date": h.date.isoformat(), "title": h.title} for h in rows]}
+
+@router.put("/holidays")
+async def put_holiday(payload: dict, db: AsyncSession = Depends(get_db)):
+    d = _date(payload.get("date"), "date")
+    title = payload.get("title")
+    stmt = insert(CompanyHoliday).values(date=d, title=title)
+    await db.execute(stmt.on_conflict_do_update(index_elements=[CompanyHoliday.date], set_={"title": title}))
+    await _commit_calendar_change(db)
+    return {"ok": True, "data": {"date": d.isoformat(), "title": title}}
+
+@router.delete("/holidays/{day}")
+async def delete_holiday(day: str, db: AsyncSession = Depends(get_db)):
+    d = _date(day, "date")
+    res = await db.execute(delete(CompanyHoliday).where(CompanyHoliday.date == d))
+    if not res.rowcount:
+        raise AppError("HOLIDAY_NOT_FOUND", "Праздничный день не найден.", 404)
+    await _commit_calendar_change(db)
+    return {"ok": True, "data": {"deleted": d.isoformat()}}
+
+@router.get("/absences")
+async def list_absences(employee_id: str, db: AsyncSession = Depends(get_db)):
+    emp_id = _uuid(employee_id, "employee_id")
+    rows = (await db.execute(
+        select(EmployeeAbsence).where(EmployeeAbsence.employee_id == emp_id).order_by(EmployeeAbsence.date_from)
+    )).scalars().all()
+    return {"ok": True, "data": [{
+        "id": str(a.id),
+        "date_from": a.date_from.isoformat(),
+        "date_to": a.date_to.isoformat(),
+        "absence_type": a.absence_type,
+    } for a in rows]}
+
+@router.post("/absences")
+async def add_absence(payload: dict, db: AsyncSession = Depends(get_db)):
+    emp_id = _uuid(payload.get("employee_id"), "employee_id")
+    d_from = _date(payload.get("date_from"), "date_from")
+    d_to = _date(payload.get("date_to"), "date_to")
+    absence_type = payload.get("absence_type")
+    if d_to < d_from:
+        raise AppError("BAD_REQUEST", "date_to раньше date_from.")
+    if absence_type not in ABSENCE_TYPES:
+        raise AppError("BAD_REQUEST", f"absence_type: одно из {', '.join(sorted(ABSENCE_TYPES))}.")
+    if not (await db.execute(select(Employee.id).where(Employee.id == emp_id))).scalar_one_or_none():
+        raise AppError("EMPLOYEE_NOT_FOUND", "Сотрудник не найден.", 404)
+
+    absence = EmployeeAbsence(employee_id=emp_id, date_from=d_from, date_to=d_to, absence_type=absence_type)
+    db.add(absence)
+    await _commit_calendar_change(db)
+    return {"ok": True, "data": {"id": str(absence.id)}}
+
+@router.delete("/absences/{absence_id}")
+async def delete_absence(absence_id: str, db: AsyncSession = Depends(get_db)):
+    row = (await db.execute(
+        delete(EmployeeAbsence)
+        .where(EmployeeAbsence.id == _uuid(absence_id, "absence_id"))
+        .returning(EmployeeAbsence.employee_id, EmployeeAbsence.date_from, EmployeeAbsence.date_to)
+    )).one_or_none()
+    if not row:
+        raise AppError("ABSENCE_NOT_FOUND", "Отсутствие не найдено.", 404)
+    await _commit_calendar_change(db)
+    return {"ok": True, "data": {"deleted": absence_id}}
+
+@router.get("/calendar")
+async def calendar_status(db: AsyncSession = Depends(get_db)):
+    return {"ok": True, "data": (await get_calendar(db)).stats()}
+
+async def _update_terminal(db: AsyncSession, terminal_id: str, **values) -> uuid.UUID:
+    tid = _uuid(terminal_id, "terminal_id")
+    res = await db.execute(update(Terminal).where(Terminal.id == tid).values(**values))
+    if not res.rowcount:
+        raise AppError("TERMINAL_NOT_FOUND", "Терминал не найден.", 404)
+    await db.commit()
+    # this worker drops the cached auth now, others within TERMINAL_AUTH_CACHE_TTL_SEC
+    invalidate_terminal(tid)
+    return tid
+
+@router.post("/terminals/{terminal_id}/block")
+async def block_terminal(terminal_id: str, db: AsyncSession = Depends(get_db)):
+    tid = await _update_terminal(db, terminal_id, status="BLOCKED")
+    return {"ok": True, "data": {"terminal_id": str(tid), "status": "BLOCKED"}}
+
+@router.post("/terminals/{terminal_id}/unblock")
+async def unblock_terminal(terminal_id: str, db: AsyncSession = Depends(get_db)):
+    tid = await _update_terminal(db, terminal_id, status="ACTIVE")
+    return {"ok": True, "data": {"terminal_id": str(tid), "status": "ACTIVE"}}
+
+@router.post("/terminals/{terminal_id}/rotate_token")
+async def rotate_terminal_token(terminal_id: str, db: AsyncSession = Depends(get_db)):
+    token = secrets.token_urlsafe(32)
+    tid = await _update_terminal(db, terminal_id, api_token_hash=hash_token(token))
+    # the plain token is shown once; only its hash is stored
+    return {"ok": True, "data": {"terminal_id": str(tid), "api_token": token}}
@@ -1,63 +1,97 @@
 import base64
+import uuid
 from datetime import datetime
 from zoneinfo import ZoneInfo
 
-from fastapi import APIRouter, Depends
-from sqlalchemy import select
+from fastapi import APIRouter, Depends, Response
+from sqlalchemy import select, text
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.api.deps import get_terminal
 from app.core.config import settings
 from app.core.errors import AppError
-from app.db.models import Card, Employee, Face, MonthlyBalance, DailyBalance
-from app.db.session import get_db
-from app.services.calendar import is_company_workday, is_employee_working
+from app.db.models import Employee
+from app.db.session import get_read_db
+from app.services.calendar import get_calendar
 from app.services.finance import year_month
 
 router = APIRouter()
 
-@router.get("/api/employee_info")
-async def employee_info(card_uid: str, db: AsyncSession = Depends(get_db), terminal=Depends(get_terminal)):
-    card = (await db.execute(select(Card).where(Card.uid == card_uid))).scalar_one_or_none()
-    if not card:
-        raise AppError("CARD_NOT_FOUND", "Карта не найдена.", 404)
-    if card.status != "ACTIVE":
-        raise AppError("CARD_BLOCKED", "Карта заблокирована.", 403)
-
-    emp = (await db.execute(select(Employee).where(Employee.id == card.employee_id))).scalar_one()
-    if emp.status != "ACTIVE":
-        raise AppError("EMPLOYEE_BLOCKED", "Сотрудник заблокирован.", 403)
-
-    face = (await db.execute(select(Face).where(Face.employee_id == emp.id, Face.is_active == True))).scalar_one_or_none()
-    needs_face = face is None
+# Everything the first screen after a card tap needs, in one round trip.
+# The photo blob is only selected when asked for; the terminal normally
+# loads it separately from /api/employee_photo (cacheable per employee).
+EMPLOYEE_INFO_SQL = text("""
+SELECT c.status AS card_status,
+       e.id AS employee_id, e.full_name, e.employee_type, e.status AS employee_status, e.monthly_limit_cents,
+       e.photo_jpeg IS NOT NULL AS has_photo,
+       CASE WHEN :include_photo THEN e.photo_jpeg END AS photo_jpeg,
+       EXISTS (SELECT 1 FROM faces f WHERE f.employee_id = e.id AND f.is_active) AS has_face,
+       d.used_cents AS daily_used, d.subsidy_eligible,
+       m.used_cents AS monthly_used, m.limit_cents AS monthly_limit
+FROM cards c
+JOIN employees e ON e.id = c.employee_id
+LEFT JOIN daily_balance d ON d.employee_id = e.id AND d.date = :today
+LEFT JOIN monthly_balance m ON m.employee_id = e.id AND m.year_month = :ym
+WHERE c.uid = :card_uid
+""")
 
+@router.get("/api/employee_info")
+async def employee_info(
+    card_uid: str,
+    include_photo: bool = False,
+    db: AsyncSession = Depends(get_read_db),
+    terminal=Depends(get_terminal)
+):
     tz = ZoneInfo(settings.APP_TZ)
     today = datetime.now(tz=tz).date()
     ym = year_month(today)
 
-    dbal = (await db.execute(select(DailyBalance).where(DailyBalance.employee_id == emp.id, DailyBalance.date == today))).scalar_one_or_none()
-    used_today = dbal.used_cents if dbal else 0
+    row = (await db.execute(
+        EMPLOYEE_INFO_SQL, {"card_uid": card_uid, "today": today, "ym": ym, "include_photo": include_photo}
+    )).mappings().one_or_none()
+    if not row:
+        raise AppError("CARD_NOT_FOUND", "Карта не найдена.", 404)
+    if row["card_status"] != "ACTIVE":
+        raise AppError("CARD_BLOCKED", "Карта заблокирована.", 403)
+    if row["employee_status"] != "ACTIVE":
+        raise AppError("EMPLOYEE_BLOCKED", "Сотрудник заблокирован.", 403)
 
-    mbal = (await db.execute(select(MonthlyBalance).where(MonthlyBalance.employee_id == emp.id, MonthlyBalance.year_month == ym))).scalar_one_or_none()
-    monthly_used = mbal.used_cents if mbal else 0
-    monthly_limit = (mbal.limit_cents if mbal else emp.monthly_limit_cents)
+    used_today = row["daily_used"] or 0
+    monthly_used = row["monthly_used"] or 0
+    monthly_limit = row["monthly_limit"] if row["monthly_limit"] is not None else row["monthly_limit_cents"]
 
-    eligible = (emp.employee_type == "WORKER" and await is_company_workday(db, today) and await is_employee_working(db, emp.id, today))
+    emp_id = row["employee_id"]
+    eligible = row["subsidy_eligible"]
+    if eligible is None:
+        cal = await get_calendar(db)
+        eligible = (row["employee_type"] == "WORKER" and cal.is_company_workday(today) and cal.is_employee_working(emp_id, today))
     subsidy_left = max(0, settings.SUBSIDY_DAILY_CENTS - used_today) if eligible else 0
     monthly_left = max(0, monthly_limit - monthly_used)
 
-    photo_b64 = base64.b64encode(emp.photo_jpeg).decode("ascii") if emp.photo_jpeg else None
+    photo_b64 = base64.b64encode(row["photo_jpeg"]).decode("ascii") if row["photo_jpeg"] else None
 
     return {
         "ok": True,
         "data": {
-            "employee_id": str(emp.id),
-            "full_name": emp.full_name,
-            "employee_type": emp.employee_type,
-            "status": emp.status,
-            "photo_base64": photo_b64,
+            "employee_id": str(emp_id),
+            "full_name": row["full_name"],
+            "employee_type": row["employee_type"],
+            "status": row["employee_status"],
+            "photo_base64": photo_b64,  # only with include_photo=true
+            "photo_url": f"/api/employee_photo?employee_id={emp_id}" if row["has_photo"] else None,
             "subsidy_today_left_cents": subsidy_left,
             "monthly_left_cents": monthly_left,
-            "needs_face_enrollment": needs_face,
+            "needs_face_enrollment": not row["has_face"],
         }
     }
+
+@router.get("/api/employee_photo")
+async def employee_photo(employee_id: str, db: AsyncSession = Depends(get_read_db), terminal=Depends(get_terminal)):
+    try:
+        emp_id = uuid.UUID(employee_id)
+    except ValueError:
+        raise AppError("BAD_REQUEST", "Некорректный employee_id.")
+    photo = (await db.execute(select(Employee.photo_jpeg).where(Employee.id == emp_id))).scalar_one_or_none()
+    if not photo:
+        raise AppError("PHOTO_NOT_FOUND", "Фото сотрудника не найдено.", 404)
+    return Response(content=photo, media_type="image/jpeg", headers={"Cache-Control": "private, max-age=3600"})
@@ -1,3 +1,5 @@
+import asyncio
+
 from fastapi import APIRouter, Depends, UploadFile, File, Form
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, update
@@ -6,8 +8,9 @@ from app.api.deps import get_terminal
 from app.core.errors import AppError
 from app.db.models import Employee, Face
 from app.db.session import get_db
-from app.services.face import decode_image, detect_single_face_and_encoding
-import numpy as np
+from app.services.cv_executor import run_cv
+from app.services.face import encode_face_image, enrollment_template
+from app.services.face_index import invalidate_face_index
 
 router = APIRouter()
 
@@ -24,17 +27,10 @@ async def enroll_face(
     if not images or len(images) < 1:
         raise AppError("BAD_REQUEST", "Нужно прислать минимум 1 изображение.")
 
-    embeddings = []
-    for f in images[:10]:
-        raw = await f.read()
-        bgr = decode_image(raw)
-        _, emb = detect_single_face_and_encoding(bgr)
-        embeddings.append(emb)
-
-    # average embedding
-    avg = np.mean(np.stack(embeddings, axis=0), axis=0).astype(np.float32)
-    # simple quality: more samples -> better
-    quality_score = float(min(1.0, 0.5 + 0.1 * len(embeddings)))
+    raws = [await f.read() for f in images[:10]]
+    # one CV task per image, spread over the worker pool
+    embeddings = await asyncio.gather(*(run_cv(encode_face_image, raw) for raw in raws))
+    avg, quality_score = enrollment_template(embeddings)
 
     async with db.begin():
         # deactivate previous
@@ -46,6 +42,7 @@ async def enroll_face(
         face = Face(employee_id=emp.id, embedding=avg.tolist(), quality_score=quality_score, is_active=True)
         db.add(face)
 
+    invalidate_face_index()
     await db.refresh(face)
     return {
         "ok": True,
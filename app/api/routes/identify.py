@@ -0,0 +1,75 @@
+from fastapi import APIRouter, Depends, UploadFile, File
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.api.deps import get_terminal
+from app.core.config import settings
+from app.db.models import Card, Employee
+from app.db.session import get_db
+from app.services.cv_executor import run_cv
+from app.services.face import encode_face_image
+from app.services.face_index import search_faces
+
+router = APIRouter()
+
+@router.post("/api/identify_face")
+async def identify_face(
+    db: AsyncSession = Depends(get_db),
+    terminal=Depends(get_terminal),
+    image: UploadFile = File(...)
+):
+    raw = await image.read()
+    emb = await run_cv(encode_face_image, raw, settings.CV_FRAME_DECODE_SCALE)
+    cands = await search_faces(db, emb, settings.FACE_IDENTIFY_TOP_K)
+
+    # the search covers every enrolled face (a blocked look-alike must still
+    # make a match ambiguous); payability is checked on the winner below
+    names = {}
+    if cands:
+        rows = (await db.execute(
+            select(Employee.id, Employee.full_name, Employee.status,
+                   func.bool_or(Card.status == "ACTIVE"), func.count(Card.id))
+            .outerjoin(Card, Card.employee_id == Employee.id)
+            .where(Employee.id.in_([c.employee_id for c in cands]))
+            .group_by(Employee.id)
+        )).all()
+        names = {r[0]: (r[1], r[2], r[3], r[4]) for r in rows}
+
+    # top-1 must be under the 1:1 threshold and clearly closer than top-2,
+    # otherwise two enrolled people look alike and the cashier must tap a card
+    reason = None
+    if not cands or cands[0].dist > settings.FACE_DIST_THRESHOLD:
+        reason = "FACE_NOT_IDENTIFIED"
+    elif len(cands) > 1 and cands[1].dist - cands[0].dist < settings.FACE_IDENTIFY_MARGIN:
+        reason = "FACE_AMBIGUOUS"
+    else:
+        # identified, but not payable: same codes as /api/pay
+        _, status, has_active_card, n_cards = names.get(cands[0].employee_id, (None, None, None, 0))
+        if status != "ACTIVE":
+            reason = "EMPLOYEE_BLOCKED"
+        elif not n_cards:
+            reason = "CARD_NOT_FOUND"
+        elif not has_active_card:
+            reason = "CARD_BLOCKED"
+    best = cands[0] if reason is None else None
+
+    return {
+        "ok": True,
+        "data": {
+            "match": best is not None,
+            "reason_code": reason,
+            "employee_id": str(best.employee_id) if best else None,
+            "full_name": names[best.employee_id][0] if best else None,
+            "threshold": settings.FACE_DIST_THRESHOLD,
+            "margin": settings.FACE_IDENTIFY_MARGIN,
+            "candidates": [
+                {
+                    "employee_id": str(c.employee_id),
+                    "full_name": names.get(c.employee_id, (None, None))[0],
+                    "employee_status": names.get(c.employee_id, (None, None))[1],
+                    "dist": c.dist,
+                }
+                for c in cands
+            ],
+        }
+    }
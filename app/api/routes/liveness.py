@@ -1,4 +1,7 @@
-from fastapi import APIRouter, Depends, UploadFile, File, Form
+import asyncio
+import uuid
+
+from fastapi import APIRouter, Depends, UploadFile, File, Form, WebSocket, WebSocketDisconnect
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 
@@ -6,11 +9,28 @@ from app.api.deps import get_terminal
 from app.core.errors import AppError
 from app.core.security import make_liveness_token
 from app.db.models import LivenessSession
-from app.db.session import get_db
-from app.services.liveness import start_liveness, process_frame
+from app.db.session import SessionLocal, get_db
+from app.services.liveness import start_liveness, ingest_frame, load_state, session_by_id
+from app.services.liveness_store import get_session_store
+from app.services.terminal_auth import authenticate_terminal
 
 router = APIRouter()
 
+# Errors after which the session can't continue; everything else (no face,
+# blur, CV busy, ...) only concerns the current frame.
+SESSION_END_CODES = {"LIVENESS_NOT_FOUND", "LIVENESS_NOT_IN_PROGRESS", "LIVENESS_EXPIRED", "FACE_NOT_MATCH", "LIVENESS_FAILED"}
+WS_AUTH_TIMEOUT_SEC = 5
+
+def frame_status(sess) -> dict:
+    items = sess.commands["items"]
+    hint = items[sess.current_index]["text"] if sess.status == "IN_PROGRESS" and sess.current_index < len(items) else "Проверка завершена"
+    return {
+        "status": sess.status,
+        "current_index": sess.current_index,
+        "hint": hint,
+        "blink_seen": sess.blink_seen
+    }
+
 @router.post("/api/start_liveness")
 async def api_start_liveness(payload: dict, db: AsyncSession = Depends(get_db), terminal=Depends(get_terminal)):
     card_uid = payload.get("card_uid")
@@ -24,7 +44,8 @@ async def api_start_liveness(payload: dict, db: AsyncSession = Depends(get_db),
             "session_id": str(sess.id),
             "commands": items,
             "expires_at": sess.expires_at.isoformat(),
-            "frame_interval_ms": 150
+            "frame_interval_ms": 150,
+            "ws_url": f"/ws/liveness/{sess.id}"
         }
     }
 
@@ -36,25 +57,92 @@ async def api_liveness_frame(
     image: UploadFile = File(...)
 ):
     raw = await image.read()
-    sess = await process_frame(db, session_id, raw)
-    items = sess.commands["items"]
-    hint = items[sess.current_index]["text"] if sess.status == "IN_PROGRESS" and sess.current_index < len(items) else "Проверка завершена"
-    return {
-        "ok": True,
-        "data": {
-            "status": sess.status,
-            "current_index": sess.current_index,
-            "hint": hint,
-            "blink_seen": sess.blink_seen
-        }
-    }
+    sess, dropped = await ingest_frame(db, session_id, raw)
+    # busy: this frame was superseded by a newer one; the client should slow down
+    return {"ok": True, "data": {**frame_status(sess), "busy": dropped}}
+
+@router.websocket("/ws/liveness/{session_id}")
+async def ws_liveness(websocket: WebSocket, session_id: str):
+    # Protocol: the first message is JSON {"token": "<terminal token>"}
+    # (browsers can't set headers on a WebSocket), then every binary message
+    # is one JPEG frame. Each frame is answered with the same payload as
+    # /api/liveness_frame; the server closes the socket when the session ends.
+    await websocket.accept()
+    try:
+        # a malformed id would otherwise fail inside the DB query
+        session_id = str(uuid.UUID(session_id))
+        auth = await asyncio.wait_for(websocket.receive_json(), timeout=WS_AUTH_TIMEOUT_SEC)
+        async with SessionLocal() as db:
+            terminal = await authenticate_terminal(db, auth.get("token") if isinstance(auth, dict) else None)
+            state = await get_session_store().get(session_id) or await load_state(db, session_id)
+        if state.terminal_id != terminal.id:
+            raise AppError("FORBIDDEN", "Сессия принадлежит другому терминалу.", 403)
+    except (asyncio.TimeoutError, ValueError, KeyError):
+        await websocket.close(code=4400)
+        return
+    except AppError as e:
+        await websocket.send_json({"ok": False, "code": e.code, "message": e.message, "details": e.details})
+        await websocket.close(code=4000 + e.http_status)
+        return
+    except WebSocketDisconnect:
+        return
+    await websocket.send_json({"ok": True, "data": frame_status(state)})
+
+    # Frames are read as fast as they arrive and handed to ingest_frame, whose
+    # latest-wins slot drops superseded ones, so no backlog builds up in the
+    # socket while a frame is being analyzed.
+    done = asyncio.Event()
+    handlers: set[asyncio.Task] = set()
+
+    async def send(payload: dict) -> None:
+        try:
+            await websocket.send_json(payload)
+        except (RuntimeError, WebSocketDisconnect):
+            done.set()
+
+    async def handle(raw: bytes) -> None:
+        try:
+            # a session per frame: no pooled connection is held while idle
+            async with SessionLocal() as db:
+                state, dropped = await ingest_frame(db, session_id, raw)
+        except AppError as e:
+            await send({"ok": False, "code": e.code, "message": e.message, "details": e.details})
+            if e.code in SESSION_END_CODES:
+                done.set()
+            return
+        await send({"ok": True, "data": {**frame_status(state), "busy": dropped}})
+        if state.status != "IN_PROGRESS":
+            done.set()
+
+    async def reader() -> None:
+        while not done.is_set():
+            msg = await websocket.receive()
+            if msg["type"] == "websocket.disconnect":
+                return
+            if msg.get("bytes"):
+                t = asyncio.create_task(handle(msg["bytes"]))
+                handlers.add(t)
+                t.add_done_callback(handlers.discard)
+
+    reader_task = asyncio.create_task(reader())
+    done_task = asyncio.create_task(done.wait())
+    await asyncio.wait({reader_task, done_task}, return_when=asyncio.FIRST_COMPLETED)
+    reader_task.cancel()
+    done_task.cancel()
+    # let in-flight frames finish so terminal transitions are persisted
+    await asyncio.gather(*handlers, return_exceptions=True)
+    if done.is_set():
+        try:
+            await websocket.close(code=1000)
+        except RuntimeError:
+            pass
 
 @router.post("/api/finish_liveness")
 async def api_finish_liveness(payload: dict, db: AsyncSession = Depends(get_db), terminal=Depends(get_terminal)):
     session_id = payload.get("session_id")
     if not session_id:
         raise AppError("BAD_REQUEST", "Не указан session_id.")
-    sess = (await db.execute(select(LivenessSession).where(LivenessSession.id == session_id))).scalar_one_or_none()
+    sess = (await db.execute(select(LivenessSession).where(*session_by_id(session_id)))).scalar_one_or_none()
     if not sess:
         raise AppError("LIVENESS_NOT_FOUND", "Сессия liveness не найдена.", 404)
     if sess.terminal_id != terminal.id:
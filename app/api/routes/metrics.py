@@ -0,0 +1,33 @@
+from fastapi import APIRouter, Depends
+
+from app.api.deps import get_terminal
+from app.db.metrics import route_stats
+from app.db.session import pool_stats
+from app.services.calendar import calendar_index
+from app.services.cv_executor import cv_stats
+from app.services.idempotency import idempotency_stats
+from app.services.liveness import ingest_stats
+from app.services.liveness_recorder import recorder_stats
+from app.services.liveness_store import get_session_store
+from app.services.telegram import telegram_stats
+from app.services.terminal_auth import terminal_auth_stats
+
+router = APIRouter()
+
+@router.get("/api/metrics")
+async def metrics(terminal=Depends(get_terminal)):
+    return {
+        "ok": True,
+        "data": {
+            "cv": await cv_stats(),
+            "liveness_store": get_session_store().stats(),
+            "liveness_ingest": ingest_stats(),
+            "liveness_recorder": recorder_stats(),
+            "telegram": telegram_stats(),
+            "pay_idempotency": idempotency_stats(),
+            "calendar": calendar_index.stats(),
+            "terminal_auth": terminal_auth_stats(),
+            "db_pool": pool_stats(),
+            "db_per_route": route_stats.snapshot(),
+        }
+    }
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Header
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 
@@ -7,65 +7,109 @@ from app.core.errors import AppError
 from app.core.security import verify_liveness_token
 from app.db.models import LivenessSession, Transaction
 from app.db.session import get_db
+from app.services import idempotency
 from app.services.finance import pay
-from app.services.telegram import send_telegram_payment_notification
+from app.services.liveness import session_by_id
+from app.services.pay_batch import pay_batch
 
 router = APIRouter()
 
 @router.post("/api/pay")
-async def api_pay(payload: dict, db: AsyncSession = Depends(get_db), terminal=Depends(get_terminal)):
+async def api_pay(
+    payload: dict,
+    db: AsyncSession = Depends(get_db),
+    terminal=Depends(get_terminal),
+    idempotency_key: str | None = Header(default=None)
+):
+    # Idempotency-Key header (or "idempotency_key" in the body): retries with
+    # the same key get the first response back without running pay() again.
+    # The key is checked first, so a retry still gets the stored response after
+    # its liveness token expired or the first attempt consumed the session.
+    key = idempotency.check_key(idempotency_key or payload.get("idempotency_key"))
     card_uid = payload.get("card_uid")
     amount_cents = payload.get("amount_cents")
     token = payload.get("liveness_token")
     if not card_uid or amount_cents is None or not token:
         raise AppError("BAD_REQUEST", "Нужны поля: card_uid, amount_cents, liveness_token.")
+    amount_cents = int(amount_cents)
 
-    claims = verify_liveness_token(token)
-    if claims["tid"] != str(terminal.id):
-        raise AppError("LIVENESS_TOKEN_TERMINAL_MISMATCH", "Токен liveness выдан другому терминалу.", 403)
+    if key:
+        fp = idempotency.fingerprint(card_uid, amount_cents)
+        cached = idempotency.cached_response(terminal.id, key, fp)
+        if cached is not None:
+            return cached
+        stored = await idempotency.claim(db, terminal.id, key, fp)
+        if stored is not None:
+            return stored
 
-    session_id = claims["sid"]
-    sess = (await db.execute(select(LivenessSession).where(LivenessSession.id == session_id))).scalar_one_or_none()
-    if not sess:
-        raise AppError("LIVENESS_NOT_FOUND", "Сессия liveness не найдена.", 404)
-    if sess.terminal_id != terminal.id:
-        raise AppError("FORBIDDEN", "Сессия принадлежит другому терминалу.", 403)
+    try:
+        claims = verify_liveness_token(token)
+        if claims["tid"] != str(terminal.id):
+            raise AppError("LIVENESS_TOKEN_TERMINAL_MISMATCH", "Токен liveness выдан другому терминалу.", 403)
+
+        session_id = claims["sid"]
+        sess = (await db.execute(select(LivenessSession).where(*session_by_id(session_id)))).scalar_one_or_none()
+        if not sess:
+            raise AppError("LIVENESS_NOT_FOUND", "Сессия liveness не найдена.", 404)
+        if sess.terminal_id != terminal.id:
+            raise AppError("FORBIDDEN", "Сессия принадлежит другому терминалу.", 403)
+    except AppError:
+        if key:
+            await idempotency.release(db, terminal.id, key)
+        raise
 
+    # pay() rolls back on a decline, which expires sess: keep what we need
+    employee_id, sess_id = sess.employee_id, sess.id
     try:
-        result = await pay(db, terminal.id, card_uid, int(amount_cents), sess.id)
+        result = await pay(db, terminal.id, card_uid, amount_cents, sess)
     except AppError as e:
         tx = Transaction(
             terminal_id=terminal.id,
-            employee_id=sess.employee_id,
+            employee_id=employee_id,
             card_uid=card_uid,
-            amount_cents=int(amount_cents),
+            amount_cents=amount_cents,
             status="DECLINED",
             decline_code=e.code,
             decline_message=e.message,
-            liveness_session_id=sess.id,
+            liveness_session_id=sess_id,
         )
         db.add(tx)
-        await db.commit()
-        return {"ok": True, "data": {"status": "DECLINED", "code": e.code, "message": e.message}}
+        response = {"ok": True, "data": {"status": "DECLINED", "code": e.code, "message": e.message}}
+        if key:
+            await idempotency.complete(db, terminal.id, key, fp, response)
+        else:
+            await db.commit()
+        return response
 
-    await send_telegram_payment_notification(
-        db,
-        sess.employee_id,
-        int(amount_cents),
-        result.subsidy_spent,
-        result.monthly_spent,
-        result.subsidy_left,
-        result.monthly_left
-    )
-
-    return {
+    response = {
         "ok": True,
         "data": {
             "status": "APPROVED",
-            "amount_cents": int(amount_cents),
+            "amount_cents": amount_cents,
             "subsidy_spent_cents": result.subsidy_spent,
             "monthly_spent_cents": result.monthly_spent,
             "subsidy_today_left_cents": result.subsidy_left,
             "monthly_left_cents": result.monthly_left
         }
     }
+    # the debit is still uncommitted: it commits together with the stored response
+    if key:
+        await idempotency.complete(db, terminal.id, key, fp, response)
+    else:
+        await db.commit()
+    return response
+
+@router.post("/api/pay_batch")
+async def api_pay_batch(
+    payload: dict,
+    db: AsyncSession = Depends(get_db),
+    terminal=Depends(get_terminal),
+    x_terminal_token: str | None = Header(default=None)
+):
+    # Offline queue upload: {"items": [{"id", "card_uid", "amount_cents", "ts", "sig"}, ...]}
+    # with ts in unix seconds and sig = hex HMAC-SHA256 keyed with the terminal
+    # token (app.core.security.offline_payment_signature). One result per item,
+    # in request order; re-uploading returns the same results.
+    results = await pay_batch(db, terminal.id, x_terminal_token, payload.get("items"))
+    approved = sum(1 for r in results if r["status"] == "APPROVED")
+    return {"ok": True, "data": {"items": results, "approved": approved, "declined": len(results) - approved}}
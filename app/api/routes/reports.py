@@ -0,0 +1,15 @@
+from fastapi import APIRouter, Depends
+from fastapi.responses import StreamingResponse
+
+from app.api.deps import require_admin
+from app.services.reports import FORMATS, payroll_export
+
+router = APIRouter(dependencies=[Depends(require_admin)])
+
+@router.get("/api/reports/payroll")
+async def payroll_report(year_month: int, format: str = "csv", detail: bool = False):
+    # per-employee totals of APPROVED meals; detail=true lists every transaction
+    body = payroll_export(year_month, format, detail)
+    name = f"payroll_{year_month}{'_detail' if detail else ''}.{format}"
+    return StreamingResponse(body, media_type=FORMATS[format],
+                             headers={"Content-Disposition": f'attachment; filename="{name}"'})
@@ -13,3 +13,7 @@ class AppError(Exception):
         self.message = message
         self.http_status = http_status
         self.details = details or {}
+
+    def __reduce__(self):
+        # keep AppError intact when it crosses a process boundary (CV workers)
+        return (self.__class__, (self.code, self.message, self.http_status, self.details))
@@ -1,4 +1,5 @@
 import hashlib
+import hmac
 import jwt
 from datetime import datetime, timedelta, timezone
 from app.core.config import settings
@@ -25,3 +26,8 @@ def verify_liveness_token(token: str) -> dict:
         raise AppError("LIVENESS_TOKEN_EXPIRED", "Токен liveness истёк.", 401)
     except jwt.InvalidTokenError:
         raise AppError("LIVENESS_TOKEN_INVALID", "Некорректный токен liveness.", 401)
+
+def offline_payment_signature(terminal_token: str, client_id: str, card_uid: str, amount_cents: int, ts: int) -> str:
+    # HMAC-SHA256 over "client_id|card_uid|amount_cents|ts", keyed with the terminal token
+    msg = f"{client_id}|{card_uid}|{amount_cents}|{ts}".encode("utf-8")
+    return hmac.new(terminal_token.encode("utf-8"), msg, hashlib.sha256).hexdigest()
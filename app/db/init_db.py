@@ -1,15 +1,41 @@
+from datetime import datetime, timezone
 from sqlalchemy import text
+from app.core.config import settings
 from app.db.session import engine
 from app.db.models import Base
+from app.db.partitions import PARTITIONED_TABLES, ensure_monthly_partitions
+from app.services.balances import install_eligibility_triggers
+from app.services.calendar import install_calendar_triggers
 
 async def init_db() -> None:
     async with engine.begin() as conn:
         # pgvector extension (safe if already installed)
         try:
-            await conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector;"))
+            async with conn.begin_nested():
+                await conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector;"))
         except Exception:
             # On some managed PG instances extension may be unavailable.
-            # The app can still run if you change Face.embedding type to FLOAT8[].
+            # The app can still run if you change Face.embedding type to FLOAT8[]
+            # (1:N identification then falls back to the in-process NumPy index).
             pass
 
         await conn.run_sync(Base.metadata.create_all)
+
+        # ANN index for 1:N identification over active templates
+        has_vector = (await conn.execute(text("SELECT 1 FROM pg_extension WHERE extname = 'vector'"))).scalar()
+        if has_vector:
+            await conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_faces_embedding_hnsw ON faces "
+                "USING hnsw (embedding vector_l2_ops) WHERE is_active"
+            ))
+
+        # any holiday/absence write bumps calendar_version (app.services.calendar)
+        await install_calendar_triggers(conn)
+        # ... and clears stored subsidy_eligible flags (app.services.balances)
+        await install_eligibility_triggers(conn)
+
+        # partitioned tables need their current and upcoming partitions before
+        # the first insert; the maintenance job keeps creating them afterwards
+        today = datetime.now(timezone.utc).date()
+        for table in PARTITIONED_TABLES:
+            await ensure_monthly_partitions(conn, table, today, settings.PARTITION_MONTHS_AHEAD)
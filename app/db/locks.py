@@ -0,0 +1,20 @@
+import zlib
+
+from sqlalchemy import text
+
+# Postgres advisory locks for jobs that every API worker schedules (see
+# app.main) but only one should run at a time. Keys are derived from a name.
+
+def lock_key(name: str) -> int:
+    return zlib.crc32(name.encode("utf-8"))
+
+async def try_xact_lock(conn, name: str) -> bool:
+    # held until the current transaction ends; conn is a connection or session
+    return bool((await conn.execute(text("SELECT pg_try_advisory_xact_lock(:k)"), {"k": lock_key(name)})).scalar())
+
+async def try_session_lock(conn, name: str) -> bool:
+    # held until unlock() or the connection closes; for jobs spanning several transactions
+    return bool((await conn.execute(text("SELECT pg_try_advisory_lock(:k)"), {"k": lock_key(name)})).scalar())
+
+async def unlock(conn, name: str) -> None:
+    await conn.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": lock_key(name)})
@@ -0,0 +1,62 @@
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Per-request DB accounting: every statement executed while handling a request
+# adds to that request's QueryStats (a ContextVar set by the middleware in
+# app.main), and finished requests are summed per route for /api/metrics.
+# Used to size DB_POOL_SIZE for the number of terminals and API workers.
+
+@dataclass
+class QueryStats:
+    queries: int = 0
+    db_time_ms: float = 0.0
+
+current_stats: ContextVar[QueryStats | None] = ContextVar("db_query_stats", default=None)
+
+def _before(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+def _after(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["query_start"].pop()
+    stats = current_stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_time_ms += (time.perf_counter() - started) * 1000
+
+def _error(exception_context):
+    starts = exception_context.connection.info.get("query_start") if exception_context.connection else None
+    if starts:
+        starts.pop()
+
+def instrument(engine: Engine) -> None:
+    event.listen(engine, "before_cursor_execute", _before)
+    event.listen(engine, "after_cursor_execute", _after)
+    event.listen(engine, "handle_error", _error)
+
+class RouteStats:
+    def __init__(self):
+        self._routes: dict[str, list[float]] = {}  # route -> [requests, queries, db_ms, max_queries]
+
+    def add(self, route: str, stats: QueryStats) -> None:
+        r = self._routes.setdefault(route, [0, 0, 0.0, 0])
+        r[0] += 1
+        r[1] += stats.queries
+        r[2] += stats.db_time_ms
+        r[3] = max(r[3], stats.queries)
+
+    def snapshot(self) -> dict:
+        return {
+            route: {
+                "requests": n,
+                "queries_per_request": q / n,
+                "max_queries": mx,
+                "db_ms_per_request": ms / n,
+            }
+            for route, (n, q, ms, mx) in sorted(self._routes.items())
+        }
+
+route_stats = RouteStats()
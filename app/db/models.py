@@ -1,7 +1,8 @@
 import uuid
+from datetime import datetime, timezone
 from sqlalchemy import (
     String, Text, Date, DateTime, Boolean, Integer, BigInteger, ForeignKey,
-    CheckConstraint, JSON, func, Float
+    CheckConstraint, Index, JSON, func, Float, text
 )
 from sqlalchemy.dialects.postgresql import UUID, BYTEA
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
@@ -10,6 +11,9 @@ from pgvector.sqlalchemy import Vector
 class Base(DeclarativeBase):
     pass
 
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
 class Employee(Base):
     __tablename__ = "employees"
     id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
@@ -59,6 +63,7 @@ class DailyBalance(Base):
     employee_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), ForeignKey("employees.id", ondelete="CASCADE"), primary_key=True)
     date: Mapped = mapped_column(Date, primary_key=True)
     used_cents: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+    subsidy_eligible: Mapped[bool | None] = mapped_column(Boolean, nullable=True)  # set by app.services.balances; NULL = ask the calendar
 
 class MonthlyBalance(Base):
     __tablename__ = "monthly_balance"
@@ -82,6 +87,12 @@ class CompanyHoliday(Base):
     date: Mapped = mapped_column(Date, primary_key=True)
     title: Mapped[str] = mapped_column(Text, nullable=True)
 
+class CalendarVersion(Base):
+    __tablename__ = "calendar_version"
+    # single row, bumped by trigger on every holiday/absence write (app.services.calendar)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    version: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+
 class EmployeeAbsence(Base):
     __tablename__ = "employee_absences"
     id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
@@ -101,21 +112,28 @@ class LivenessSession(Base):
     baseline_pose: Mapped[dict | None] = mapped_column(JSON, nullable=True)
     anchor_pose: Mapped[dict | None] = mapped_column(JSON, nullable=True)
     fail_reason_code: Mapped[str | None] = mapped_column(String(64), nullable=True)
-    created_at: Mapped = mapped_column(DateTime(timezone=True), server_default=func.now())
+    # partition key, hence part of the primary key
+    created_at: Mapped = mapped_column(DateTime(timezone=True), primary_key=True, default=utcnow, server_default=func.now())
     expires_at: Mapped = mapped_column(DateTime(timezone=True), nullable=False)
     last_seen_at: Mapped = mapped_column(DateTime(timezone=True), nullable=True)
     min_face_dist: Mapped[float | None] = mapped_column(Float, nullable=True)
     blink_seen: Mapped[bool] = mapped_column(Boolean, nullable=False, default=False)
+    track_state: Mapped[dict | None] = mapped_column(JSON, nullable=True)  # {"bbox","geom","age"} between keyframes
     used_at: Mapped = mapped_column(DateTime(timezone=True), nullable=True)
 
+    # Range-partitioned by month on created_at (partitions are managed by
+    # app.db.partitions); retention drops whole partitions.
     __table_args__ = (
         CheckConstraint("status in ('IN_PROGRESS','PASSED','FAILED','EXPIRED','USED')", name="ck_liveness_status"),
+        Index("ix_liveness_in_progress_expires", "expires_at", postgresql_where=text("status = 'IN_PROGRESS'")),
+        {"postgresql_partition_by": "RANGE (created_at)"},
     )
 
 class Transaction(Base):
     __tablename__ = "transactions"
     id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    created_at: Mapped = mapped_column(DateTime(timezone=True), server_default=func.now(), index=True)
+    # partition key, hence part of the primary key
+    created_at: Mapped = mapped_column(DateTime(timezone=True), primary_key=True, default=utcnow, server_default=func.now(), index=True)
     terminal_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), ForeignKey("terminals.id", ondelete="RESTRICT"))
     employee_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), ForeignKey("employees.id", ondelete="RESTRICT"), index=True)
 
@@ -129,4 +147,38 @@ class Transaction(Base):
     liveness_session_id: Mapped[uuid.UUID | None] = mapped_column(UUID(as_uuid=True), nullable=True)
     meta: Mapped[dict] = mapped_column(JSON, nullable=False, default=dict)
 
-    __table_args__ = (CheckConstraint("status in ('APPROVED','DECLINED')", name="ck_tx_status"),)
+    __table_args__ = (
+        CheckConstraint("status in ('APPROVED','DECLINED')", name="ck_tx_status"),
+        # monthly partitions, closed months archived to disk (app.services.tx_archive)
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
+
+class PaymentIdempotency(Base):
+    __tablename__ = "payment_idempotency"
+    # one row per (terminal, Idempotency-Key) of /api/pay, see app.services.idempotency
+    terminal_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), ForeignKey("terminals.id", ondelete="CASCADE"), primary_key=True)
+    key: Mapped[str] = mapped_column(String(128), primary_key=True)
+    status: Mapped[str] = mapped_column(String(16), nullable=False, default="IN_PROGRESS")  # IN_PROGRESS/DONE
+    fingerprint: Mapped[str | None] = mapped_column(String(64), nullable=True)  # sha256 of the request payload
+    response: Mapped[dict | None] = mapped_column(JSON, nullable=True)
+    created_at: Mapped = mapped_column(DateTime(timezone=True), nullable=False, default=utcnow, index=True)
+
+    __table_args__ = (CheckConstraint("status in ('IN_PROGRESS','DONE')", name="ck_idempotency_status"),)
+
+class NotificationOutbox(Base):
+    __tablename__ = "notification_outbox"
+    # written in the payment transaction, delivered by app.services.telegram
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
+    created_at: Mapped = mapped_column(DateTime(timezone=True), server_default=func.now())
+    chat_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    text: Mapped[str] = mapped_column(Text, nullable=False)
+    status: Mapped[str] = mapped_column(String(16), nullable=False, default="PENDING")  # PENDING/SENT/FAILED
+    attempts: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    next_attempt_at: Mapped = mapped_column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    last_error: Mapped[str | None] = mapped_column(Text, nullable=True)
+    sent_at: Mapped = mapped_column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        CheckConstraint("status in ('PENDING','SENT','FAILED')", name="ck_outbox_status"),
+        Index("ix_outbox_pending_next", "next_attempt_at", postgresql_where=text("status = 'PENDING'")),
+    )
@@ -0,0 +1,114 @@
+import logging
+import re
+from datetime import date
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+log = logging.getLogger(__name__)
+
+# Monthly range partitions on a timestamptz column, named <table>_YYYYMM.
+# Bounds are UTC month starts. Retention drops whole partitions (DETACH + DROP
+# is O(1) and leaves no dead tuples behind), instead of a huge DELETE. A
+# <table>_default partition is a safety net only; it should stay empty.
+
+PARTITIONED_TABLES = ("liveness_sessions", "transactions")
+
+def month_start(d: date) -> date:
+    return d.replace(day=1)
+
+def add_months(d: date, n: int) -> date:
+    y, m = divmod(d.year * 12 + d.month - 1 + n, 12)
+    return date(y, m + 1, 1)
+
+def partition_name(table: str, month: date) -> str:
+    return f"{table}_{month:%Y%m}"
+
+async def is_partitioned(conn: AsyncConnection, table: str) -> bool:
+    kind = (await conn.execute(text("SELECT relkind FROM pg_class WHERE relname = :t"), {"t": table})).scalar()
+    return kind == "p"
+
+async def list_partitions(conn: AsyncConnection, table: str) -> list[tuple[str, date]]:
+    rows = (await conn.execute(text(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+        "WHERE p.relname = :t"
+    ), {"t": table})).scalars().all()
+    out = []
+    for name in rows:
+        m = re.fullmatch(re.escape(table) + r"_(\d{4})(\d{2})", name)
+        if m:
+            out.append((name, date(int(m.group(1)), int(m.group(2)), 1)))
+    return sorted(out, key=lambda p: p[1])
+
+def default_partition(table: str) -> str:
+    return f"{table}_default"
+
+async def ensure_monthly_partitions(conn: AsyncConnection, table: str, today: date, months_ahead: int) -> list[str]:
+    # Creates the current and the next months_ahead partitions, plus a DEFAULT
+    # partition that catches inserts if maintenance ever falls behind. Months
+    # found in the DEFAULT partition get their own partition on the next run.
+    if not await is_partitioned(conn, table):
+        log.warning("%s is not a partitioned table; skipping partition maintenance "
+                    "(convert it with: python -m scripts.partition_table %s)", table, table)
+        return []
+    default = default_partition(table)
+    await conn.execute(text(f"CREATE TABLE IF NOT EXISTS {default} PARTITION OF {table} DEFAULT"))
+    stray = [
+        r.date() for r in (await conn.execute(text(
+            f"SELECT DISTINCT date_trunc('month', created_at AT TIME ZONE 'UTC') FROM {default}"
+        ))).scalars()
+    ]
+    if stray:
+        log.warning("%s: rows for %s in %s, partition maintenance fell behind", table, stray, default)
+
+    months = {add_months(month_start(today), i) for i in range(months_ahead + 1)} | set(stray)
+    existing = {name for name, _ in await list_partitions(conn, table)}
+    created = []
+    for lo in sorted(months):
+        name = partition_name(table, lo)
+        if name in existing:
+            continue
+        await _create_partition(conn, table, name, lo, add_months(lo, 1), lo in stray)
+        created.append(name)
+    return created
+
+async def create_month_partition(conn: AsyncConnection, table: str, lo: date) -> str:
+    # one empty partition for the month starting at lo (no-op if it exists)
+    name = partition_name(table, lo)
+    await _create_partition(conn, table, name, lo, add_months(lo, 1), False)
+    return name
+
+async def _create_partition(conn: AsyncConnection, table: str, name: str, lo: date, hi: date, from_default: bool) -> None:
+    bounds = f"FROM ('{lo.isoformat()} 00:00:00+00') TO ('{hi.isoformat()} 00:00:00+00')"
+    if not from_default:
+        await conn.execute(text(f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table} FOR VALUES {bounds}"))
+        return
+    # CREATE ... PARTITION OF fails while the DEFAULT partition holds rows of
+    # that range: build the table, move the rows over, then attach it
+    # (ATTACH creates the partitioned indexes and the primary key)
+    default = default_partition(table)
+    await conn.execute(text(f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+    await conn.execute(text(
+        f"WITH moved AS (DELETE FROM {default} "
+        f"WHERE created_at >= '{lo.isoformat()} 00:00:00+00' AND created_at < '{hi.isoformat()} 00:00:00+00' "
+        f"RETURNING *) INSERT INTO {name} SELECT * FROM moved"
+    ))
+    await conn.execute(text(f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES {bounds}"))
+
+async def drop_partitions_before(conn: AsyncConnection, table: str, cutoff: date) -> list[str]:
+    # drops partitions whose whole month lies before cutoff (a month start)
+    if not await is_partitioned(conn, table):
+        return []
+    dropped = []
+    for name, month in await closed_partitions_before(conn, table, cutoff):
+        await drop_partition(conn, table, name)
+        dropped.append(name)
+    return dropped
+
+async def closed_partitions_before(conn: AsyncConnection, table: str, cutoff: date) -> list[tuple[str, date]]:
+    return [(name, month) for name, month in await list_partitions(conn, table) if add_months(month, 1) <= cutoff]
+
+async def drop_partition(conn: AsyncConnection, table: str, name: str) -> None:
+    await conn.execute(text(f"ALTER TABLE {table} DETACH PARTITION {name}"))
+    await conn.execute(text(f"DROP TABLE {name}"))
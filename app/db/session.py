@@ -1,9 +1,55 @@
+import uuid
+
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from app.core.config import settings
+from app.db.metrics import instrument
+
+def _connect_args() -> dict:
+    if settings.DB_PGBOUNCER:
+        # PgBouncer transaction mode: a prepared statement may land on another
+        # server connection, so asyncpg must not cache or reuse named ones
+        return {
+            "statement_cache_size": 0,
+            "prepared_statement_cache_size": 0,
+            "prepared_statement_name_func": lambda: f"__asyncpg_{uuid.uuid4()}__",
+        }
+    return {"prepared_statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE}
 
-engine = create_async_engine(settings.DATABASE_URL, echo=False, pool_pre_ping=True)
+def _make_engine(url: str):
+    engine = create_async_engine(
+        url,
+        echo=False,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT_SEC,
+        pool_recycle=settings.DB_POOL_RECYCLE_SEC,
+        # "always" pings on every checkout (one extra round trip); "off" relies
+        # on pool_recycle and on invalidating connections that fail mid-use
+        pool_pre_ping=settings.DB_PRE_PING == "always",
+        connect_args=_connect_args(),
+    )
+    instrument(engine.sync_engine)
+    return engine
+
+engine = _make_engine(settings.DATABASE_URL)
 SessionLocal = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
 
+# Optional read replica for read-mostly paths (employee_info, reports); falls
+# back to the primary. Replica lag only affects displayed balances: payments
+# always read and write on the primary.
+read_engine = _make_engine(settings.DATABASE_READ_URL) if settings.DATABASE_READ_URL else engine
+ReadSessionLocal = async_sessionmaker(read_engine, expire_on_commit=False, class_=AsyncSession)
+
 async def get_db() -> AsyncSession:
     async with SessionLocal() as session:
         yield session
+
+async def get_read_db() -> AsyncSession:
+    async with ReadSessionLocal() as session:
+        yield session
+
+def pool_stats() -> dict:
+    out = {"primary": engine.pool.status()}
+    if read_engine is not engine:
+        out["replica"] = read_engine.pool.status()
+    return out
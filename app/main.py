@@ -2,14 +2,26 @@ from fastapi import FastAPI, Request
 from fastapi.responses import JSONResponse
 from fastapi.staticfiles import StaticFiles
 
+from app.core.config import settings
 from app.core.errors import AppError
 from app.core.logging import setup_logging
 from app.db.init_db import init_db
+from app.db.metrics import QueryStats, current_stats, route_stats
+from app.services.background import start_periodic, stop_background_tasks
+from app.services.balances import materialize_balances
+from app.services.cv_executor import start_cv_executor, shutdown_cv_executor
+from app.services.liveness_recorder import close_recorder
+from app.services.maintenance import maintain_partitions, purge_expired_rows, reap_expired_sessions
+from app.services.telegram import close_telegram_client, dispatch_outbox
 
 from app.api.routes.employee import router as employee_router
 from app.api.routes.liveness import router as liveness_router
 from app.api.routes.pay import router as pay_router
 from app.api.routes.enrollment import router as enrollment_router
+from app.api.routes.metrics import router as metrics_router
+from app.api.routes.identify import router as identify_router
+from app.api.routes.admin import router as admin_router
+from app.api.routes.reports import router as reports_router
 
 setup_logging()
 
@@ -18,6 +30,36 @@ app = FastAPI(title="Meal Subsidy Control")
 @app.on_event("startup")
 async def on_startup():
     await init_db()
+    start_cv_executor()
+    start_periodic("liveness_reaper", settings.LIVENESS_REAPER_INTERVAL_SEC, reap_expired_sessions)
+    start_periodic("partitions", settings.MAINTENANCE_INTERVAL_SEC, maintain_partitions)
+    start_periodic("telegram_outbox", settings.TELEGRAM_DISPATCH_INTERVAL_SEC, dispatch_outbox)
+    start_periodic("balance_rows", settings.BALANCE_MATERIALIZE_INTERVAL_SEC, materialize_balances)
+    start_periodic("row_purge", settings.MAINTENANCE_INTERVAL_SEC, purge_expired_rows)
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await stop_background_tasks()
+    await close_telegram_client()
+    await close_recorder()
+    shutdown_cv_executor()
+
+@app.middleware("http")
+async def db_query_stats(request: Request, call_next):
+    stats = QueryStats()
+    token = current_stats.set(stats)
+    try:
+        response = await call_next(request)
+    finally:
+        current_stats.reset(token)
+    # a streamed body runs after this point and counts its own queries
+    # (app.services.reports._stream)
+    route = request.scope.get("route")
+    route_stats.add(getattr(route, "path", "other"), stats)
+    if settings.DB_QUERY_STATS_HEADERS:
+        response.headers["X-DB-Queries"] = str(stats.queries)
+        response.headers["X-DB-Time-Ms"] = f"{stats.db_time_ms:.1f}"
+    return response
 
 @app.exception_handler(AppError)
 async def app_error_handler(request: Request, exc: AppError):
@@ -30,5 +72,9 @@ app.include_router(employee_router)
 app.include_router(liveness_router)
 app.include_router(pay_router)
 app.include_router(enrollment_router)
+app.include_router(metrics_router)
+app.include_router(identify_router)
+app.include_router(admin_router)
+app.include_router(reports_router)
 
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
@@ -0,0 +1,25 @@
+import asyncio
+import logging
+
+log = logging.getLogger(__name__)
+
+# Periodic jobs running inside the API process (started from app.main).
+_tasks: list[asyncio.Task] = []
+
+def start_periodic(name: str, interval_sec: float, job) -> None:
+    async def loop():
+        while True:
+            try:
+                await job()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception("background job %s failed", name)
+            await asyncio.sleep(interval_sec)
+    _tasks.append(asyncio.create_task(loop(), name=name))
+
+async def stop_background_tasks() -> None:
+    for t in _tasks:
+        t.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
+    _tasks.clear()
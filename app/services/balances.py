@@ -0,0 +1,112 @@
+import logging
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+
+from app.core.config import settings
+from app.db.locks import try_xact_lock
+from app.db.session import SessionLocal
+from app.services.finance import year_month
+
+log = logging.getLogger(__name__)
+
+# Balance rows are created ahead of time so the lunch rush only updates
+# existing rows: daily_balance for every active employee with the day's
+# subsidy eligibility stored, monthly_balance with limit_cents snapshotted
+# from the employee. pay() still upserts, so a missing row (new employee,
+# job not run yet) only costs the old insert path. Stored flags are
+# recomputed on every run, and cleared by triggers as soon as a holiday,
+# absence, employee_type or status changes (ELIGIBILITY_TRIGGERS); pay()
+# falls back to the calendar index for a NULL flag.
+
+# WORKER, company workday (Mon-Fri, not a holiday), not absent; the same rule
+# as finance.subsidy_eligible. Employee status is checked by pay() itself.
+DAILY_SQL = text("""
+INSERT INTO daily_balance AS b (employee_id, date, used_cents, subsidy_eligible)
+SELECT e.id, :day, 0,
+       e.employee_type = 'WORKER'
+       AND extract(isodow FROM CAST(:day AS date)) < 6
+       AND NOT EXISTS (SELECT 1 FROM company_holidays h WHERE h.date = :day)
+       AND NOT EXISTS (SELECT 1 FROM employee_absences a
+                       WHERE a.employee_id = e.id AND a.date_from <= :day AND a.date_to >= :day)
+FROM employees e
+WHERE e.status = 'ACTIVE'
+ON CONFLICT (employee_id, date) DO UPDATE
+    SET subsidy_eligible = EXCLUDED.subsidy_eligible
+    WHERE b.subsidy_eligible IS DISTINCT FROM EXCLUDED.subsidy_eligible
+""")
+
+MONTHLY_SQL = text("""
+INSERT INTO monthly_balance (employee_id, year_month, limit_cents, used_cents)
+SELECT e.id, :ym, e.monthly_limit_cents, 0
+FROM employees e
+WHERE e.status = 'ACTIVE'
+ON CONFLICT (employee_id, year_month) DO NOTHING
+""")
+
+# Flags from yesterday on (APP_TZ may be ahead of the server's current_date)
+# are cleared in the transaction that changes an input of the rule.
+ELIGIBILITY_TRIGGER_FUNCTIONS = [
+    """
+    CREATE OR REPLACE FUNCTION calendar_eligibility_reset() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        UPDATE daily_balance SET subsidy_eligible = NULL
+        WHERE date >= current_date - 1 AND subsidy_eligible IS NOT NULL;
+        RETURN NULL;
+    END $$
+    """,
+    """
+    CREATE OR REPLACE FUNCTION employee_eligibility_reset() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        UPDATE daily_balance SET subsidy_eligible = NULL
+        WHERE employee_id = NEW.id AND date >= current_date - 1 AND subsidy_eligible IS NOT NULL;
+        RETURN NULL;
+    END $$
+    """,
+]
+ELIGIBILITY_TRIGGERS = {
+    "company_holidays_eligibility_reset": (
+        "company_holidays",
+        "AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON company_holidays "
+        "FOR EACH STATEMENT EXECUTE FUNCTION calendar_eligibility_reset()",
+    ),
+    "employee_absences_eligibility_reset": (
+        "employee_absences",
+        "AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON employee_absences "
+        "FOR EACH STATEMENT EXECUTE FUNCTION calendar_eligibility_reset()",
+    ),
+    "employees_eligibility_reset": (
+        "employees",
+        "AFTER UPDATE OF employee_type, status ON employees FOR EACH ROW "
+        "WHEN (OLD.employee_type IS DISTINCT FROM NEW.employee_type OR OLD.status IS DISTINCT FROM NEW.status) "
+        "EXECUTE FUNCTION employee_eligibility_reset()",
+    ),
+}
+
+async def install_eligibility_triggers(conn: AsyncConnection) -> None:
+    for ddl in ELIGIBILITY_TRIGGER_FUNCTIONS:
+        await conn.execute(text(ddl))
+    for name, (table, spec) in ELIGIBILITY_TRIGGERS.items():
+        await conn.execute(text(f"DROP TRIGGER IF EXISTS {name} ON {table}"))
+        await conn.execute(text(f"CREATE TRIGGER {name} {spec}"))
+
+async def materialize_day(db: AsyncSession, day: date) -> tuple[int, int]:
+    # idempotent: existing rows keep their used_cents; flags are recomputed
+    daily = (await db.execute(DAILY_SQL, {"day": day})).rowcount
+    monthly = (await db.execute(MONTHLY_SQL, {"ym": year_month(day)})).rowcount
+    return daily, monthly
+
+async def materialize_balances() -> None:
+    # today and tomorrow, so rows exist before the first meal after midnight;
+    # one API worker at a time (the others skip this round)
+    today = datetime.now(tz=ZoneInfo(settings.APP_TZ)).date()
+    async with SessionLocal() as db:
+        if not await try_xact_lock(db, "balance_rows"):
+            return
+        for day in (today, today + timedelta(days=1)):
+            daily, monthly = await materialize_day(db, day)
+            if daily or monthly:
+                log.info("balances for %s: daily=%d monthly=%d", day, daily, monthly)
+        await db.commit()
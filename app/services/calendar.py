@@ -1,27 +1,114 @@
+import time
+from bisect import bisect_right
 from datetime import date
-from sqlalchemy import select, and_
-from sqlalchemy.ext.asyncio import AsyncSession
-from app.db.models import CompanyHoliday, EmployeeAbsence
+
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+
+from app.core.config import settings
+from app.db.models import CalendarVersion, CompanyHoliday, EmployeeAbsence
+
+class CalendarIndex:
+    # Holidays and employee absences, kept in memory so eligibility checks
+    # (employee_info, every pay) cost no DB round trip. Holidays are a set;
+    # each employee's absences are merged into disjoint sorted intervals and
+    # searched with bisect. Every write to either table bumps calendar_version
+    # through a trigger (CALENDAR_TRIGGERS), whoever makes it: admin API, SQL,
+    # import scripts. The index compares the version at most every
+    # CALENDAR_REFRESH_SEC and, when it moved, rebuilds itself from scratch
+    # (both tables are small; there is no incremental update).
+    def __init__(self):
+        self.holidays: set[date] = set()
+        self.absences: dict[object, tuple[list[date], list[date]]] = {}
+        self.version: int | None = None
+        self.checked_at: float | None = None
+        self.reloads = 0
+
+    def needs_check(self) -> bool:
+        return self.checked_at is None or time.monotonic() - self.checked_at > settings.CALENDAR_REFRESH_SEC
+
+    def invalidate(self) -> None:
+        self.version = None
+        self.checked_at = None
+
+    async def refresh(self, db: AsyncSession) -> None:
+        version = (await db.execute(select(CalendarVersion.version).where(CalendarVersion.id == 1))).scalar_one_or_none() or 0
+        self.checked_at = time.monotonic()
+        if version == self.version:
+            return
+        holidays = (await db.execute(select(CompanyHoliday.date))).scalars().all()
+        rows = (await db.execute(
+            select(EmployeeAbsence.employee_id, EmployeeAbsence.date_from, EmployeeAbsence.date_to)
+            .order_by(EmployeeAbsence.employee_id, EmployeeAbsence.date_from)
+        )).all()
+        absences: dict[object, tuple[list[date], list[date]]] = {}
+        for emp_id, d_from, d_to in rows:
+            starts, ends = absences.setdefault(emp_id, ([], []))
+            if ends and d_from <= ends[-1]:
+                ends[-1] = max(ends[-1], d_to)  # overlapping with the previous interval
+            else:
+                starts.append(d_from)
+                ends.append(d_to)
+        self.holidays = set(holidays)
+        self.absences = absences
+        self.version = version
+        self.reloads += 1
+
+    def is_company_workday(self, d: date) -> bool:
+        # default Mon-Fri, excluding company_holidays
+        return d.weekday() < 5 and d not in self.holidays
+
+    def is_employee_working(self, employee_id, d: date) -> bool:
+        item = self.absences.get(employee_id)
+        if not item:
+            return True
+        starts, ends = item
+        i = bisect_right(starts, d) - 1
+        return not (i >= 0 and ends[i] >= d)
+
+    def stats(self) -> dict:
+        return {
+            "version": self.version,
+            "holidays": len(self.holidays),
+            "employees_with_absences": len(self.absences),
+            "reloads": self.reloads,
+        }
+
+calendar_index = CalendarIndex()
+
+async def get_calendar(db: AsyncSession) -> CalendarIndex:
+    if calendar_index.needs_check():
+        await calendar_index.refresh(db)
+    return calendar_index
+
+# Statement-level triggers: the version moves in the writing transaction, so
+# an index that sees the new version also sees the new rows.
+CALENDAR_TABLES = ("company_holidays", "employee_absences")
+CALENDAR_TRIGGER_FUNCTION = """
+CREATE OR REPLACE FUNCTION calendar_changed() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    INSERT INTO calendar_version (id, version) VALUES (1, 1)
+    ON CONFLICT (id) DO UPDATE SET version = calendar_version.version + 1;
+    RETURN NULL;
+END $$
+"""
+
+async def install_calendar_triggers(conn: AsyncConnection) -> None:
+    await conn.execute(text(CALENDAR_TRIGGER_FUNCTION))
+    for table in CALENDAR_TABLES:
+        await conn.execute(text(f"DROP TRIGGER IF EXISTS {table}_calendar_changed ON {table}"))
+        await conn.execute(text(
+            f"CREATE TRIGGER {table}_calendar_changed "
+            f"AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table} "
+            f"FOR EACH STATEMENT EXECUTE FUNCTION calendar_changed()"
+        ))
+
+def invalidate_calendar() -> None:
+    # this process reloads on next use; other API workers within CALENDAR_REFRESH_SEC
+    calendar_index.invalidate()
 
 async def is_company_workday(db: AsyncSession, d: date) -> bool:
-    # default Mon-Fri, excluding company_holidays
-    if d.weekday() >= 5:
-        return False
-    res = await db.execute(select(CompanyHoliday).where(CompanyHoliday.date == d))
-    if res.scalar_one_or_none():
-        return False
-    return True
+    return (await get_calendar(db)).is_company_workday(d)
 
 async def is_employee_working(db: AsyncSession, employee_id, d: date) -> bool:
-    res = await db.execute(
-        select(EmployeeAbsence).where(
-            and_(
-                EmployeeAbsence.employee_id == employee_id,
-                EmployeeAbsence.date_from <= d,
-                EmployeeAbsence.date_to >= d
-            )
-        )
-    )
-    if res.scalar_one_or_none():
-        return False
-    return True
+    return (await get_calendar(db)).is_employee_working(employee_id, d)
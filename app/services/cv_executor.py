@@ -0,0 +1,109 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from app.core.config import settings
+from app.core.errors import AppError
+from app.services import face
+
+log = logging.getLogger(__name__)
+
+# Face detection/encoding and FaceMesh are CPU-bound (hundreds of ms per frame),
+# so they run in worker processes and the event loop only awaits the result.
+# Each worker is its own single-process pool ("shard"): tasks with a key (the
+# liveness session id) always land on the same worker, where that session's
+# FaceMesh tracker lives; keyless tasks go to the least loaded worker.
+_shards: list[ProcessPoolExecutor | None] = []
+_shard_pending: list[int] = []
+_pending = 0
+
+def cv_workers() -> int:
+    return settings.CV_WORKERS or os.cpu_count() or 1
+
+def _new_shard() -> ProcessPoolExecutor:
+    ctx = multiprocessing.get_context(settings.CV_MP_START_METHOD)
+    return ProcessPoolExecutor(max_workers=1, mp_context=ctx, initializer=face.init_worker)
+
+def start_cv_executor() -> None:
+    if not _shards:
+        n = cv_workers()
+        _shards.extend(_new_shard() for _ in range(n))
+        _shard_pending.extend(0 for _ in range(n))
+        log.info("CV executor started: %d workers", n)
+
+def shutdown_cv_executor(wait: bool = True) -> None:
+    for ex in _shards:
+        if ex is not None:
+            ex.shutdown(wait=wait, cancel_futures=True)
+    _shards.clear()
+    _shard_pending.clear()
+
+def _pick_shard(key) -> int:
+    if key is not None:
+        return zlib.crc32(str(key).encode("utf-8")) % len(_shards)
+    return min(range(len(_shards)), key=_shard_pending.__getitem__)
+
+def _release(i: int) -> None:
+    global _pending
+    _pending -= 1
+    if i < len(_shard_pending):
+        _shard_pending[i] -= 1
+
+async def run_cv(fn, *args, key=None):
+    global _pending
+    if _pending >= settings.CV_MAX_PENDING:
+        raise AppError("CV_BUSY", "Сервер перегружен. Повторите попытку.", 503)
+    start_cv_executor()
+    i = _pick_shard(key)
+    if _shards[i] is None:
+        _shards[i] = _new_shard()
+    executor = _shards[i]
+    loop = asyncio.get_running_loop()
+    _pending += 1
+    _shard_pending[i] += 1
+    try:
+        try:
+            fut = executor.submit(fn, *args)
+        except BrokenProcessPool:
+            _release(i)
+            raise
+        # released when the worker is really done, not when the caller gives
+        # up: a timed-out frame still occupies its worker until it finishes
+        fut.add_done_callback(lambda _: _call_soon(loop, _release, i))
+        return await asyncio.wait_for(asyncio.wrap_future(fut), timeout=settings.CV_TASK_TIMEOUT_SEC)
+    except asyncio.TimeoutError:
+        raise AppError("CV_TIMEOUT", "Обработка изображения заняла слишком много времени.", 504)
+    except BrokenProcessPool:
+        # the worker died (e.g. native crash in dlib); replace it on the next call
+        log.exception("CV worker %d broken, restarting", i)
+        if _shards[i] is executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+            _shards[i] = None
+        raise AppError("CV_UNAVAILABLE", "Сервис распознавания временно недоступен.", 503)
+
+def _call_soon(loop, fn, *args) -> None:
+    # done-callbacks run in the executor's management thread
+    try:
+        loop.call_soon_threadsafe(fn, *args)
+    except RuntimeError:  # loop already closed (shutdown)
+        pass
+
+async def cv_stats() -> dict:
+    start_cv_executor()
+    loop = asyncio.get_running_loop()
+    workers = []
+    for i, ex in enumerate(_shards):
+        if ex is None:
+            workers.append({"worker": i, "alive": False})
+            continue
+        try:
+            st = await asyncio.wait_for(loop.run_in_executor(ex, face.worker_stats), timeout=settings.CV_TASK_TIMEOUT_SEC)
+        except Exception:
+            workers.append({"worker": i, "alive": False})
+            continue
+        workers.append({"worker": i, "alive": True, "pending": _shard_pending[i], **st})
+    return {"pending": _pending, "max_pending": settings.CV_MAX_PENDING, "workers": workers}
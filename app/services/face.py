@@ -1,3 +1,8 @@
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
 import numpy as np
 import cv2
 import mediapipe as mp
@@ -5,30 +10,133 @@ import face_recognition
 from app.core.config import settings
 from app.core.errors import AppError
 
-mp_face_mesh = mp.solutions.face_mesh.FaceMesh(static_image_mode=False, max_num_faces=2, refine_landmarks=True)
+# Models are created lazily: the API process only dispatches work, CV workers
+# build their own instances in init_worker().
+_face_mesh = None
+
+def _new_face_mesh(static_image_mode: bool):
+    return mp.solutions.face_mesh.FaceMesh(static_image_mode=static_image_mode, max_num_faces=2, refine_landmarks=True)
+
+class FaceMeshPool:
+    # FaceMesh in tracking mode keeps per-video state (the previous frame's
+    # landmarks seed the next search), so every liveness session gets its own
+    # instance. Idle instances die with their session (TTL) and the pool is
+    # capped, evicting the least recently used session first.
+    def __init__(self, max_size: int, ttl_sec: float):
+        self.max_size = max_size
+        self.ttl_sec = ttl_sec
+        self._items: OrderedDict[str, tuple[object, float]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _drop(self, key: str) -> None:
+        mesh, _ = self._items.pop(key)
+        mesh.close()
+
+    def get(self, key: str):
+        now = time.monotonic()
+        while self._items:
+            oldest, (_, last_used) = next(iter(self._items.items()))
+            if now - last_used < self.ttl_sec:
+                break
+            self._drop(oldest)
+            self.expirations += 1
+        item = self._items.pop(key, None)
+        if item is not None:
+            self.hits += 1
+            mesh = item[0]
+        else:
+            self.misses += 1
+            while len(self._items) >= self.max_size:
+                self._drop(next(iter(self._items)))
+                self.evictions += 1
+            mesh = _new_face_mesh(static_image_mode=False)
+        self._items[key] = (mesh, now)
+        return mesh
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._items),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+_mesh_pool = FaceMeshPool(settings.CV_FACEMESH_POOL_SIZE, settings.LIVENESS_SESSION_TTL_SEC)
+
+def get_face_mesh(session_key: str | None = None):
+    # frames without a session are unrelated stills: no tracking state to keep
+    global _face_mesh
+    if session_key is not None:
+        return _mesh_pool.get(session_key)
+    if _face_mesh is None:
+        _face_mesh = _new_face_mesh(static_image_mode=True)
+    return _face_mesh
+
+def init_worker() -> None:
+    # one worker process = one core; don't let OpenCV spawn its own thread pool on top
+    cv2.setNumThreads(1)
+    get_face_mesh()
+
+def worker_stats() -> dict:
+    return {"pid": os.getpid(), "facemesh_pool": _mesh_pool.stats()}
+
+# cv2.imdecode can scale JPEGs down during DCT decoding, which is far cheaper
+# than decoding at full size and resizing afterwards.
+_DECODE_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
 
-def decode_image(file_bytes: bytes) -> np.ndarray:
+def decode_image(file_bytes: bytes, scale: int = 1) -> np.ndarray:
+    # scale is one of _DECODE_FLAGS (the settings are validated in app.core.config)
     arr = np.frombuffer(file_bytes, dtype=np.uint8)
-    bgr = cv2.imdecode(arr, cv2.IMREAD_COLOR)
+    bgr = cv2.imdecode(arr, _DECODE_FLAGS[scale])
     if bgr is None:
         raise AppError("BAD_IMAGE", "Не удалось декодировать изображение.")
     return bgr
 
-def image_quality_checks(bgr: np.ndarray, bbox_ltrb) -> None:
+def image_quality_checks(bgr: np.ndarray, bbox_ltrb, scale: float = 1) -> None:
+    # Runs on the face ROI only and before the encoder, so dark or blurry
+    # frames are rejected in a few milliseconds. FACE_MIN_SHARPNESS is
+    # calibrated at native resolution; a 1/scale decode raises the Laplacian
+    # response of the same face by about scale**2, so the threshold follows.
     left, top, right, bottom = bbox_ltrb
     h, w = bgr.shape[:2]
     area = max(0, right-left) * max(0, bottom-top)
     if area < (w*h)*0.05:
         raise AppError("FACE_TOO_SMALL", "Подойдите ближе к камере.")
-    gray = cv2.cvtColor(bgr, cv2.COLOR_BGR2GRAY)
+    gray = cv2.cvtColor(bgr[top:bottom, left:right], cv2.COLOR_BGR2GRAY)
     mean = float(np.mean(gray))
-    if mean < 35:
+    if mean < settings.FACE_MIN_BRIGHTNESS:
         raise AppError("LOW_LIGHT", "Слишком темно. Улучшите освещение.")
     blur = float(cv2.Laplacian(gray, cv2.CV_64F).var())
-    if blur < 60:
+    if blur < settings.FACE_MIN_SHARPNESS * scale * scale:
         raise AppError("BLURRY", "Изображение размыто. Не двигайтесь и повторите.")
 
-def detect_single_face_and_encoding(bgr: np.ndarray):
+def encode_face(bgr: np.ndarray, bbox_ltrb, native: np.ndarray | None = None) -> np.ndarray:
+    # bbox is in bgr coordinates. When bgr was decoded at reduced scale, the
+    # face is cropped from the native-resolution frame instead; the crop keeps
+    # a margin so the encoder's aligner still sees the whole face.
+    src = bgr if native is None else native
+    k = src.shape[1] / bgr.shape[1]
+    left, top, right, bottom = (int(round(v * k)) for v in bbox_ltrb)
+    mx, my = (right - left) // 2, (bottom - top) // 2
+    h, w = src.shape[:2]
+    x0, y0, x1, y1 = max(0, left - mx), max(0, top - my), min(w, right + mx), min(h, bottom + my)
+    roi = cv2.cvtColor(src[y0:y1, x0:x1], cv2.COLOR_BGR2RGB)
+    encs = face_recognition.face_encodings(roi, known_face_locations=[(top - y0, right - x0, bottom - y0, left - x0)])
+    if not encs:
+        raise AppError("NO_FACE_ENCODING", "Не удалось построить биометрический шаблон.")
+    return encs[0].astype(np.float32)
+
+def detect_single_face_and_encoding(bgr: np.ndarray, native: np.ndarray | None = None):
     rgb = cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
     locs = face_recognition.face_locations(rgb, model="hog")
     if len(locs) == 0:
@@ -36,38 +144,61 @@ def detect_single_face_and_encoding(bgr: np.ndarray):
     if len(locs) > 1:
         raise AppError("MULTIPLE_FACES", "В кадре несколько лиц. Останьтесь один в кадре.")
     (top, right, bottom, left) = locs[0]
-    image_quality_checks(bgr, (left, top, right, bottom))
-    encs = face_recognition.face_encodings(rgb, known_face_locations=locs)
-    if not encs:
-        raise AppError("NO_FACE_ENCODING", "Не удалось построить биометрический шаблон.")
-    return (left, top, right, bottom), encs[0].astype(np.float32)
+    scale = native.shape[1] / bgr.shape[1] if native is not None else 1
+    image_quality_checks(bgr, (left, top, right, bottom), scale)
+    return (left, top, right, bottom), encode_face(bgr, (left, top, right, bottom), native)
 
 def l2_dist(a: np.ndarray, b: np.ndarray) -> float:
     return float(np.linalg.norm(a - b))
 
-def estimate_pose_and_blink(bgr: np.ndarray):
-    rgb = cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
-    res = mp_face_mesh.process(rgb)
+# FaceMesh landmark indices: solvePnP anchors (nose tip, chin, eye corners,
+# mouth corners), eye contours for EAR, and brows for the encoder box top.
+POSE_LANDMARKS = [1, 152, 33, 263, 61, 291]
+EYE_LANDMARKS = [[33, 160, 158, 133, 153, 144], [263, 387, 385, 362, 380, 373]]
+BROW_LANDMARKS = [70, 63, 105, 66, 107, 336, 296, 334, 293, 300]
+CHIN_LANDMARK = 152
+
+MODEL_POINTS = np.array([
+    (0.0, 0.0, 0.0),
+    (0.0, -63.6, -12.5),
+    (-43.3, 32.7, -26.0),
+    (43.3, 32.7, -26.0),
+    (-28.9, -28.9, -24.1),
+    (28.9, -28.9, -24.1)
+], dtype=np.float64)
+
+@dataclass
+class FrameAnalysis:
+    bbox: tuple[int, int, int, int]  # left, top, right, bottom
+    landmarks: np.ndarray            # (N, 2) pixel coordinates
+    pose: dict
+    blink: bool
+    embedding: np.ndarray | None = None
+
+def face_landmarks(rgb: np.ndarray, session_key: str | None = None) -> np.ndarray:
+    res = get_face_mesh(session_key).process(rgb)
     if not res.multi_face_landmarks or len(res.multi_face_landmarks) == 0:
-        raise AppError("FACE_NOT_FOUND", "Лицо не найдено.")
+        raise AppError("FACE_NOT_FOUND", "Лицо не найдено. Встаньте в кадр.")
     if len(res.multi_face_landmarks) > 1:
-        raise AppError("MULTIPLE_FACES", "В кадре несколько лиц.")
+        raise AppError("MULTIPLE_FACES", "В кадре несколько лиц. Останьтесь один в кадре.")
+    h, w = rgb.shape[:2]
+    pts = np.array([(p.x, p.y) for p in res.multi_face_landmarks[0].landmark], dtype=np.float64)
+    pts *= (w, h)
+    return pts
 
-    lm = res.multi_face_landmarks[0].landmark
-    h, w = bgr.shape[:2]
+def landmarks_bbox(pts: np.ndarray, shape) -> tuple[int, int, int, int]:
+    # Approximates the dlib HOG box (brows to chin, cheek to cheek) so the
+    # encoder's 5-point aligner starts from the same region it was trained on.
+    h, w = shape[:2]
+    left = int(max(0, np.floor(pts[:, 0].min())))
+    right = int(min(w, np.ceil(pts[:, 0].max())))
+    top = int(max(0, np.floor(pts[BROW_LANDMARKS, 1].min())))
+    bottom = int(min(h, np.ceil(pts[CHIN_LANDMARK, 1])))
+    return left, top, right, bottom
 
-    def pt(i):
-        return np.array([lm[i].x * w, lm[i].y * h], dtype=np.float64)
-
-    image_points = np.array([pt(1), pt(152), pt(33), pt(263), pt(61), pt(291)], dtype=np.float64)
-    model_points = np.array([
-        (0.0, 0.0, 0.0),
-        (0.0, -63.6, -12.5),
-        (-43.3, 32.7, -26.0),
-        (43.3, 32.7, -26.0),
-        (-28.9, -28.9, -24.1),
-        (28.9, -28.9, -24.1)
-    ], dtype=np.float64)
+def pose_and_blink_from_landmarks(pts: np.ndarray, shape):
+    h, w = shape[:2]
+    image_points = pts[POSE_LANDMARKS]
 
     focal_length = w
     center = (w / 2, h / 2)
@@ -78,7 +209,7 @@ def estimate_pose_and_blink(bgr: np.ndarray):
     ], dtype=np.float64)
     dist_coeffs = np.zeros((4, 1), dtype=np.float64)
 
-    ok, rvec, tvec = cv2.solvePnP(model_points, image_points, camera_matrix, dist_coeffs, flags=cv2.SOLVEPNP_ITERATIVE)
+    ok, rvec, tvec = cv2.solvePnP(MODEL_POINTS, image_points, camera_matrix, dist_coeffs, flags=cv2.SOLVEPNP_ITERATIVE)
     if not ok:
         raise AppError("POSE_FAIL", "Не удалось оценить поворот головы.")
 
@@ -98,20 +229,99 @@ def estimate_pose_and_blink(bgr: np.ndarray):
     yaw = float(np.degrees(y))
     roll = float(np.degrees(z))
 
-    def ear(indices):
-        p = [pt(i) for i in indices]
-        v1 = np.linalg.norm(p[1]-p[5])
-        v2 = np.linalg.norm(p[2]-p[4])
-        hdist = np.linalg.norm(p[0]-p[3])
-        return float((v1 + v2) / (2.0 * max(hdist, 1e-6)))
-
-    left_ear = ear([33,160,158,133,153,144])
-    right_ear = ear([263,387,385,362,380,373])
-    ear_avg = (left_ear + right_ear) / 2.0
+    # eye aspect ratio for both eyes at once: (|p1-p5| + |p2-p4|) / (2 |p0-p3|)
+    eyes = pts[EYE_LANDMARKS]
+    v1 = np.linalg.norm(eyes[:, 1] - eyes[:, 5], axis=1)
+    v2 = np.linalg.norm(eyes[:, 2] - eyes[:, 4], axis=1)
+    hdist = np.maximum(np.linalg.norm(eyes[:, 0] - eyes[:, 3], axis=1), 1e-6)
+    ear_avg = float(np.mean((v1 + v2) / (2.0 * hdist)))
     blink = ear_avg < 0.18
 
     return {"yaw": yaw, "pitch": pitch, "roll": roll}, blink
 
+def estimate_pose_and_blink(bgr: np.ndarray):
+    rgb = cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
+    pts = face_landmarks(rgb)
+    return pose_and_blink_from_landmarks(pts, bgr.shape)
+
+# Geometry used to check that the tracked face is still the same person between
+# keyframes: segment lengths along the face midline, normalised by
+# nasion-to-chin length. They are ratios of near-vertical distances, so they
+# barely move under the yaw/roll the liveness commands ask for.
+GEOMETRY_SEGMENTS = [(168, 1), (1, 13), (13, CHIN_LANDMARK), (33, 133), (263, 362), (61, 291)]
+
+def landmark_geometry(pts: np.ndarray) -> np.ndarray:
+    a = pts[[i for i, _ in GEOMETRY_SEGMENTS]]
+    b = pts[[j for _, j in GEOMETRY_SEGMENTS]]
+    scale = max(float(np.linalg.norm(pts[168] - pts[CHIN_LANDMARK])), 1e-6)
+    return np.linalg.norm(a - b, axis=1) / scale
+
+def bbox_iou(a, b) -> float:
+    left, top = max(a[0], b[0]), max(a[1], b[1])
+    right, bottom = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0, right - left) * max(0, bottom - top)
+    union = (a[2]-a[0]) * (a[3]-a[1]) + (b[2]-b[0]) * (b[3]-b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+def is_same_track(track: dict, bbox, pts: np.ndarray) -> bool:
+    # bbox is compared with the previous frame, geometry with the last keyframe
+    if bbox_iou(track["bbox"], bbox) < settings.LIVENESS_TRACK_MIN_IOU:
+        return False
+    delta = float(np.max(np.abs(np.asarray(track["geom"]) - landmark_geometry(pts))))
+    return delta <= settings.LIVENESS_TRACK_MAX_GEOM_DELTA
+
+def locate_face(bgr: np.ndarray, session_key: str | None = None, scale: int = 1) -> FrameAnalysis:
+    # One RGB conversion, one FaceMesh run: landmarks give the pose, the blink
+    # and the face box for the encoder, so the HOG pyramid scan is skipped.
+    rgb = cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
+    pts = face_landmarks(rgb, session_key)
+    bbox = landmarks_bbox(pts, bgr.shape)
+    image_quality_checks(bgr, bbox, scale)
+    pose, blink = pose_and_blink_from_landmarks(pts, bgr.shape)
+    return FrameAnalysis(bbox=bbox, landmarks=pts, pose=pose, blink=blink)
+
+def needs_embedding(track: dict | None, analysis: FrameAnalysis) -> bool:
+    # with a track from the previous frame the (expensive) embedding is only
+    # computed if the face is no longer continuous with it
+    return track is None or not is_same_track(track, analysis.bbox, analysis.landmarks)
+
+def analyze_frame(bgr: np.ndarray, track: dict | None = None, session_key: str | None = None) -> FrameAnalysis:
+    analysis = locate_face(bgr, session_key)
+    if needs_embedding(track, analysis):
+        analysis.embedding = encode_face(bgr, analysis.bbox)
+    return analysis
+
+def next_track(track: dict | None, analysis: FrameAnalysis) -> dict:
+    if analysis.embedding is not None:
+        return {"bbox": list(analysis.bbox), "geom": landmark_geometry(analysis.landmarks).tolist(), "age": 0}
+    return {"bbox": list(analysis.bbox), "geom": track["geom"], "age": track["age"] + 1}
+
+def enrollment_template(embeddings: list[np.ndarray]) -> tuple[np.ndarray, float]:
+    # average embedding
+    avg = np.mean(np.stack(embeddings, axis=0), axis=0).astype(np.float32)
+    # simple quality: more samples -> better
+    quality_score = float(min(1.0, 0.5 + 0.1 * len(embeddings)))
+    return avg, quality_score
+
 def face_match(stored_embedding: np.ndarray, current_embedding: np.ndarray):
     dist = l2_dist(stored_embedding, current_embedding)
     return (dist <= settings.FACE_DIST_THRESHOLD), dist
+
+# Entry points executed in CV worker processes (see app.services.cv_executor).
+
+def analyze_liveness_image(image_bytes: bytes, track: dict | None = None, session_key: str | None = None):
+    scale = settings.CV_FRAME_DECODE_SCALE
+    bgr = decode_image(image_bytes, scale)
+    a = locate_face(bgr, session_key, scale)
+    if needs_embedding(track, a):
+        # the native-resolution decode is only paid for on keyframes
+        native = decode_image(image_bytes) if scale > 1 else None
+        a.embedding = encode_face(bgr, a.bbox, native)
+    return a.embedding, a.pose, a.blink, next_track(track, a)
+
+def encode_face_image(image_bytes: bytes, scale: int | None = None) -> np.ndarray:
+    scale = scale or settings.CV_PHOTO_DECODE_SCALE
+    bgr = decode_image(image_bytes, scale)
+    native = decode_image(image_bytes) if scale > 1 else None
+    _, emb = detect_single_face_and_encoding(bgr, native)
+    return emb
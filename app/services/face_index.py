@@ -0,0 +1,90 @@
+import time
+import uuid
+from dataclasses import dataclass
+
+import numpy as np
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.db.models import Face
+
+@dataclass
+class FaceCandidate:
+    face_id: uuid.UUID
+    employee_id: uuid.UUID
+    dist: float
+
+def pairwise_sq_l2(a: np.ndarray, b: np.ndarray, b_sq: np.ndarray | None = None) -> np.ndarray:
+    # |a-b|^2 = |a|^2 + |b|^2 - 2ab, one GEMM instead of an (N, M, 128) difference tensor
+    a_sq = np.einsum("ij,ij->i", a, a)
+    if b_sq is None:
+        b_sq = np.einsum("ij,ij->i", b, b)
+    d2 = a_sq[:, None] + b_sq[None, :] - 2.0 * (a @ b.T)
+    np.maximum(d2, 0.0, out=d2)
+    return d2
+
+class NumpyFaceIndex:
+    # Brute-force exact search over all active templates kept in one contiguous
+    # float32 matrix. 50k x 128 is ~25 MB and one query is a single GEMV.
+    def __init__(self):
+        self.face_ids: list[uuid.UUID] = []
+        self.employee_ids: list[uuid.UUID] = []
+        self.matrix = np.zeros((0, 128), dtype=np.float32)
+        self.sq_norms = np.zeros((0,), dtype=np.float32)
+        self.loaded_at: float | None = None
+
+    def is_stale(self) -> bool:
+        return self.loaded_at is None or time.monotonic() - self.loaded_at > settings.FACE_INDEX_REFRESH_SEC
+
+    def invalidate(self) -> None:
+        self.loaded_at = None
+
+    async def refresh(self, db: AsyncSession) -> None:
+        rows = (await db.execute(
+            select(Face.id, Face.employee_id, Face.embedding).where(Face.is_active == True)
+        )).all()
+        self.face_ids = [r[0] for r in rows]
+        self.employee_ids = [r[1] for r in rows]
+        self.matrix = np.asarray([r[2] for r in rows], dtype=np.float32).reshape(len(rows), 128)
+        self.sq_norms = np.einsum("ij,ij->i", self.matrix, self.matrix)
+        self.loaded_at = time.monotonic()
+
+    def search(self, emb: np.ndarray, k: int) -> list[FaceCandidate]:
+        n = len(self.face_ids)
+        if n == 0:
+            return []
+        q = np.asarray(emb, dtype=np.float32).reshape(1, -1)
+        d2 = pairwise_sq_l2(q, self.matrix, self.sq_norms)[0]
+        k = min(k, n)
+        top = np.argpartition(d2, k - 1)[:k]
+        top = top[np.argsort(d2[top])]
+        return [FaceCandidate(self.face_ids[i], self.employee_ids[i], float(np.sqrt(d2[i]))) for i in top]
+
+numpy_index = NumpyFaceIndex()
+_use_pgvector: bool | None = None
+
+async def _pgvector_available(db: AsyncSession) -> bool:
+    global _use_pgvector
+    if _use_pgvector is None:
+        if settings.FACE_INDEX_BACKEND == "auto":
+            _use_pgvector = bool((await db.execute(text("SELECT 1 FROM pg_extension WHERE extname = 'vector'"))).scalar())
+        else:
+            _use_pgvector = settings.FACE_INDEX_BACKEND == "pgvector"
+    return _use_pgvector
+
+def invalidate_face_index() -> None:
+    # called after enrollment; other API workers pick changes up after FACE_INDEX_REFRESH_SEC
+    numpy_index.invalidate()
+
+async def search_faces(db: AsyncSession, emb: np.ndarray, k: int) -> list[FaceCandidate]:
+    if await _pgvector_available(db):
+        # ordered by the distance operator so the partial HNSW index (init_db) is used
+        dist = Face.embedding.l2_distance(np.asarray(emb, dtype=np.float32).tolist())
+        rows = (await db.execute(
+            select(Face.id, Face.employee_id, dist).where(Face.is_active == True).order_by(dist).limit(k)
+        )).all()
+        return [FaceCandidate(r[0], r[1], float(r[2])) for r in rows]
+    if numpy_index.is_stale():
+        await numpy_index.refresh(db)
+    return numpy_index.search(emb, k)
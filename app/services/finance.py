@@ -1,12 +1,14 @@
+import uuid
 from dataclasses import dataclass
 from datetime import datetime
 from zoneinfo import ZoneInfo
-from sqlalchemy import select
+from sqlalchemy import text
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.core.config import settings
 from app.core.errors import AppError
-from app.db.models import Card, Employee, DailyBalance, MonthlyBalance, Transaction, LivenessSession
-from app.services.calendar import is_company_workday, is_employee_working
+from app.db.models import LivenessSession
+from app.services.calendar import CalendarIndex, get_calendar
+from app.services.telegram import enqueue_payment_notification
 
 def year_month(d) -> int:
     return d.year * 100 + d.month
@@ -18,18 +20,75 @@ class PaymentResult:
     subsidy_left: int
     monthly_left: int
 
-async def compute_subsidy_eligibility(db: AsyncSession, emp: Employee, d) -> bool:
-    if emp.employee_type != "WORKER":
+def subsidy_eligible(cal: CalendarIndex, employee_id, employee_type: str, employee_status: str, d) -> bool:
+    if employee_type != "WORKER":
         return False
-    if emp.status != "ACTIVE":
+    if employee_status != "ACTIVE":
         return False
-    if not await is_company_workday(db, d):
+    if not cal.is_company_workday(d):
         return False
-    if not await is_employee_working(db, emp.id, d):
+    if not cal.is_employee_working(employee_id, d):
         return False
     return True
 
-async def pay(db: AsyncSession, terminal_id, card_uid: str, amount_cents: int, liveness_session_id) -> PaymentResult:
+# Everything pay() needs to validate and price a payment, in one statement
+# (holidays and absences come from the in-memory calendar index).
+# Balances are read without locks; the debit below is guarded instead.
+PAYMENT_CONTEXT_SQL = text("""
+SELECT c.status AS card_status,
+       e.id AS employee_id, e.status AS employee_status, e.employee_type, e.monthly_limit_cents, e.telegram_chat_id,
+       d.used_cents AS daily_used, d.subsidy_eligible,
+       m.used_cents AS monthly_used, m.limit_cents AS monthly_limit
+FROM cards c
+JOIN employees e ON e.id = c.employee_id
+LEFT JOIN daily_balance d ON d.employee_id = e.id AND d.date = :today
+LEFT JOIN monthly_balance m ON m.employee_id = e.id AND m.year_month = :ym
+WHERE c.uid = :card_uid
+""")
+
+# The whole debit in one round trip. Each step only runs if the previous one
+# produced a row: consume the liveness session (must still be PASSED and
+# unused), add the subsidy part to daily_balance (never past the daily cap),
+# add the rest to monthly_balance (never past limit_cents), insert the
+# transaction. The upserts create missing balance rows. Row locks are held
+# for this single statement only.
+PAYMENT_DEBIT_SQL = text("""
+WITH s AS (
+    UPDATE liveness_sessions SET status = 'USED', used_at = now()
+    WHERE id = :sid AND created_at = :screated AND status = 'PASSED' AND used_at IS NULL
+    RETURNING id
+), d AS (
+    INSERT INTO daily_balance AS b (employee_id, date, used_cents)
+    SELECT :emp, :today, :subsidy FROM s
+    ON CONFLICT (employee_id, date) DO UPDATE
+        SET used_cents = b.used_cents + EXCLUDED.used_cents
+        WHERE EXCLUDED.used_cents = 0 OR b.used_cents + EXCLUDED.used_cents <= :daily_cap
+    RETURNING b.used_cents
+), m AS (
+    INSERT INTO monthly_balance AS b (employee_id, year_month, limit_cents, used_cents)
+    SELECT :emp, :ym, :limit, :remaining FROM d
+    ON CONFLICT (employee_id, year_month) DO UPDATE
+        SET used_cents = b.used_cents + EXCLUDED.used_cents
+        WHERE EXCLUDED.used_cents = 0 OR b.used_cents + EXCLUDED.used_cents <= b.limit_cents
+    RETURNING b.used_cents, b.limit_cents
+), t AS (
+    INSERT INTO transactions (id, terminal_id, employee_id, card_uid, amount_cents,
+                              subsidy_spent_cents, monthly_spent_cents, status, liveness_session_id, meta)
+    SELECT :tx_id, :terminal_id, :emp, :card_uid, :amount, :subsidy, :remaining, 'APPROVED', :sid, CAST('{}' AS json)
+    FROM m
+    RETURNING id
+)
+SELECT (SELECT count(*) FROM s) AS session_ok,
+       (SELECT used_cents FROM d) AS daily_used,
+       (SELECT used_cents FROM m) AS monthly_used,
+       (SELECT limit_cents FROM m) AS monthly_limit
+""")
+
+# a concurrent payment for the same employee changed daily_balance between
+# the read and the guarded debit: re-read and price again
+DEBIT_ATTEMPTS = 3
+
+def check_amount(amount_cents: int) -> None:
     if amount_cents <= 0:
         raise AppError("BAD_AMOUNT", "Сумма должна быть больше нуля.")
     if amount_cents > settings.MAX_MEAL_CENTS:
@@ -37,78 +96,83 @@ async def pay(db: AsyncSession, terminal_id, card_uid: str, amount_cents: int, l
     if amount_cents > settings.MAX_RECEIPT_CENTS:
         raise AppError("MAX_RECEIPT_500_EXCEEDED", "Сумма одного чека не может превышать 500 руб.")
 
-    sess = (await db.execute(select(LivenessSession).where(LivenessSession.id == liveness_session_id))).scalar_one_or_none()
+def check_card(card_status: str | None, employee_status: str | None) -> None:
+    if card_status is None:
+        raise AppError("CARD_NOT_FOUND", "Карта не найдена.")
+    if card_status != "ACTIVE":
+        raise AppError("CARD_BLOCKED", "Карта заблокирована.")
+    if employee_status != "ACTIVE":
+        raise AppError("EMPLOYEE_BLOCKED", "Сотрудник заблокирован.")
+
+async def pay(db: AsyncSession, terminal_id, card_uid: str, amount_cents: int, sess: LivenessSession | None) -> PaymentResult:
+    # Leaves the debit uncommitted: the caller commits it together with the
+    # idempotency record (app.services.idempotency.complete). Rolls back on a
+    # decline.
+    check_amount(amount_cents)
+
+    # the caller already loaded the session; the debit re-checks it atomically
     if not sess or sess.status != "PASSED":
         raise AppError("LIVENESS_REQUIRED", "Liveness не пройдена или недействительна.", 403)
     if sess.used_at is not None or sess.status == "USED":
         raise AppError("LIVENESS_ALREADY_USED", "Liveness-токен уже использован.", 409)
+    sid, screated = sess.id, sess.created_at
 
     tz = ZoneInfo(settings.APP_TZ)
-    now = datetime.now(tz=tz)
-    today = now.date()
+    today = datetime.now(tz=tz).date()
     ym = year_month(today)
 
-    async with db.begin():
-        card = (await db.execute(select(Card).where(Card.uid == card_uid).with_for_update())).scalar_one_or_none()
-        if not card:
-            raise AppError("CARD_NOT_FOUND", "Карта не найдена.")
-        if card.status != "ACTIVE":
-            raise AppError("CARD_BLOCKED", "Карта заблокирована.")
-
-        emp = (await db.execute(select(Employee).where(Employee.id == card.employee_id).with_for_update())).scalar_one()
-        if emp.status != "ACTIVE":
-            raise AppError("EMPLOYEE_BLOCKED", "Сотрудник заблокирован.")
-
-        eligible = await compute_subsidy_eligibility(db, emp, today)
-
-        dbal = (await db.execute(
-            select(DailyBalance).where(DailyBalance.employee_id == emp.id, DailyBalance.date == today).with_for_update()
-        )).scalar_one_or_none()
-        if not dbal:
-            dbal = DailyBalance(employee_id=emp.id, date=today, used_cents=0)
-            db.add(dbal)
-            await db.flush()
-
-        mbal = (await db.execute(
-            select(MonthlyBalance).where(MonthlyBalance.employee_id == emp.id, MonthlyBalance.year_month == ym).with_for_update()
-        )).scalar_one_or_none()
-        if not mbal:
-            mbal = MonthlyBalance(employee_id=emp.id, year_month=ym, limit_cents=emp.monthly_limit_cents, used_cents=0)
-            db.add(mbal)
-            await db.flush()
-
-        subsidy_left = (settings.SUBSIDY_DAILY_CENTS - dbal.used_cents) if eligible else 0
-        subsidy_left = max(0, subsidy_left)
-
-        subsidy_spent = min(subsidy_left, amount_cents)
-        remaining = amount_cents - subsidy_spent
-
-        monthly_left = max(0, mbal.limit_cents - mbal.used_cents)
-        if remaining > monthly_left:
-            raise AppError("INSUFFICIENT_MONTHLY_LIMIT", "Недостаточно средств в месячном лимите.")
-
-        dbal.used_cents += subsidy_spent
-        mbal.used_cents += remaining
-
-        sess.used_at = datetime.now(tz=ZoneInfo("UTC"))
-        sess.status = "USED"
-
-        tx = Transaction(
-            terminal_id=terminal_id,
-            employee_id=emp.id,
-            card_uid=card_uid,
-            amount_cents=amount_cents,
-            subsidy_spent_cents=subsidy_spent,
-            monthly_spent_cents=remaining,
-            status="APPROVED",
-            liveness_session_id=liveness_session_id,
-        )
-        db.add(tx)
-        await db.flush()
-
-        return PaymentResult(
-            subsidy_spent=subsidy_spent,
-            monthly_spent=remaining,
-            subsidy_left=(settings.SUBSIDY_DAILY_CENTS - dbal.used_cents) if eligible else 0,
-            monthly_left=(mbal.limit_cents - mbal.used_cents),
-        )
+    try:
+        cal = await get_calendar(db)
+        for _ in range(DEBIT_ATTEMPTS):
+            ctx = (await db.execute(PAYMENT_CONTEXT_SQL, {"card_uid": card_uid, "today": today, "ym": ym})).mappings().one_or_none()
+            check_card(ctx["card_status"] if ctx else None, ctx["employee_status"] if ctx else None)
+
+            # pre-materialized flag (app.services.balances) when present
+            eligible = ctx["subsidy_eligible"]
+            if eligible is None:
+                eligible = subsidy_eligible(cal, ctx["employee_id"], ctx["employee_type"], ctx["employee_status"], today)
+            daily_used = ctx["daily_used"] or 0
+            monthly_used = ctx["monthly_used"] or 0
+            monthly_limit = ctx["monthly_limit"] if ctx["monthly_limit"] is not None else ctx["monthly_limit_cents"]
+
+            subsidy_left = (settings.SUBSIDY_DAILY_CENTS - daily_used) if eligible else 0
+            subsidy_left = max(0, subsidy_left)
+
+            subsidy_spent = min(subsidy_left, amount_cents)
+            remaining = amount_cents - subsidy_spent
+
+            monthly_left = max(0, monthly_limit - monthly_used)
+            if remaining > monthly_left:
+                raise AppError("INSUFFICIENT_MONTHLY_LIMIT", "Недостаточно средств в месячном лимите.")
+
+            res = (await db.execute(PAYMENT_DEBIT_SQL, {
+                "sid": sid, "screated": screated, "emp": ctx["employee_id"], "today": today, "ym": ym,
+                "subsidy": subsidy_spent, "remaining": remaining, "daily_cap": settings.SUBSIDY_DAILY_CENTS,
+                "limit": ctx["monthly_limit_cents"], "tx_id": uuid.uuid4(), "terminal_id": terminal_id,
+                "card_uid": card_uid, "amount": amount_cents,
+            })).mappings().one()
+
+            if not res["session_ok"]:
+                raise AppError("LIVENESS_ALREADY_USED", "Liveness-токен уже использован.", 409)
+            if res["daily_used"] is None:
+                await db.rollback()
+                continue
+            if res["monthly_used"] is None:
+                raise AppError("INSUFFICIENT_MONTHLY_LIMIT", "Недостаточно средств в месячном лимите.")
+
+            result = PaymentResult(
+                subsidy_spent=subsidy_spent,
+                monthly_spent=remaining,
+                subsidy_left=(settings.SUBSIDY_DAILY_CENTS - res["daily_used"]) if eligible else 0,
+                monthly_left=(res["monthly_limit"] - res["monthly_used"]),
+            )
+            # outbox row commits (or rolls back) together with the payment
+            enqueue_payment_notification(
+                db, ctx["telegram_chat_id"], amount_cents, result.subsidy_spent,
+                result.monthly_spent, result.subsidy_left, result.monthly_left,
+            )
+            return result
+        raise AppError("PAYMENT_CONFLICT", "Параллельная оплата по сотруднику. Повторите попытку.", 409)
+    except AppError:
+        await db.rollback()
+        raise
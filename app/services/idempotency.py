@@ -0,0 +1,138 @@
+import hashlib
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.errors import AppError
+from app.db.models import PaymentIdempotency
+from app.db.session import SessionLocal
+
+# Idempotency keys for /api/pay, scoped per terminal. The first request claims
+# (terminal_id, key) in payment_idempotency; its response is stored there and
+# replayed to every retry with the same key, so a retry never runs pay() again
+# (and never writes a second DECLINED transaction). The key is looked up before
+# anything else is validated: a retry whose liveness token has meanwhile
+# expired (or whose session was consumed by the first attempt) still gets the
+# stored response. A fingerprint of the payload is stored with the key; the
+# same key with a different card or amount is rejected. Completed responses
+# are also kept in a bounded per-process LRU so hot retries skip Postgres.
+
+MAX_KEY_LEN = 128
+OFFLINE_KEY_PREFIX = "offline:"  # keys of /api/pay_batch items (app.services.pay_batch)
+
+class ResponseCache:
+    def __init__(self, max_size: int, ttl_sec: float):
+        self.max_size = max_size
+        self.ttl_sec = ttl_sec
+        self._items: OrderedDict[tuple, tuple[dict, str | None, float]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple) -> tuple[dict, str | None] | None:
+        item = self._items.get(key)
+        if item is None or time.monotonic() - item[2] >= self.ttl_sec:
+            self.misses += 1
+            return None
+        self._items.move_to_end(key)
+        self.hits += 1
+        return item[0], item[1]
+
+    def put(self, key: tuple, response: dict, fingerprint: str | None) -> None:
+        self._items[key] = (response, fingerprint, time.monotonic())
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {"size": len(self._items), "max_size": self.max_size, "hits": self.hits, "misses": self.misses}
+
+_cache = ResponseCache(settings.IDEMPOTENCY_CACHE_SIZE, settings.IDEMPOTENCY_TTL_HOURS * 3600)
+
+def check_key(key: str | None) -> str | None:
+    if key is None:
+        return None
+    key = str(key).strip()
+    if not key or len(key) > MAX_KEY_LEN:
+        raise AppError("BAD_IDEMPOTENCY_KEY", f"Ключ идемпотентности: от 1 до {MAX_KEY_LEN} символов.")
+    if key.startswith(OFFLINE_KEY_PREFIX):
+        # reserved: would collide with the offline batch's replay records
+        raise AppError("BAD_IDEMPOTENCY_KEY", f"Ключ идемпотентности не может начинаться с {OFFLINE_KEY_PREFIX!r}.")
+    return key
+
+def fingerprint(*parts) -> str:
+    return hashlib.sha256("|".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+
+def _check_fingerprint(stored: str | None, fp: str) -> None:
+    if stored is not None and stored != fp:
+        raise AppError("IDEMPOTENCY_KEY_REUSED", "Ключ идемпотентности уже использован для другого платежа.", 422)
+
+def cached_response(terminal_id, key: str, fp: str) -> dict | None:
+    item = _cache.get((terminal_id, key))
+    if item is None:
+        return None
+    _check_fingerprint(item[1], fp)
+    return item[0]
+
+async def claim(db: AsyncSession, terminal_id, key: str, fp: str) -> dict | None:
+    # Returns the stored response if the key was already completed, None if
+    # this request now owns the key. The payment and complete() commit
+    # together, so an IN_PROGRESS claim never stands for a charged payment; one
+    # left by a crashed request is taken over after IDEMPOTENCY_STALE_SEC.
+    stale_before = datetime.now(timezone.utc) - timedelta(seconds=settings.IDEMPOTENCY_STALE_SEC)
+    stmt = insert(PaymentIdempotency).values(terminal_id=terminal_id, key=key, status="IN_PROGRESS", fingerprint=fp)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[PaymentIdempotency.terminal_id, PaymentIdempotency.key],
+        set_={"created_at": datetime.now(timezone.utc), "fingerprint": fp},
+        where=(PaymentIdempotency.status == "IN_PROGRESS") & (PaymentIdempotency.created_at < stale_before),
+    ).returning(PaymentIdempotency.key)
+    claimed = (await db.execute(stmt)).scalar_one_or_none()
+    await db.commit()
+    if claimed is not None:
+        return None
+
+    row = (await db.execute(
+        select(PaymentIdempotency.status, PaymentIdempotency.fingerprint, PaymentIdempotency.response)
+        .where(PaymentIdempotency.terminal_id == terminal_id, PaymentIdempotency.key == key)
+    )).one()
+    _check_fingerprint(row.fingerprint, fp)
+    if row.status != "DONE":
+        raise AppError("PAYMENT_IN_PROGRESS", "Оплата с этим ключом ещё выполняется. Повторите запрос позже.", 409)
+    _cache.put((terminal_id, key), row.response, row.fingerprint)
+    return row.response
+
+async def release(db: AsyncSession, terminal_id, key: str) -> None:
+    # the request failed before pay() ran (bad token, unknown session, ...):
+    # drop the claim so a corrected retry with the same key is processed
+    await db.rollback()
+    await db.execute(
+        delete(PaymentIdempotency)
+        .where(PaymentIdempotency.terminal_id == terminal_id, PaymentIdempotency.key == key,
+               PaymentIdempotency.status == "IN_PROGRESS")
+    )
+    await db.commit()
+
+async def complete(db: AsyncSession, terminal_id, key: str, fp: str, response: dict) -> None:
+    # commits whatever the caller added to the session (the payment itself)
+    # together with the response
+    await db.execute(
+        update(PaymentIdempotency)
+        .where(PaymentIdempotency.terminal_id == terminal_id, PaymentIdempotency.key == key)
+        .values(status="DONE", response=response)
+    )
+    await db.commit()
+    _cache.put((terminal_id, key), response, fp)
+
+async def purge_idempotency_keys() -> int:
+    cutoff = datetime.now(timezone.utc) - timedelta(hours=settings.IDEMPOTENCY_TTL_HOURS)
+    async with SessionLocal() as db:
+        res = await db.execute(delete(PaymentIdempotency).where(PaymentIdempotency.created_at < cutoff))
+        await db.commit()
+    return res.rowcount
+
+def idempotency_stats() -> dict:
+    return _cache.stats()
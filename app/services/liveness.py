@@ -1,11 +1,17 @@
+import asyncio
 import random
+from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
-from sqlalchemy import select
+from sqlalchemy import select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.core.config import settings
 from app.core.errors import AppError
-from app.db.models import LivenessSession, Face, Card, Terminal
-from app.services.face import decode_image, detect_single_face_and_encoding, estimate_pose_and_blink, face_match
+from app.db.models import LivenessSession, Face, Card
+from app.services import liveness_recorder as recorder
+from app.services.cv_executor import run_cv
+from app.services.face import analyze_liveness_image, face_match
+from app.services.liveness_store import LivenessState, get_session_store
+from app.services.terminal_auth import TerminalIdentity
 import numpy as np
 
 COMMANDS_POOL = [
@@ -14,6 +20,18 @@ COMMANDS_POOL = [
     ("TILT",       "Наклоните голову к плечу"),
 ]
 
+# liveness_sessions is range-partitioned on created_at, so a lookup by id
+# alone probes every partition. A session is usable for minutes only; the
+# created_at lower bound lets the planner prune to the newest partition(s).
+SESSION_LOOKBACK = timedelta(days=1)
+
+def session_by_id(session_id) -> tuple:
+    # where-clause for one session: select(LivenessSession).where(*session_by_id(sid))
+    return (
+        LivenessSession.id == session_id,
+        LivenessSession.created_at >= datetime.now(timezone.utc) - SESSION_LOOKBACK,
+    )
+
 def pick_commands():
     k = random.choice([2, 3])
     items = random.sample(COMMANDS_POOL, k=k)
@@ -30,7 +48,49 @@ def command_satisfied(cmd_type: str, anchor: dict, pose: dict) -> bool:
         return abs(roll - roll0) >= 12.0
     return False
 
-async def start_liveness(db: AsyncSession, terminal: Terminal, card_uid: str) -> LivenessSession:
+def keyframe_track(sess):
+    # Keyframes (first frame, every Nth frame, or a break in landmark tracking)
+    # get a full embedding and face_match; frames in between only have to stay
+    # continuous with the tracked face. None forces a keyframe.
+    track = sess.track_state
+    if track is not None and track["age"] + 1 >= settings.LIVENESS_KEYFRAME_EVERY:
+        return None
+    return track
+
+def advance_session(sess, pose: dict, blink: bool, emb: np.ndarray | None, stored: np.ndarray | None) -> None:
+    # Pure session state machine for one analyzed frame (no I/O), shared by
+    # process_frame and the offline replay tool. Terminal failures set
+    # sess.status before raising.
+    if emb is not None:
+        ok, dist = face_match(stored, emb)
+        if not ok:
+            sess.status = "FAILED"
+            sess.fail_reason_code = "FACE_NOT_MATCH"
+            raise AppError("FACE_NOT_MATCH", "Лицо не совпадает с владельцем карты.", 403, {"dist": dist})
+
+        sess.min_face_dist = float(dist) if sess.min_face_dist is None else float(min(sess.min_face_dist, dist))
+    sess.blink_seen = bool(sess.blink_seen or blink)
+
+    items = sess.commands["items"]
+    if sess.baseline_pose is None:
+        sess.baseline_pose = pose
+    if sess.anchor_pose is None:
+        sess.anchor_pose = pose
+
+    if sess.current_index < len(items):
+        cur_cmd = items[sess.current_index]
+        if command_satisfied(cur_cmd["type"], sess.anchor_pose, pose):
+            sess.current_index += 1
+            sess.anchor_pose = pose
+
+    if sess.current_index >= len(items):
+        if not sess.blink_seen:
+            sess.status = "FAILED"
+            sess.fail_reason_code = "BLINK_NOT_DETECTED"
+            raise AppError("LIVENESS_FAILED", "Не удалось подтвердить живость (моргните и повторите).", 403)
+        sess.status = "PASSED"
+
+async def start_liveness(db: AsyncSession, terminal: TerminalIdentity, card_uid: str) -> LivenessSession:
     card = (await db.execute(select(Card).where(Card.uid == card_uid))).scalar_one_or_none()
     if not card:
         raise AppError("CARD_NOT_FOUND", "Карта не найдена.")
@@ -55,58 +115,114 @@ async def start_liveness(db: AsyncSession, terminal: Terminal, card_uid: str) ->
     db.add(sess)
     await db.commit()
     await db.refresh(sess)
+    await get_session_store().put(LivenessState.from_row(sess, face.embedding))
+    recorder.start_session(sess, face.embedding)
     return sess
 
-async def process_frame(db: AsyncSession, session_id, image_bytes: bytes) -> LivenessSession:
-    sess = (await db.execute(select(LivenessSession).where(LivenessSession.id == session_id))).scalar_one_or_none()
+async def persist_state(db: AsyncSession, state: LivenessState) -> None:
+    await db.execute(update(LivenessSession).where(*session_by_id(state.id)).values(**state.row_values()))
+    await db.commit()
+
+async def load_state(db: AsyncSession, session_id) -> LivenessState:
+    # Store miss: worker restart, or (memory store) another worker started the
+    # session. Rebuild the state from the row.
+    sess = (await db.execute(select(LivenessSession).where(*session_by_id(session_id)))).scalar_one_or_none()
     if not sess:
         raise AppError("LIVENESS_NOT_FOUND", "Сессия liveness не найдена.")
-    now = datetime.now(timezone.utc)
     if sess.status != "IN_PROGRESS":
         raise AppError("LIVENESS_NOT_IN_PROGRESS", "Сессия liveness не активна.", 409, {"status": sess.status})
-    if now >= sess.expires_at:
-        sess.status = "EXPIRED"
-        await db.commit()
+    face = (await db.execute(select(Face).where(Face.employee_id == sess.employee_id, Face.is_active == True))).scalar_one()
+    return LivenessState.from_row(sess, face.embedding)
+
+async def process_frame(db: AsyncSession, session_id, image_bytes: bytes) -> LivenessState:
+    # Intermediate state stays in the session store; Postgres only sees the
+    # terminal transition (PASSED / FAILED / EXPIRED).
+    store = get_session_store()
+    state = await store.get(session_id)
+    if state is None:
+        state = await load_state(db, session_id)
+    now = datetime.now(timezone.utc)
+    if state.status != "IN_PROGRESS":
+        raise AppError("LIVENESS_NOT_IN_PROGRESS", "Сессия liveness не активна.", 409, {"status": state.status})
+    if now >= state.expires_at:
+        state.status = "EXPIRED"
+        await persist_state(db, state)
+        await store.put(state)
+        recorder.record_outcome(state)
         raise AppError("LIVENESS_EXPIRED", "Сессия liveness истекла. Повторите попытку.", 409)
 
-    bgr = decode_image(image_bytes)
-    _, emb = detect_single_face_and_encoding(bgr)
-    pose, blink = estimate_pose_and_blink(bgr)
+    recorder.record_frame(state.id, image_bytes)
 
-    face = (await db.execute(select(Face).where(Face.employee_id == sess.employee_id, Face.is_active == True))).scalar_one()
-    stored = np.array(face.embedding, dtype=np.float32)
+    sid = str(state.id)
+    emb, pose, blink, track = await run_cv(analyze_liveness_image, image_bytes, keyframe_track(state), sid, key=sid)
+    state.track_state = track
+    stored = np.asarray(state.stored_embedding, dtype=np.float32) if emb is not None else None
 
-    ok, dist = face_match(stored, emb)
-    if not ok:
-        sess.status = "FAILED"
-        sess.fail_reason_code = "FACE_NOT_MATCH"
-        await db.commit()
-        raise AppError("FACE_NOT_MATCH", "Лицо не совпадает с владельцем карты.", 403, {"dist": dist})
+    state.last_seen_at = now
+    try:
+        advance_session(state, pose, blink, emb, stored)
+    except AppError:
+        await persist_state(db, state)
+        await store.put(state)
+        recorder.record_outcome(state)
+        raise
+    if state.status != "IN_PROGRESS":
+        await persist_state(db, state)
+        recorder.record_outcome(state)
+    await store.put(state)
+    return state
 
-    sess.min_face_dist = float(dist) if sess.min_face_dist is None else float(min(sess.min_face_dist, dist))
-    sess.blink_seen = bool(sess.blink_seen or blink)
+# Latest-wins ingest. A session processes one frame at a time; frames that
+# arrive meanwhile wait in a single pending slot, and a newer frame replaces
+# (drops) the one already waiting. Under load we analyze fewer but fresher
+# frames instead of queueing stale ones until the session expires.
 
-    items = sess.commands["items"]
-    if sess.baseline_pose is None:
-        sess.baseline_pose = pose
-    if sess.anchor_pose is None:
-        sess.anchor_pose = pose
+@dataclass
+class _FrameSlot:
+    busy: bool = False
+    waiter: asyncio.Future | None = None
 
-    if sess.current_index < len(items):
-        cur_cmd = items[sess.current_index]
-        if command_satisfied(cur_cmd["type"], sess.anchor_pose, pose):
-            sess.current_index += 1
-            sess.anchor_pose = pose
+_frame_slots: dict[str, _FrameSlot] = {}
+frame_stats = {"processed": 0, "dropped": 0}
 
-    if sess.current_index >= len(items):
-        if not sess.blink_seen:
-            sess.status = "FAILED"
-            sess.fail_reason_code = "BLINK_NOT_DETECTED"
-            await db.commit()
-            raise AppError("LIVENESS_FAILED", "Не удалось подтвердить живость (моргните и повторите).", 403)
-        sess.status = "PASSED"
+async def ingest_frame(db: AsyncSession, session_id, image_bytes: bytes) -> tuple[LivenessState, bool]:
+    # Returns (state, dropped). dropped=True means a newer frame superseded
+    # this one before it was analyzed; state is then the current session state.
+    sid = str(session_id)
+    slot = _frame_slots.setdefault(sid, _FrameSlot())
+    if slot.busy:
+        if slot.waiter is not None and not slot.waiter.done():
+            slot.waiter.set_result(False)
+            frame_stats["dropped"] += 1
+        fut = asyncio.get_running_loop().create_future()
+        slot.waiter = fut
+        try:
+            granted = await fut
+        except asyncio.CancelledError:
+            # cancelled after the slot was already handed to us: pass it on
+            if fut.done() and not fut.cancelled() and fut.result():
+                _release_slot(sid, slot)
+            raise
+        if not granted:
+            state = await get_session_store().get(sid)
+            if state is None:
+                raise AppError("LIVENESS_BUSY", "Предыдущий кадр ещё обрабатывается.", 429)
+            return state, True
+    slot.busy = True
+    try:
+        state = await process_frame(db, sid, image_bytes)
+        frame_stats["processed"] += 1
+        return state, False
+    finally:
+        _release_slot(sid, slot)
 
-    sess.last_seen_at = now
-    await db.commit()
-    await db.refresh(sess)
-    return sess
+def _release_slot(sid: str, slot: _FrameSlot) -> None:
+    nxt, slot.waiter = slot.waiter, None
+    if nxt is not None and not nxt.done():
+        nxt.set_result(True)  # hand the slot over, busy stays set
+    else:
+        slot.busy = False
+        _frame_slots.pop(sid, None)
+
+def ingest_stats() -> dict:
+    return {**frame_stats, "active_sessions": len(_frame_slots)}
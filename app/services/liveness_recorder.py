@@ -0,0 +1,167 @@
+import asyncio
+import json
+import logging
+import mmap
+import os
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+
+from app.core.config import settings
+
+log = logging.getLogger(__name__)
+
+# Opt-in archive of liveness sessions for offline tuning (scripts.liveness_replay).
+# One directory per session under LIVENESS_RECORD_DIR:
+#   meta.json    session id, commands, stored template, start time
+#   frames.bin   raw JPEG frames, appended back to back
+#   index.bin    fixed-size records (offset, length, unix ts) into frames.bin
+#   outcome.json final status, written when the session leaves IN_PROGRESS
+# Both .bin files are append-only; the index is read with np.memmap and the
+# frames through mmap, so replay never copies the blob into memory.
+
+INDEX_DTYPE = np.dtype([("offset", "<u8"), ("length", "<u4"), ("ts", "<f8")])
+
+# Writes happen on a single background task (to_thread, in submission order)
+# fed by a bounded queue, so the frame path never waits on the disk. When the
+# disk can't keep up, recordings lose frames, not the live session.
+QUEUE_SIZE = 256
+
+_queue: asyncio.Queue | None = None
+_writer: asyncio.Task | None = None
+_dropped = 0
+
+def enabled() -> bool:
+    return bool(settings.LIVENESS_RECORD_DIR)
+
+def _session_dir(session_id) -> Path:
+    return Path(settings.LIVENESS_RECORD_DIR) / str(session_id)
+
+def _submit(fn, *args) -> None:
+    global _queue, _writer, _dropped
+    if _queue is None:
+        _queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+    try:
+        _queue.put_nowait((fn, args))
+    except asyncio.QueueFull:
+        _dropped += 1
+        return
+    if _writer is None or _writer.done():
+        _writer = asyncio.get_running_loop().create_task(_write_loop())
+
+async def _write_loop() -> None:
+    while True:
+        fn, args = await _queue.get()
+        try:
+            await asyncio.to_thread(fn, *args)
+        except Exception:
+            # recording must never break a live session
+            log.exception("liveness recorder: %s failed", fn.__name__)
+        finally:
+            _queue.task_done()
+
+async def close_recorder(timeout: float = 5.0) -> None:
+    # on shutdown: flush what is queued, then stop the writer
+    global _writer
+    if _queue is not None:
+        try:
+            await asyncio.wait_for(_queue.join(), timeout)
+        except asyncio.TimeoutError:
+            log.warning("liveness recorder: %d writes not flushed", _queue.qsize())
+    if _writer is not None:
+        _writer.cancel()
+        _writer = None
+
+def recorder_stats() -> dict:
+    return {"enabled": enabled(), "queued": _queue.qsize() if _queue else 0, "dropped": _dropped}
+
+def _write_meta(d: Path, meta: dict) -> None:
+    d.mkdir(parents=True, exist_ok=True)
+    (d / "meta.json").write_text(json.dumps(meta), encoding="utf-8")
+
+def _append_frame(d: Path, image_bytes: bytes, ts: float) -> None:
+    if not (d / "meta.json").exists():
+        return
+    with open(d / "frames.bin", "ab") as frames, open(d / "index.bin", "ab") as index:
+        offset = frames.tell()
+        frames.write(image_bytes)
+        rec = np.array([(offset, len(image_bytes), ts)], dtype=INDEX_DTYPE)
+        index.write(rec.tobytes())
+
+def _write_outcome(d: Path, outcome: dict) -> None:
+    if d.exists():
+        (d / "outcome.json").write_text(json.dumps(outcome), encoding="utf-8")
+
+def start_session(sess, stored_embedding) -> None:
+    if not enabled():
+        return
+    meta = {
+        "session_id": str(sess.id),
+        "employee_id": str(sess.employee_id),
+        "terminal_id": str(sess.terminal_id),
+        "commands": sess.commands,
+        "stored_embedding": [float(v) for v in stored_embedding],
+        "started_at": time.time(),
+    }
+    _submit(_write_meta, _session_dir(sess.id), meta)
+
+def record_frame(session_id, image_bytes: bytes) -> None:
+    if not enabled():
+        return
+    _submit(_append_frame, _session_dir(session_id), image_bytes, time.time())
+
+def record_outcome(sess) -> None:
+    if not enabled():
+        return
+    outcome = {
+        "status": sess.status,
+        "fail_reason_code": sess.fail_reason_code,
+        "current_index": sess.current_index,
+        "blink_seen": sess.blink_seen,
+        "min_face_dist": sess.min_face_dist,
+    }
+    _submit(_write_outcome, _session_dir(sess.id), outcome)
+
+@dataclass
+class SessionArchive:
+    path: Path
+    meta: dict
+    outcome: dict | None
+    index: np.ndarray
+    _blob: mmap.mmap | None
+
+    @classmethod
+    def open(cls, path: Path) -> "SessionArchive":
+        path = Path(path)
+        meta = json.loads((path / "meta.json").read_text(encoding="utf-8"))
+        outcome_path = path / "outcome.json"
+        outcome = json.loads(outcome_path.read_text(encoding="utf-8")) if outcome_path.exists() else None
+        index_path = path / "index.bin"
+        n = index_path.stat().st_size // INDEX_DTYPE.itemsize if index_path.exists() else 0
+        index = np.memmap(index_path, dtype=INDEX_DTYPE, mode="r", shape=(n,)) if n else np.zeros(0, dtype=INDEX_DTYPE)
+        blob = None
+        if n:
+            with open(path / "frames.bin", "rb") as f:
+                blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(path, meta, outcome, index, blob)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def frame(self, i: int) -> tuple[float, bytes]:
+        rec = self.index[i]
+        off, length = int(rec["offset"]), int(rec["length"])
+        return float(rec["ts"]), self._blob[off:off + length]
+
+    def close(self) -> None:
+        if self._blob is not None:
+            self._blob.close()
+            self._blob = None
+
+def list_archives(root) -> list[Path]:
+    root = Path(root)
+    if (root / "meta.json").exists():
+        return [root]
+    return sorted(p for p in root.iterdir() if (p / "meta.json").exists()) if os.path.isdir(root) else []
@@ -0,0 +1,145 @@
+import json
+import time
+import uuid
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+
+from app.core.config import settings
+from app.db.models import LivenessSession
+
+# Intermediate liveness state (current_index, poses, track, ...) changes on every
+# frame at ~7 fps per terminal. It lives in a session-state store instead of
+# Postgres; the liveness_sessions row is written on create and on terminal
+# transitions only (see app.services.liveness).
+
+@dataclass
+class LivenessState:
+    id: uuid.UUID
+    employee_id: uuid.UUID
+    terminal_id: uuid.UUID
+    status: str
+    commands: dict
+    expires_at: datetime
+    stored_embedding: list[float]  # active Face template, needed on keyframes
+    current_index: int = 0
+    baseline_pose: dict | None = None
+    anchor_pose: dict | None = None
+    fail_reason_code: str | None = None
+    last_seen_at: datetime | None = None
+    min_face_dist: float | None = None
+    blink_seen: bool = False
+    track_state: dict | None = None
+
+    @classmethod
+    def from_row(cls, sess: LivenessSession, stored_embedding) -> "LivenessState":
+        return cls(
+            id=sess.id, employee_id=sess.employee_id, terminal_id=sess.terminal_id,
+            status=sess.status, commands=sess.commands, expires_at=sess.expires_at,
+            stored_embedding=[float(v) for v in stored_embedding],
+            current_index=sess.current_index, baseline_pose=sess.baseline_pose,
+            anchor_pose=sess.anchor_pose, fail_reason_code=sess.fail_reason_code,
+            last_seen_at=sess.last_seen_at, min_face_dist=sess.min_face_dist,
+            blink_seen=sess.blink_seen, track_state=sess.track_state,
+        )
+
+    def row_values(self) -> dict:
+        # columns written back to liveness_sessions on a terminal transition
+        return {
+            "status": self.status,
+            "current_index": self.current_index,
+            "baseline_pose": self.baseline_pose,
+            "anchor_pose": self.anchor_pose,
+            "fail_reason_code": self.fail_reason_code,
+            "last_seen_at": self.last_seen_at,
+            "min_face_dist": self.min_face_dist,
+            "blink_seen": self.blink_seen,
+            "track_state": self.track_state,
+        }
+
+    def to_json(self) -> str:
+        d = asdict(self)
+        for k in ("id", "employee_id", "terminal_id"):
+            d[k] = str(d[k])
+        for k in ("expires_at", "last_seen_at"):
+            d[k] = d[k].isoformat() if d[k] else None
+        return json.dumps(d)
+
+    @classmethod
+    def from_json(cls, raw: str | bytes) -> "LivenessState":
+        d = json.loads(raw)
+        for k in ("id", "employee_id", "terminal_id"):
+            d[k] = uuid.UUID(d[k])
+        for k in ("expires_at", "last_seen_at"):
+            d[k] = datetime.fromisoformat(d[k]) if d[k] else None
+        return cls(**d)
+
+def _ttl_sec(state: LivenessState) -> float:
+    # keep finished/expired states a little longer so late frames are answered
+    # from the store instead of falling through to Postgres
+    left = (state.expires_at - datetime.now(timezone.utc)).total_seconds()
+    return max(left, 0.0) + settings.LIVENESS_STORE_GRACE_SEC
+
+class MemorySessionStore:
+    # Per-process dict; fine for a single API worker. With several workers a
+    # session's frames may land on different processes: use the redis store.
+    def __init__(self):
+        self._items: dict[str, tuple[LivenessState, float]] = {}
+        self._next_purge = 0.0
+
+    def _purge(self, now: float) -> None:
+        if now < self._next_purge:
+            return
+        self._next_purge = now + 5.0
+        for k in [k for k, (_, exp) in self._items.items() if exp <= now]:
+            del self._items[k]
+
+    async def get(self, session_id) -> LivenessState | None:
+        now = time.monotonic()
+        self._purge(now)
+        item = self._items.get(str(session_id))
+        if item is None or item[1] <= now:
+            return None
+        return item[0]
+
+    async def put(self, state: LivenessState) -> None:
+        self._items[str(state.id)] = (state, time.monotonic() + _ttl_sec(state))
+
+    async def delete(self, session_id) -> None:
+        self._items.pop(str(session_id), None)
+
+    def stats(self) -> dict:
+        return {"backend": "memory", "size": len(self._items)}
+
+class RedisSessionStore:
+    # Shared across API workers (local Redis or any protocol-compatible server).
+    def __init__(self, url: str):
+        import redis.asyncio as redis  # optional dependency, only for LIVENESS_STORE=redis
+        self._redis = redis.from_url(url)
+
+    @staticmethod
+    def _key(session_id) -> str:
+        return f"liveness:{session_id}"
+
+    async def get(self, session_id) -> LivenessState | None:
+        raw = await self._redis.get(self._key(session_id))
+        return LivenessState.from_json(raw) if raw else None
+
+    async def put(self, state: LivenessState) -> None:
+        await self._redis.set(self._key(state.id), state.to_json(), px=max(1, int(_ttl_sec(state) * 1000)))
+
+    async def delete(self, session_id) -> None:
+        await self._redis.delete(self._key(session_id))
+
+    def stats(self) -> dict:
+        return {"backend": "redis"}
+
+_store = None
+
+def get_session_store():
+    global _store
+    if _store is None:
+        if settings.LIVENESS_STORE == "redis":
+            _store = RedisSessionStore(settings.LIVENESS_REDIS_URL)
+        else:
+            _store = MemorySessionStore()
+    return _store
@@ -0,0 +1,53 @@
+import logging
+from datetime import datetime, timezone
+
+from sqlalchemy import update
+
+from app.core.config import settings
+from app.db.locks import try_xact_lock
+from app.db.models import LivenessSession
+from app.db.partitions import PARTITIONED_TABLES, add_months, drop_partitions_before, ensure_monthly_partitions, month_start
+from app.db.session import SessionLocal, engine
+from app.services.idempotency import purge_idempotency_keys
+from app.services.telegram import purge_notification_outbox
+from app.services.tx_archive import archive_closed_months
+
+log = logging.getLogger(__name__)
+
+async def reap_expired_sessions() -> int:
+    # Abandoned sessions never get another frame, so process_frame never marks
+    # them EXPIRED; do it in bulk (served by the partial IN_PROGRESS index).
+    async with SessionLocal() as db:
+        res = await db.execute(
+            update(LivenessSession)
+            .where(LivenessSession.status == "IN_PROGRESS", LivenessSession.expires_at < datetime.now(timezone.utc))
+            .values(status="EXPIRED")
+            .execution_options(synchronize_session=False)
+        )
+        await db.commit()
+    if res.rowcount:
+        log.info("expired %d abandoned liveness sessions", res.rowcount)
+    return res.rowcount
+
+async def maintain_partitions() -> None:
+    today = datetime.now(timezone.utc).date()
+    cutoff = add_months(month_start(today), -settings.LIVENESS_RETENTION_MONTHS)
+    async with engine.begin() as conn:
+        # every API worker schedules this; DDL from two of them would collide
+        if await try_xact_lock(conn, "partitions"):
+            created = []
+            for table in PARTITIONED_TABLES:
+                created += await ensure_monthly_partitions(conn, table, today, settings.PARTITION_MONTHS_AHEAD)
+            dropped = await drop_partitions_before(conn, "liveness_sessions", cutoff)
+            if created or dropped:
+                log.info("partitions: created=%s dropped=%s", created, dropped)
+    # transactions are never just dropped: exported to disk first
+    await archive_closed_months()
+
+async def purge_expired_rows() -> None:
+    purged = await purge_notification_outbox()
+    if purged:
+        log.info("purged %d delivered/failed notifications", purged)
+    purged = await purge_idempotency_keys()
+    if purged:
+        log.info("purged %d expired idempotency keys", purged)
@@ -0,0 +1,235 @@
+import hmac
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import insert as bulk_insert, select, tuple_, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.errors import AppError
+from app.core.security import offline_payment_signature
+from app.db.models import Card, DailyBalance, Employee, MonthlyBalance, PaymentIdempotency, Transaction
+from app.services.calendar import get_calendar
+from app.services.finance import check_amount, check_card, subsidy_eligible, year_month
+from app.services.idempotency import OFFLINE_KEY_PREFIX, fingerprint
+from app.services.telegram import enqueue_payment_notification
+
+# Offline-buffered payments (/api/pay_batch). A till that lost the API queues
+# meals as {id, card_uid, amount_cents, ts, sig} and uploads them on
+# reconnect. Items are applied in order with pay()'s rules except liveness
+# (there was no server to run it), PAY_BATCH_CHUNK items per transaction:
+# claim the item ids, lock the touched balance rows, price everything in
+# Python, write balances and transactions in bulk, store the per-item results.
+# Re-sending a batch replays the stored results (ids are idempotency keys,
+# in /api/pay's key table under the "offline:" prefix, which /api/pay refuses
+# for its own keys); an id re-sent with a different card or amount is
+# declined as ID_REUSED.
+
+KEY_PREFIX = OFFLINE_KEY_PREFIX
+MAX_ID_LEN = 64
+
+@dataclass
+class OfflinePayment:
+    index: int
+    client_id: str
+    card_uid: str
+    amount_cents: int
+    ts: int
+
+    @property
+    def key(self) -> str:
+        return KEY_PREFIX + self.client_id
+
+    @property
+    def fingerprint(self) -> str:
+        return fingerprint(self.card_uid, self.amount_cents)
+
+def _is_int(v) -> bool:
+    # JSON true/false arrive as bool, which is an int subclass
+    return isinstance(v, int) and not isinstance(v, bool)
+
+def _declined(client_id, code: str, message: str) -> dict:
+    return {"id": client_id, "status": "DECLINED", "code": code, "message": message}
+
+def parse_item(raw, index: int, terminal_token: str, now: float) -> OfflinePayment:
+    if not isinstance(raw, dict):
+        raise AppError("BAD_ITEM", "Элемент пакета должен быть объектом.")
+    client_id, card_uid, amount, ts, sig = (raw.get(k) for k in ("id", "card_uid", "amount_cents", "ts", "sig"))
+    if not isinstance(client_id, str) or not 0 < len(client_id) <= MAX_ID_LEN:
+        raise AppError("BAD_ITEM", f"id: строка от 1 до {MAX_ID_LEN} символов.")
+    if not isinstance(card_uid, str) or not card_uid or not _is_int(amount) or not _is_int(ts) or not isinstance(sig, str):
+        raise AppError("BAD_ITEM", "Нужны поля: id, card_uid, amount_cents, ts, sig.")
+    expected = offline_payment_signature(terminal_token, client_id, card_uid, amount, ts)
+    if not hmac.compare_digest(expected, sig.lower()):
+        raise AppError("BAD_SIGNATURE", "Подпись платежа не совпадает.")
+    if ts > now + settings.PAY_BATCH_MAX_CLOCK_SKEW_SEC:
+        raise AppError("PAYMENT_IN_FUTURE", "Время платежа в будущем.")
+    if ts < now - settings.PAY_BATCH_MAX_AGE_HOURS * 3600:
+        raise AppError("PAYMENT_TOO_OLD", "Платёж слишком старый для офлайн-загрузки.")
+    return OfflinePayment(index, client_id, card_uid, amount, ts)
+
+async def pay_batch(db: AsyncSession, terminal_id, terminal_token: str, items: list) -> list[dict]:
+    if not isinstance(items, list) or not items:
+        raise AppError("BAD_REQUEST", "Нужен непустой список items.")
+    if len(items) > settings.PAY_BATCH_MAX_ITEMS:
+        raise AppError("BAD_REQUEST", f"Не больше {settings.PAY_BATCH_MAX_ITEMS} платежей в пакете.")
+
+    # malformed, forged or out-of-window items never reach the ledger
+    results: list[dict | None] = [None] * len(items)
+    payments: list[OfflinePayment] = []
+    seen = set()
+    now = time.time()
+    for i, raw in enumerate(items):
+        try:
+            p = parse_item(raw, i, terminal_token, now)
+            if p.client_id in seen:
+                raise AppError("BAD_ITEM", "Повторяющийся id в пакете.")
+        except AppError as e:
+            results[i] = _declined(raw.get("id") if isinstance(raw, dict) else None, e.code, e.message)
+            continue
+        seen.add(p.client_id)
+        payments.append(p)
+
+    chunk = settings.PAY_BATCH_CHUNK
+    for start in range(0, len(payments), chunk):
+        await _apply_chunk(db, terminal_id, payments[start:start + chunk], results)
+    return results
+
+async def _apply_chunk(db: AsyncSession, terminal_id, payments: list[OfflinePayment], results: list) -> None:
+    # claim ids in this transaction: a concurrent upload of the same batch
+    # waits on the unique index and then sees the stored results
+    claimed = set((await db.execute(
+        insert(PaymentIdempotency)
+        .values([{"terminal_id": terminal_id, "key": p.key, "status": "IN_PROGRESS", "fingerprint": p.fingerprint}
+                 for p in payments])
+        .on_conflict_do_nothing()
+        .returning(PaymentIdempotency.key)
+    )).scalars())
+    done = [p for p in payments if p.key not in claimed]
+    if done:
+        stored = {r.key: r for r in (await db.execute(
+            select(PaymentIdempotency.key, PaymentIdempotency.fingerprint, PaymentIdempotency.response)
+            .where(PaymentIdempotency.terminal_id == terminal_id, PaymentIdempotency.key.in_([p.key for p in done]))
+        )).all()}
+        for p in done:
+            row = stored.get(p.key)
+            if row is not None and row.fingerprint is not None and row.fingerprint != p.fingerprint:
+                # same id, differently signed payment: never replay the old result for it
+                results[p.index] = _declined(p.client_id, "ID_REUSED", "Этот id уже использован для другого платежа.")
+            elif row is not None and row.response:
+                results[p.index] = row.response
+            else:
+                results[p.index] = _declined(p.client_id, "PAYMENT_IN_PROGRESS", "Платёж ещё обрабатывается.")
+    todo = [p for p in payments if p.key in claimed]
+    if todo:
+        await _apply_payments(db, terminal_id, todo, results)
+        await db.execute(update(PaymentIdempotency), [
+            {"terminal_id": terminal_id, "key": p.key, "status": "DONE", "response": results[p.index]} for p in todo
+        ])
+    await db.commit()
+
+async def _apply_payments(db: AsyncSession, terminal_id, payments: list[OfflinePayment], results: list) -> None:
+    tz = ZoneInfo(settings.APP_TZ)
+    cards = {r.uid: r for r in (await db.execute(
+        select(Card.uid, Card.status.label("card_status"), Employee.id.label("employee_id"),
+               Employee.status.label("employee_status"), Employee.employee_type,
+               Employee.monthly_limit_cents, Employee.telegram_chat_id)
+        .join(Employee, Employee.id == Card.employee_id)
+        .where(Card.uid.in_({p.card_uid for p in payments}))
+    )).all()}
+
+    day_of = {p.index: datetime.fromtimestamp(p.ts, tz).date() for p in payments}
+    daily_keys, monthly_rows = set(), {}
+    for p in payments:
+        c = cards.get(p.card_uid)
+        if c is not None:
+            d = day_of[p.index]
+            daily_keys.add((c.employee_id, d))
+            monthly_rows[(c.employee_id, year_month(d))] = c.monthly_limit_cents
+
+    daily: dict[tuple, DailyBalance] = {}
+    monthly: dict[tuple, MonthlyBalance] = {}
+    if daily_keys:
+        # make sure every touched row exists, then lock them in key order
+        # (daily before monthly, like pay()) so concurrent writers can't deadlock;
+        # populate_existing: rows loaded by an earlier chunk are refreshed, not
+        # reused with used_cents from before another till's debit
+        await db.execute(insert(DailyBalance).values(
+            [{"employee_id": e, "date": d, "used_cents": 0} for e, d in daily_keys]
+        ).on_conflict_do_nothing())
+        await db.execute(insert(MonthlyBalance).values(
+            [{"employee_id": e, "year_month": ym, "limit_cents": lim, "used_cents": 0} for (e, ym), lim in monthly_rows.items()]
+        ).on_conflict_do_nothing())
+        for b in (await db.execute(
+            select(DailyBalance).where(tuple_(DailyBalance.employee_id, DailyBalance.date).in_(list(daily_keys)))
+            .order_by(DailyBalance.employee_id, DailyBalance.date).with_for_update()
+            .execution_options(populate_existing=True)
+        )).scalars():
+            daily[(b.employee_id, b.date)] = b
+        for b in (await db.execute(
+            select(MonthlyBalance).where(tuple_(MonthlyBalance.employee_id, MonthlyBalance.year_month).in_(list(monthly_rows)))
+            .order_by(MonthlyBalance.employee_id, MonthlyBalance.year_month).with_for_update()
+            .execution_options(populate_existing=True)
+        )).scalars():
+            monthly[(b.employee_id, b.year_month)] = b
+
+    cal = await get_calendar(db)
+    received_at = datetime.now(timezone.utc).isoformat()
+    txs = []
+    for p in payments:
+        c = cards.get(p.card_uid)
+        tx = {
+            "terminal_id": terminal_id,
+            "card_uid": p.card_uid,
+            "amount_cents": p.amount_cents,
+            "subsidy_spent_cents": 0,
+            "monthly_spent_cents": 0,
+            "decline_code": None,
+            "decline_message": None,
+            "created_at": datetime.fromtimestamp(p.ts, timezone.utc),  # when the meal was sold
+            "meta": {"offline": True, "client_id": p.client_id, "received_at": received_at},
+        }
+        try:
+            check_amount(p.amount_cents)
+            check_card(c.card_status if c else None, c.employee_status if c else None)
+            d = day_of[p.index]
+            dbal = daily[(c.employee_id, d)]
+            mbal = monthly[(c.employee_id, year_month(d))]
+            eligible = dbal.subsidy_eligible
+            if eligible is None:
+                eligible = subsidy_eligible(cal, c.employee_id, c.employee_type, c.employee_status, d)
+
+            subsidy_spent = min(max(0, settings.SUBSIDY_DAILY_CENTS - dbal.used_cents) if eligible else 0, p.amount_cents)
+            remaining = p.amount_cents - subsidy_spent
+            if remaining > max(0, mbal.limit_cents - mbal.used_cents):
+                raise AppError("INSUFFICIENT_MONTHLY_LIMIT", "Недостаточно средств в месячном лимите.")
+        except AppError as e:
+            results[p.index] = _declined(p.client_id, e.code, e.message)
+            if c is not None:  # a DECLINED row needs an employee
+                txs.append({**tx, "employee_id": c.employee_id, "status": "DECLINED",
+                            "decline_code": e.code, "decline_message": e.message})
+            continue
+
+        dbal.used_cents += subsidy_spent
+        mbal.used_cents += remaining
+        subsidy_left = (settings.SUBSIDY_DAILY_CENTS - dbal.used_cents) if eligible else 0
+        monthly_left = mbal.limit_cents - mbal.used_cents
+        txs.append({**tx, "employee_id": c.employee_id, "status": "APPROVED",
+                    "subsidy_spent_cents": subsidy_spent, "monthly_spent_cents": remaining})
+        enqueue_payment_notification(db, c.telegram_chat_id, p.amount_cents, subsidy_spent, remaining, subsidy_left, monthly_left)
+        results[p.index] = {
+            "id": p.client_id,
+            "status": "APPROVED",
+            "amount_cents": p.amount_cents,
+            "subsidy_spent_cents": subsidy_spent,
+            "monthly_spent_cents": remaining,
+            "subsidy_today_left_cents": subsidy_left,
+            "monthly_left_cents": monthly_left,
+        }
+
+    if txs:
+        # one multi-row INSERT; the balance changes flush as batched UPDATEs
+        await db.execute(bulk_insert(Transaction), txs)
@@ -0,0 +1,104 @@
+import csv
+import io
+import json
+import uuid
+from datetime import datetime
+from typing import AsyncIterator
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import text
+
+from app.core.config import settings
+from app.core.errors import AppError
+from app.db.metrics import QueryStats, current_stats, route_stats
+from app.db.session import ReadSessionLocal
+
+# Payroll export of monthly deductions. Aggregation happens in Postgres and
+# rows are fetched through a server-side cursor REPORT_FETCH_ROWS at a time,
+# formatted and handed out chunk by chunk, so memory stays flat however
+# large the month is.
+
+FORMATS = {"csv": "text/csv; charset=utf-8", "jsonl": "application/x-ndjson"}
+
+# per employee; limit_cents from monthly_balance (the snapshot pay() checked against)
+SUMMARY_SQL = text("""
+SELECT e.tab_no, e.full_name, e.employee_type, t.employee_id,
+       count(*) AS meals,
+       CAST(sum(t.amount_cents) AS bigint) AS amount_cents,
+       CAST(sum(t.subsidy_spent_cents) AS bigint) AS subsidy_spent_cents,
+       CAST(sum(t.monthly_spent_cents) AS bigint) AS monthly_spent_cents,
+       m.limit_cents AS monthly_limit_cents
+FROM transactions t
+JOIN employees e ON e.id = t.employee_id
+LEFT JOIN monthly_balance m ON m.employee_id = t.employee_id AND m.year_month = :ym
+WHERE t.status = 'APPROVED' AND t.created_at >= :start AND t.created_at < :end
+GROUP BY e.tab_no, e.full_name, e.employee_type, t.employee_id, m.limit_cents
+ORDER BY e.tab_no
+""")
+
+# every transaction, declined ones included, for audits
+DETAIL_SQL = text("""
+SELECT t.created_at, t.id AS transaction_id, e.tab_no, e.full_name, t.employee_id, t.card_uid,
+       t.terminal_id, t.status, t.decline_code,
+       t.amount_cents, t.subsidy_spent_cents, t.monthly_spent_cents
+FROM transactions t
+JOIN employees e ON e.id = t.employee_id
+WHERE t.created_at >= :start AND t.created_at < :end
+ORDER BY t.created_at, t.id
+""")
+
+def month_bounds(ym: int) -> tuple[datetime, datetime]:
+    # calendar month in APP_TZ, as aware datetimes for created_at comparisons
+    year, month = divmod(ym, 100)
+    if not (2000 <= year <= 2100 and 1 <= month <= 12):
+        raise AppError("BAD_REQUEST", "year_month: ожидается YYYYMM.")
+    tz = ZoneInfo(settings.APP_TZ)
+    start = datetime(year, month, 1, tzinfo=tz)
+    end = datetime(year + month // 12, month % 12 + 1, 1, tzinfo=tz)
+    return start, end
+
+def _value(v):
+    if isinstance(v, datetime):
+        return v.isoformat()
+    if isinstance(v, uuid.UUID):
+        return str(v)
+    return v
+
+def payroll_export(ym: int, fmt: str = "csv", detail: bool = False) -> AsyncIterator[str]:
+    # validates up front (errors must surface before a streamed response starts)
+    if fmt not in FORMATS:
+        raise AppError("BAD_REQUEST", f"format: одно из {', '.join(FORMATS)}.")
+    start, end = month_bounds(ym)
+    stmt = DETAIL_SQL if detail else SUMMARY_SQL
+    return _stream(stmt, {"start": start, "end": end, "ym": ym}, fmt)
+
+async def _stream(stmt, params: dict, fmt: str) -> AsyncIterator[str]:
+    # own session (on the replica when configured): it has to outlive the
+    # request handler while the body streams
+    stats = QueryStats()
+    # the middleware's stats are recorded when the headers go out, before any
+    # of these queries run: the body is counted under its own route
+    current_stats.set(stats)
+    try:
+        async with ReadSessionLocal() as db:
+            result = await db.stream(stmt.execution_options(yield_per=settings.REPORT_FETCH_ROWS), params)
+            columns = list(result.keys())
+            buf = io.StringIO()
+            writer = csv.writer(buf)
+            if fmt == "csv":
+                writer.writerow(columns)
+            async for rows in result.partitions():
+                for row in rows:
+                    values = [_value(v) for v in row]
+                    if fmt == "csv":
+                        writer.writerow(values)
+                    else:
+                        buf.write(json.dumps(dict(zip(columns, values)), ensure_ascii=False))
+                        buf.write("\n")
+                yield buf.getvalue()
+                buf.seek(0)
+                buf.truncate()
+            if buf.tell():
+                yield buf.getvalue()
+    finally:
+        route_stats.add("/api/reports/payroll (stream)", stats)
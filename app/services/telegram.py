@@ -1,36 +1,174 @@
-from sqlalchemy import select
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+
+import httpx
+from sqlalchemy import delete, select, update
 from sqlalchemy.ext.asyncio import AsyncSession
+
 from app.core.config import settings
-from app.db.models import Employee
-import httpx
+from app.db.models import NotificationOutbox
+from app.db.session import SessionLocal
 
-async def send_telegram_payment_notification(
+log = logging.getLogger(__name__)
+
+# Payment notifications go through an outbox: pay() adds the row in the
+# payment transaction, dispatch_outbox() (a background job, see app.main)
+# delivers it. The till response never waits for Telegram, and a message is
+# sent only if the payment committed.
+
+def payment_notification_text(amount_cents: int, subsidy_spent: int, monthly_spent: int,
+                              subsidy_left: int, monthly_left: int) -> str:
+    return (
+        f"Оплата питания: {amount_cents/100:.2f} руб\n"
+        f"Дотация: -{subsidy_spent/100:.2f} руб\n"
+        f"Из лимита: -{monthly_spent/100:.2f} руб\n"
+        f"Остаток дотации сегодня: {subsidy_left/100:.2f} руб\n"
+        f"Остаток месячного лимита: {monthly_left/100:.2f} руб"
+    )
+
+def enqueue_payment_notification(
     db: AsyncSession,
-    employee_id,
+    chat_id: int | None,
     amount_cents: int,
     subsidy_spent: int,
     monthly_spent: int,
     subsidy_left: int,
     monthly_left: int
 ) -> None:
-    if not settings.TELEGRAM_BOT_TOKEN:
-        return
-    emp = (await db.execute(select(Employee).where(Employee.id == employee_id))).scalar_one_or_none()
-    if not emp or not emp.telegram_chat_id:
+    # no I/O: the row is flushed with the caller's commit
+    if not settings.TELEGRAM_BOT_TOKEN or not chat_id:
         return
+    text = payment_notification_text(amount_cents, subsidy_spent, monthly_spent, subsidy_left, monthly_left)
+    db.add(NotificationOutbox(chat_id=chat_id, text=text))
 
-    text = (
-        f"Оплата питания: {amount_cents/100:.2f} руб\n"
-        f"Дотация: -{subsidy_spent/100:.2f} руб\n"
-        f"Из лимита: -{monthly_spent/100:.2f} руб\n"
-        f"Остаток дотации сегодня: {subsidy_left/100:.2f} руб\n"
-        f"Остаток месячного лимита: {monthly_left/100:.2f} руб"
+_client: httpx.AsyncClient | None = None
+_paused_until = 0.0  # loop time; set when Telegram answers 429
+_stats = {"sent": 0, "retried": 0, "failed": 0, "rate_limited": 0}
+
+def _get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            base_url=settings.TELEGRAM_API_BASE,
+            timeout=httpx.Timeout(5.0, connect=3.0),
+            limits=httpx.Limits(max_connections=settings.TELEGRAM_CONCURRENCY,
+                                max_keepalive_connections=settings.TELEGRAM_CONCURRENCY),
+        )
+    return _client
+
+async def close_telegram_client() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+def _backoff(attempts: int) -> float:
+    return min(settings.TELEGRAM_BACKOFF_BASE_SEC * 2 ** (attempts - 1), settings.TELEGRAM_BACKOFF_MAX_SEC)
+
+async def _send(row, sem: asyncio.Semaphore) -> dict:
+    # -> the row's new state; no DB access in here
+    global _paused_until
+    async with sem:
+        loop = asyncio.get_running_loop()
+        now = datetime.now(timezone.utc)
+        out = {"id": row.id, "status": "PENDING", "attempts": row.attempts, "next_attempt_at": now,
+               "last_error": row.last_error, "sent_at": None}
+        wait = _paused_until - loop.time()
+        if wait > 0:
+            # a 429 earlier in this batch paused the bot: put the row back
+            out["next_attempt_at"] = now + timedelta(seconds=wait)
+            return out
+        try:
+            r = await _get_client().post(
+                f"/bot{settings.TELEGRAM_BOT_TOKEN}/sendMessage",
+                json={"chat_id": row.chat_id, "text": row.text},
+            )
+        except httpx.HTTPError as e:
+            error, permanent = f"{type(e).__name__}: {e}", False
+        else:
+            if r.status_code == 200:
+                _stats["sent"] += 1
+                return {**out, "status": "SENT", "attempts": row.attempts + 1, "last_error": None, "sent_at": now}
+            error = f"HTTP {r.status_code}: {r.text[:200]}"
+            if r.status_code == 429:
+                try:
+                    retry_after = float(r.json()["parameters"]["retry_after"])
+                except (ValueError, KeyError, TypeError):
+                    retry_after = _backoff(row.attempts + 1)
+                _stats["rate_limited"] += 1
+                # the limit is per bot: hold the whole dispatcher, not just this
+                # row; rate limiting alone never uses up a row's attempts
+                _paused_until = max(_paused_until, loop.time() + retry_after)
+                return {**out, "last_error": error, "next_attempt_at": now + timedelta(seconds=retry_after)}
+            # other 4xx (chat not found, bot blocked, bad request) won't get better
+            permanent = 400 <= r.status_code < 500
+
+        out.update(attempts=row.attempts + 1, last_error=error)
+        if permanent or out["attempts"] >= settings.TELEGRAM_MAX_ATTEMPTS:
+            out["status"] = "FAILED"
+            _stats["failed"] += 1
+            log.warning("telegram notification %s failed: %s", row.id, error)
+        else:
+            out["next_attempt_at"] = now + timedelta(seconds=_backoff(out["attempts"]))
+            _stats["retried"] += 1
+        return out
+
+async def _claim(limit: int) -> list:
+    # Short transaction: lease due rows by pushing next_attempt_at past the
+    # send window (SKIP LOCKED, so several API workers never claim the same
+    # row). No lock or connection is held while Telegram is called; a worker
+    # that dies mid-batch leaves its rows to be picked up after the lease.
+    now = datetime.now(timezone.utc)
+    due = (
+        select(NotificationOutbox.id)
+        .where(NotificationOutbox.status == "PENDING", NotificationOutbox.next_attempt_at <= now)
+        .order_by(NotificationOutbox.next_attempt_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
     )
-    url = f"https://api.telegram.org/bot{settings.TELEGRAM_BOT_TOKEN}/sendMessage"
-    payload = {"chat_id": emp.telegram_chat_id, "text": text}
+    async with SessionLocal() as db:
+        rows = (await db.execute(
+            update(NotificationOutbox)
+            .where(NotificationOutbox.id.in_(due.scalar_subquery()))
+            .values(next_attempt_at=now + timedelta(seconds=settings.TELEGRAM_LEASE_SEC))
+            .returning(NotificationOutbox.id, NotificationOutbox.chat_id, NotificationOutbox.text,
+                       NotificationOutbox.attempts, NotificationOutbox.last_error)
+            .execution_options(synchronize_session=False)
+        )).all()
+        await db.commit()
+    return rows
 
-    try:
-        async with httpx.AsyncClient(timeout=3.0) as client:
-            await client.post(url, json=payload)
-    except Exception:
-        return
+async def dispatch_outbox() -> int:
+    # One round: lease due rows, send them concurrently outside any
+    # transaction, store the outcomes in one bulk UPDATE. Loops while full
+    # batches keep coming so a backlog drains without waiting for the next tick.
+    if not settings.TELEGRAM_BOT_TOKEN:
+        return 0
+    sem = asyncio.Semaphore(settings.TELEGRAM_CONCURRENCY)
+    total = 0
+    while True:
+        if _paused_until > asyncio.get_running_loop().time():
+            return total
+        rows = await _claim(settings.TELEGRAM_BATCH_SIZE)
+        if rows:
+            outcomes = await asyncio.gather(*(_send(row, sem) for row in rows))
+            async with SessionLocal() as db:
+                await db.execute(update(NotificationOutbox), outcomes)
+                await db.commit()
+        total += len(rows)
+        if len(rows) < settings.TELEGRAM_BATCH_SIZE:
+            return total
+
+async def purge_notification_outbox() -> int:
+    cutoff = datetime.now(timezone.utc) - timedelta(days=settings.TELEGRAM_OUTBOX_RETENTION_DAYS)
+    async with SessionLocal() as db:
+        res = await db.execute(
+            delete(NotificationOutbox)
+            .where(NotificationOutbox.status != "PENDING", NotificationOutbox.created_at < cutoff)
+        )
+        await db.commit()
+    return res.rowcount
+
+def telegram_stats() -> dict:
+    return {**_stats, "paused_sec": max(0.0, _paused_until - asyncio.get_running_loop().time())}
@@ -0,0 +1,96 @@
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.errors import AppError
+from app.core.security import hash_token
+from app.db.models import Terminal
+
+# Terminal authentication runs on every request (7 liveness frames/s per
+# till), so token hash -> terminal is cached per process. Entries live
+# TERMINAL_AUTH_CACHE_TTL_SEC at most: a terminal blocked or re-keyed through
+# another API worker is rejected within that window; through this one
+# (invalidate_terminal, called by the admin API) immediately.
+
+@dataclass(frozen=True)
+class TerminalIdentity:
+    id: uuid.UUID
+    name: str
+    status: str
+
+class TerminalAuthCache:
+    def __init__(self, max_size: int, ttl_sec: float):
+        self.max_size = max_size
+        self.ttl_sec = ttl_sec
+        self._items: OrderedDict[str, tuple[TerminalIdentity, float]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, token_hash: str) -> TerminalIdentity | None:
+        item = self._items.get(token_hash)
+        if item is None or time.monotonic() >= item[1]:
+            if item is not None:
+                del self._items[token_hash]
+            self.misses += 1
+            return None
+        self._items.move_to_end(token_hash)
+        self.hits += 1
+        return item[0]
+
+    def put(self, token_hash: str, term: TerminalIdentity) -> None:
+        self._items[token_hash] = (term, time.monotonic() + self.ttl_sec)
+        self._items.move_to_end(token_hash)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, terminal_id) -> None:
+        for k in [k for k, (t, _) in self._items.items() if t.id == terminal_id]:
+            del self._items[k]
+            self.invalidations += 1
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._items),
+            "max_size": self.max_size,
+            "ttl_sec": self.ttl_sec,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else None,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+_cache = TerminalAuthCache(settings.TERMINAL_AUTH_CACHE_SIZE, settings.TERMINAL_AUTH_CACHE_TTL_SEC)
+
+async def authenticate_terminal(db: AsyncSession, token: str | None) -> TerminalIdentity:
+    if not token:
+        raise AppError("TERMINAL_UNAUTHORIZED", "Не указан токен терминала.", 401)
+    token_hash = hash_token(token)
+    term = _cache.get(token_hash)
+    if term is None:
+        row = (await db.execute(
+            select(Terminal.id, Terminal.name, Terminal.status).where(Terminal.api_token_hash == token_hash)
+        )).one_or_none()
+        if not row:
+            raise AppError("TERMINAL_UNAUTHORIZED", "Неверный токен терминала.", 401)
+        term = TerminalIdentity(row.id, row.name, row.status)
+        # blocked terminals are cached too: repeated requests are rejected without a query
+        _cache.put(token_hash, term)
+    if term.status != "ACTIVE":
+        raise AppError("TERMINAL_BLOCKED", "Терминал заблокирован.", 403)
+    return term
+
+def invalidate_terminal(terminal_id) -> None:
+    _cache.invalidate(terminal_id)
+
+def terminal_auth_stats() -> dict:
+    return _cache.stats()
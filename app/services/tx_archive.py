@@ -0,0 +1,240 @@
+import asyncio
+import json
+import logging
+import os
+from array import array
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+
+import numpy as np
+from sqlalchemy import text
+
+from app.core.config import settings
+from app.db.locks import try_session_lock, unlock
+from app.db.partitions import add_months, closed_partitions_before, drop_partition, month_start, partition_name
+from app.db.session import engine
+
+log = logging.getLogger(__name__)
+
+# Closed months of the partitioned transactions table are exported to one
+# compressed columnar file each (<TRANSACTIONS_ARCHIVE_DIR>/transactions_YYYYMM.npz)
+# and only then detached and dropped. Per column:
+#   id, liveness_session_id   uint8 (N, 16) raw UUID bytes, zeros for NULL
+#   created_at                int64 microseconds since the Unix epoch, UTC
+#   *_cents                   int64
+#   other text/uuid columns   dictionary-encoded: int32 "<col>" codes into a
+#                             "<col>__values" string array ("" = NULL)
+#   meta                      JSON text, nearly unique per row, so not
+#                             dictionary-encoded: UTF-8 back to back in
+#                             "meta__bytes", row i at meta__offsets[i:i+2]
+# "__manifest__" holds a JSON string with row count and amount totals.
+# Reading is np.load() (no pickle); see load_archive() and scripts.tx_archive.
+#
+# Row encoding and compression run in a worker thread (asyncio.to_thread),
+# one cursor batch at a time, so the event loop serving the terminals only
+# drives the cursor. Before a partition is dropped, the column sums read back
+# from the file must equal SUM(...) over the (locked) partition. One process
+# at a time archives (advisory lock), however many API workers schedule it.
+
+FORMAT_VERSION = 2
+INT_COLUMNS = ["amount_cents", "subsidy_spent_cents", "monthly_spent_cents"]
+DICT_COLUMNS = ["terminal_id", "employee_id", "card_uid", "status", "decline_code", "decline_message"]
+LOCK_NAME = "tx_archive"
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_US = timedelta(microseconds=1)
+
+class _DictColumn:
+    def __init__(self):
+        self.codes = array("i")
+        self.index: dict[str, int] = {}
+
+    def append(self, value: str) -> None:
+        code = self.index.get(value)
+        if code is None:
+            code = self.index[value] = len(self.index)
+        self.codes.append(code)
+
+    def values(self) -> np.ndarray:
+        if not self.index:
+            return np.zeros(0, dtype="U1")
+        return np.array(list(self.index), dtype=str)  # dict keeps insertion (= code) order
+
+class _Utf8Column:
+    # variable-length text without per-value padding
+    def __init__(self):
+        self.data = bytearray()
+        self.offsets = array("q", [0])
+
+    def append(self, value: str) -> None:
+        self.data += value.encode("utf-8")
+        self.offsets.append(len(self.data))
+
+class Utf8Values:
+    # read side of _Utf8Column; decodes a row only when it is accessed
+    def __init__(self, data: np.ndarray, offsets: np.ndarray):
+        self._data = data
+        self._offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        return self._data[self._offsets[i]:self._offsets[i + 1]].tobytes().decode("utf-8")
+
+def _as_text(v) -> str:
+    if v is None:
+        return ""
+    if isinstance(v, (dict, list)):  # meta, if the driver decoded the JSON
+        return json.dumps(v, sort_keys=True)
+    return str(v)
+
+class _PartitionEncoder:
+    # memory is the encoded columns: ~60 bytes per row plus the meta text
+    def __init__(self):
+        self.ids, self.sessions = bytearray(), bytearray()
+        self.created = array("q")
+        self.ints = {c: array("q") for c in INT_COLUMNS}
+        self.dicts = {c: _DictColumn() for c in DICT_COLUMNS}
+        self.meta = _Utf8Column()
+
+    def add(self, rows) -> None:
+        zero = bytes(16)
+        for r in rows:
+            self.ids += r.id.bytes
+            self.created.append((r.created_at - _EPOCH) // _US)
+            self.sessions += r.liveness_session_id.bytes if r.liveness_session_id else zero
+            for c in INT_COLUMNS:
+                self.ints[c].append(getattr(r, c) or 0)
+            for c in DICT_COLUMNS:
+                self.dicts[c].append(_as_text(getattr(r, c)))
+            self.meta.append(_as_text(r.meta))
+
+    def __len__(self) -> int:
+        return len(self.created)
+
+    def arrays(self) -> dict[str, np.ndarray]:
+        n = len(self.created)
+        arrays = {
+            "id": np.frombuffer(bytes(self.ids), dtype=np.uint8).reshape(n, 16),
+            "liveness_session_id": np.frombuffer(bytes(self.sessions), dtype=np.uint8).reshape(n, 16),
+            "created_at": np.frombuffer(self.created, dtype=np.int64),
+            "meta__bytes": np.frombuffer(bytes(self.meta.data), dtype=np.uint8),
+            "meta__offsets": np.frombuffer(self.meta.offsets, dtype=np.int64),
+        }
+        for c in INT_COLUMNS:
+            arrays[c] = np.frombuffer(self.ints[c], dtype=np.int64)
+        for c in DICT_COLUMNS:
+            arrays[c] = np.frombuffer(self.dicts[c].codes, dtype=np.int32)
+            arrays[c + "__values"] = self.dicts[c].values()
+        return arrays
+
+def _write(path: Path, arrays: dict[str, np.ndarray]) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.stem}.{os.getpid()}.tmp.npz")
+    np.savez_compressed(tmp, **arrays)
+    os.replace(tmp, path)  # a half-written file never has the final name
+
+def archive_path(month: date) -> Path:
+    return Path(settings.TRANSACTIONS_ARCHIVE_DIR) / f"{partition_name('transactions', month)}.npz"
+
+async def partition_totals(conn, name: str) -> dict:
+    sums = ", ".join(f"CAST(COALESCE(sum({c}), 0) AS bigint) AS {c}" for c in INT_COLUMNS)
+    row = (await conn.execute(text(f"SELECT count(*) AS rows, {sums} FROM {name}"))).mappings().one()
+    return {k: int(v) for k, v in row.items()}
+
+def archive_totals(path) -> dict:
+    # the same figures as partition_totals, read back from the written file
+    _, cols = load_archive(path)
+    return {"rows": len(cols["created_at"]), **{c: int(cols[c].sum()) for c in INT_COLUMNS}}
+
+async def export_partition(name: str, month: date) -> tuple[Path, int]:
+    # streams the partition through a server-side cursor
+    enc = _PartitionEncoder()
+    cols = ["id", "created_at", "liveness_session_id"] + INT_COLUMNS + DICT_COLUMNS + ["meta"]
+    async with engine.connect() as conn:
+        result = await conn.stream(
+            text(f"SELECT {', '.join(cols)} FROM {name} ORDER BY created_at, id")
+            .execution_options(yield_per=settings.REPORT_FETCH_ROWS)
+        )
+        async for rows in result.partitions():
+            await asyncio.to_thread(enc.add, rows)
+        expected = (await conn.execute(text(f"SELECT count(*) FROM {name}"))).scalar()
+
+    n = len(enc)
+    if n != expected:
+        raise RuntimeError(f"{name}: exported {n} rows, partition has {expected}")
+    arrays = await asyncio.to_thread(enc.arrays)
+    manifest = {
+        "format_version": FORMAT_VERSION,
+        "table": "transactions",
+        "month": month.isoformat(),
+        "rows": n,
+        "totals": {c: int(arrays[c].sum()) for c in INT_COLUMNS},
+        "exported_at": datetime.now(timezone.utc).isoformat(),
+    }
+    arrays["__manifest__"] = np.array(json.dumps(manifest))
+
+    path = archive_path(month)
+    await asyncio.to_thread(_write, path, arrays)
+    return path, n
+
+def _decode_dict(z, c: str) -> np.ndarray:
+    values = z[c + "__values"]
+    return values[z[c]] if len(values) else np.zeros(len(z[c]), dtype="U1")
+
+def load_archive(path) -> tuple[dict, dict]:
+    # -> (manifest, columns); dictionary-encoded columns come back decoded,
+    # meta as Utf8Values (format 1 files: a decoded string array)
+    with np.load(path, allow_pickle=False) as z:
+        manifest = json.loads(str(z["__manifest__"]))
+        cols = {
+            "id": z["id"],
+            "liveness_session_id": z["liveness_session_id"],
+            "created_at": z["created_at"].astype("datetime64[us]"),
+        }
+        for c in INT_COLUMNS:
+            cols[c] = z[c]
+        for c in DICT_COLUMNS:
+            cols[c] = _decode_dict(z, c)
+        if "meta__bytes" in z.files:
+            cols["meta"] = Utf8Values(z["meta__bytes"], z["meta__offsets"])
+        else:
+            cols["meta"] = _decode_dict(z, "meta")
+    return manifest, cols
+
+async def drop_archived(name: str, path) -> None:
+    # drops the partition only if the file read back matches it
+    stored = await asyncio.to_thread(archive_totals, path)
+    async with engine.begin() as conn:
+        # no writes between the comparison and the drop
+        await conn.execute(text(f"LOCK TABLE {name} IN SHARE MODE"))
+        live = await partition_totals(conn, name)
+        if stored != live:
+            raise RuntimeError(f"{path}: archive totals {stored} != partition {live}, not dropping {name}")
+        await drop_partition(conn, "transactions", name)
+
+async def archive_closed_months() -> list[str]:
+    # Months older than TRANSACTIONS_HOT_MONTHS: export, verify, drop. Without
+    # an archive directory nothing is dropped - ledger rows are never lost.
+    if not settings.TRANSACTIONS_ARCHIVE_DIR:
+        return []
+    today = datetime.now(timezone.utc).date()
+    cutoff = add_months(month_start(today), -settings.TRANSACTIONS_HOT_MONTHS)
+    archived = []
+    async with engine.connect() as lock_conn:
+        # session-level lock (survives the commits below); other workers skip
+        if not await try_session_lock(lock_conn, LOCK_NAME):
+            return []
+        await lock_conn.commit()
+        try:
+            async with engine.connect() as conn:
+                closed = await closed_partitions_before(conn, "transactions", cutoff)
+            for name, month in closed:
+                path, n = await export_partition(name, month)
+                await drop_archived(name, path)
+                log.info("archived %s: %d rows -> %s", name, n, path)
+                archived.append(name)
+        finally:
+            await unlock(lock_conn, LOCK_NAME)
+            await lock_conn.commit()
+    return archived
@@ -3,7 +3,21 @@ const TERMINAL_TOKEN = "PUT_TERMINAL_TOKEN_HERE";
 
 let sessionId = null;
 let livenessToken = null;
+// One key per liveness pass: resending the same payment after a network
+// error replays the server's first answer instead of paying twice.
+let payKey = null;
 let frameTimer = null;
+let ws = null;
+const USE_WEBSOCKET = true;
+// Never have more than one frame in flight: when the server is slower than
+// the frame interval we skip ticks instead of piling up requests, and a
+// "busy" reply (our frame was superseded) skips one more tick.
+let frameInFlight = false;
+let skipTicks = 0;
+// Object URL of the reference photo on screen (revoked when replaced) and a
+// counter so a slow photo response can't overwrite a newer employee's.
+let photoUrl = null;
+let photoSeq = 0;
 
 function log(msg) {
   const el = document.getElementById("log");
@@ -28,11 +42,28 @@ async function loadEmployee() {
   document.getElementById("fio").textContent = d.full_name;
   document.getElementById("subsidy").textContent = (d.subsidy_today_left_cents/100).toFixed(2);
   document.getElementById("monthly").textContent = (d.monthly_left_cents/100).toFixed(2);
-  document.getElementById("refPhoto").src = d.photo_base64 ? `data:image/jpeg;base64,${d.photo_base64}` : "";
+  setPhoto(null);
+  if (d.photo_url) loadPhoto(d.photo_url);
   document.getElementById("hint").textContent = d.needs_face_enrollment ? "Нужно зарегистрировать лицо" : "—";
   log("Employee loaded");
 }
 
+// The photo comes separately so the card tap screen doesn't wait for it.
+function setPhoto(blob) {
+  photoSeq++;
+  if (photoUrl) URL.revokeObjectURL(photoUrl);
+  photoUrl = blob ? URL.createObjectURL(blob) : null;
+  document.getElementById("refPhoto").src = photoUrl || "";
+}
+
+async function loadPhoto(url) {
+  const seq = photoSeq;
+  const r = await fetch(`${API}${url}`, { headers: { "X-Terminal-Token": TERMINAL_TOKEN } });
+  if (!r.ok) return;
+  const blob = await r.blob();
+  if (seq === photoSeq) setPhoto(blob);  // otherwise another employee was loaded meanwhile
+}
+
 async function startLiveness() {
   const uid = document.getElementById("cardUid").value.trim();
   const r = await fetch(`${API}/api/start_liveness`, {
@@ -47,29 +78,81 @@ async function startLiveness() {
   document.getElementById("hint").textContent = j.data.commands[0].text;
   log("Liveness started: " + sessionId);
 
-  if (frameTimer) clearInterval(frameTimer);
-  frameTimer = setInterval(sendFrame, j.data.frame_interval_ms || 150);
+  stopFrames();
+  if (USE_WEBSOCKET && j.data.ws_url && window.WebSocket) {
+    startWsFrames(j.data.ws_url, j.data.frame_interval_ms || 150);
+  } else {
+    frameTimer = setInterval(sendFrame, j.data.frame_interval_ms || 150);
+  }
 }
 
-async function sendFrame() {
-  if (!sessionId) return;
-
+async function captureFrame() {
   const video = document.getElementById("video");
   const canvas = document.getElementById("canvas");
   const ctx = canvas.getContext("2d");
   ctx.drawImage(video, 0, 0, canvas.width, canvas.height);
+  return await new Promise(resolve => canvas.toBlob(resolve, "image/jpeg", 0.7));
+}
 
-  const blob = await new Promise(resolve => canvas.toBlob(resolve, "image/jpeg", 0.7));
-  const fd = new FormData();
-  fd.append("session_id", sessionId);
-  fd.append("image", blob, "frame.jpg");
+// One socket per liveness session: authenticate once, then stream binary
+// JPEG frames; the server pushes hint/status after every frame.
+function startWsFrames(wsUrl, intervalMs) {
+  const proto = location.protocol === "https:" ? "wss:" : "ws:";
+  const sock = new WebSocket(`${proto}//${location.host}${wsUrl}`);
+  ws = sock;
+  sock.onopen = () => {
+    sock.send(JSON.stringify({ token: TERMINAL_TOKEN }));
+    frameTimer = setInterval(async () => {
+      if (sock.readyState !== WebSocket.OPEN || frameInFlight) return;
+      if (skipTicks > 0) { skipTicks--; return; }
+      frameInFlight = true;
+      sock.send(await captureFrame());
+    }, intervalMs);
+  };
+  sock.onmessage = (ev) => {
+    const j = JSON.parse(ev.data);
+    frameInFlight = false;
+    if (!j.ok) {
+      document.getElementById("hint").textContent = j.message || "Ошибка";
+      log(JSON.stringify(j));
+      return;
+    }
+    if (j.data.busy) skipTicks = 1;
+    document.getElementById("hint").textContent = j.data.hint;
+    if (j.data.status !== "IN_PROGRESS") {
+      log("Liveness status: " + j.data.status);
+      stopFrames();
+    }
+  };
+  sock.onclose = () => {
+    if (ws !== sock) return;
+    if (frameTimer) clearInterval(frameTimer);
+    frameTimer = null;
+    ws = null;
+  };
+}
 
-  const r = await fetch(`${API}/api/liveness_frame`, {
-    method: "POST",
-    headers: { "X-Terminal-Token": TERMINAL_TOKEN },
-    body: fd
-  });
-  const j = await r.json();
+async function sendFrame() {
+  if (!sessionId || frameInFlight) return;
+  if (skipTicks > 0) { skipTicks--; return; }
+
+  frameInFlight = true;
+  let j;
+  try {
+    const blob = await captureFrame();
+    const fd = new FormData();
+    fd.append("session_id", sessionId);
+    fd.append("image", blob, "frame.jpg");
+
+    const r = await fetch(`${API}/api/liveness_frame`, {
+      method: "POST",
+      headers: { "X-Terminal-Token": TERMINAL_TOKEN },
+      body: fd
+    });
+    j = await r.json();
+  } finally {
+    frameInFlight = false;
+  }
   if (!j.ok) {
     document.getElementById("hint").textContent = j.message || "Ошибка";
     log(JSON.stringify(j));
@@ -77,6 +160,7 @@ async function sendFrame() {
     return;
   }
 
+  if (j.data.busy) skipTicks = 1;
   document.getElementById("hint").textContent = j.data.hint;
   if (j.data.status !== "IN_PROGRESS") {
     log("Liveness status: " + j.data.status);
@@ -87,6 +171,10 @@ async function sendFrame() {
 function stopFrames() {
   if (frameTimer) clearInterval(frameTimer);
   frameTimer = null;
+  frameInFlight = false;
+  skipTicks = 0;
+  if (ws) ws.close();
+  ws = null;
 }
 
 async function finishLiveness() {
@@ -100,6 +188,7 @@ async function finishLiveness() {
   if (!j.ok) { log(JSON.stringify(j)); return; }
   if (j.data.result === "PASSED") {
     livenessToken = j.data.liveness_token;
+    payKey = crypto.randomUUID();
     log("Liveness PASSED");
   } else {
     log("Liveness result: " + j.data.result + " reason=" + (j.data.reason_code || ""));
@@ -111,11 +200,20 @@ async function pay() {
   const rub = parseFloat(document.getElementById("amountRub").value || "0");
   const amount_cents = Math.round(rub * 100);
 
-  const r = await fetch(`${API}/api/pay`, {
-    method: "POST",
-    headers: { "Content-Type": "application/json", "X-Terminal-Token": TERMINAL_TOKEN },
-    body: JSON.stringify({ card_uid: uid, amount_cents, liveness_token: livenessToken })
-  });
+  let r = null;
+  for (let attempt = 0; attempt < 3 && !r; attempt++) {
+    try {
+      r = await fetch(`${API}/api/pay`, {
+        method: "POST",
+        headers: { "Content-Type": "application/json", "X-Terminal-Token": TERMINAL_TOKEN, "Idempotency-Key": payKey },
+        body: JSON.stringify({ card_uid: uid, amount_cents, liveness_token: livenessToken })
+      });
+    } catch (e) {
+      log("Network error, retrying payment...");
+      await new Promise(res => setTimeout(res, 500 * (attempt + 1)));
+    }
+  }
+  if (!r) { log("Payment not sent"); return; }
   const j = await r.json();
   log(JSON.stringify(j, null, 2));
 }
@@ -0,0 +1,171 @@
+import argparse
+import json
+import platform
+import resource
+import sys
+import time
+import tracemalloc
+from importlib.metadata import PackageNotFoundError, version
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from app.core.errors import AppError
+from app.services import face
+from app.services.liveness import command_satisfied
+
+# Usage:
+#   python -m scripts.bench_face --frames fixtures/ [--resolutions 320x240,640x480,1280x720] \
+#       [--iterations 20] [--out bench.json]
+#   python -m scripts.bench_face --frames fixtures/ --compare bench.json [--tolerance 0.15]
+#
+# Times each face/liveness pipeline stage in-process on fixture JPEGs (frames
+# with exactly one face) rescaled to every resolution, and prints per-stage
+# p50/p95/p99 latency, throughput and heap peak as JSON (plus the process
+# peak RSS once, in meta). With --compare the run
+# is checked against a saved baseline: any stage whose p50 or p95 grew by more
+# than --tolerance is reported and the exit code is 1.
+
+PACKAGES = ["opencv-python", "mediapipe", "face-recognition", "dlib", "numpy"]
+
+def _versions() -> dict:
+    out = {"python": platform.python_version(), "platform": platform.platform()}
+    for pkg in PACKAGES:
+        try:
+            out[pkg] = version(pkg)
+        except PackageNotFoundError:
+            out[pkg] = None
+    return out
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+def load_fixtures(frames_dir: Path, resolutions: list[tuple[int, int]]) -> dict[str, list[bytes]]:
+    paths = sorted(p for p in frames_dir.iterdir() if p.suffix.lower() in {".jpg", ".jpeg", ".png"})
+    if not paths:
+        raise SystemExit(f"no fixture images in {frames_dir}")
+    out = {}
+    for w, h in resolutions:
+        jpegs = []
+        for p in paths:
+            img = cv2.imread(str(p), cv2.IMREAD_COLOR)
+            img = cv2.resize(img, (w, h), interpolation=cv2.INTER_AREA)
+            ok, buf = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 90])
+            jpegs.append(buf.tobytes())
+        out[f"{w}x{h}"] = jpegs
+    return out
+
+def _heap_peak_mb(fn, inputs: list) -> float:
+    # one extra, untimed pass under tracemalloc: peak of Python and NumPy
+    # allocations made by the stage (native cv2/dlib buffers aren't traced)
+    tracemalloc.start()
+    try:
+        for args in inputs:
+            try:
+                fn(*args)
+            except AppError:
+                pass
+        return tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+    finally:
+        tracemalloc.stop()
+
+def run_stage(fn, inputs: list, iterations: int) -> dict:
+    times = []
+    errors = 0
+    for _ in range(iterations):
+        for args in inputs:
+            t0 = time.perf_counter_ns()
+            try:
+                fn(*args)
+            except AppError:
+                errors += 1
+            times.append(time.perf_counter_ns() - t0)
+    ms = np.asarray(times, dtype=np.float64) / 1e6
+    return {
+        "n": len(times),
+        "errors": errors,
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "throughput_per_sec": float(len(ms) / (ms.sum() / 1000.0)) if ms.sum() > 0 else None,
+        "heap_peak_mb": _heap_peak_mb(fn, inputs),
+    }
+
+def bench_resolution(jpegs: list[bytes], iterations: int) -> dict[str, dict]:
+    frames = [face.decode_image(b) for b in jpegs]
+    detected = []
+    for bgr in frames:
+        try:
+            detected.append((bgr, *face.detect_single_face_and_encoding(bgr)))
+        except AppError:
+            pass
+    if not detected:
+        raise SystemExit("no face detected in fixtures at this resolution")
+    stored = detected[0][2]
+    rng = np.random.default_rng(0)
+    probes = [(stored, emb + rng.normal(0, 0.01, emb.shape).astype(np.float32)) for _, _, emb in detected]
+    anchor = {"yaw": 0.0, "pitch": 0.0, "roll": 0.0}
+    poses = [(t, anchor, {"yaw": float(y), "pitch": 0.0, "roll": float(r)})
+             for t in ("TURN_LEFT", "TURN_RIGHT", "TILT") for y, r in rng.uniform(-30, 30, (8, 2))]
+
+    return {
+        "decode_image": run_stage(face.decode_image, [(b,) for b in jpegs], iterations),
+        "detect_single_face_and_encoding": run_stage(face.detect_single_face_and_encoding, [(f,) for f in frames], iterations),
+        "image_quality_checks": run_stage(face.image_quality_checks, [(bgr, bbox) for bgr, bbox, _ in detected], iterations),
+        "estimate_pose_and_blink": run_stage(face.estimate_pose_and_blink, [(f,) for f in frames], iterations),
+        "analyze_frame": run_stage(face.analyze_frame, [(f,) for f in frames], iterations),
+        "face_match": run_stage(face.face_match, probes, iterations * 10),
+        "command_satisfied": run_stage(command_satisfied, poses, iterations * 10),
+    }
+
+def compare(current: dict, baseline: dict, tolerance: float) -> list[str]:
+    regressions = []
+    for res, stages in current["results"].items():
+        for stage, cur in stages.items():
+            base = baseline.get("results", {}).get(res, {}).get(stage)
+            if not base:
+                continue
+            for key in ("p50_ms", "p95_ms"):
+                if base[key] > 0 and cur[key] > base[key] * (1.0 + tolerance):
+                    regressions.append(f"{res} {stage} {key}: {base[key]:.3f} -> {cur[key]:.3f} ms (+{cur[key] / base[key] - 1:.0%})")
+    return regressions
+
+def main():
+    ap = argparse.ArgumentParser(description="Micro-benchmarks for the face/liveness pipeline stages.")
+    ap.add_argument("--frames", type=Path, required=True)
+    ap.add_argument("--resolutions", default="320x240,640x480,1280x720")
+    ap.add_argument("--iterations", type=int, default=20)
+    ap.add_argument("--out", default="-")
+    ap.add_argument("--compare", type=Path)
+    ap.add_argument("--tolerance", type=float, default=0.15)
+    args = ap.parse_args()
+
+    resolutions = [tuple(int(v) for v in r.split("x")) for r in args.resolutions.split(",")]
+    face.init_worker()
+    fixtures = load_fixtures(args.frames, resolutions)
+
+    report = {
+        "meta": {**_versions(), "frames": len(next(iter(fixtures.values()))), "iterations": args.iterations},
+        "results": {res: bench_resolution(jpegs, args.iterations) for res, jpegs in fixtures.items()},
+    }
+    # ru_maxrss only ever grows, so it is a whole-run figure, not a per-stage one
+    report["meta"]["peak_rss_mb"] = _peak_rss_mb()
+    text = json.dumps(report, indent=2)
+    if args.out == "-":
+        print(text)
+    else:
+        Path(args.out).write_text(text, encoding="utf-8")
+
+    if args.compare:
+        baseline = json.loads(args.compare.read_text(encoding="utf-8"))
+        regressions = compare(report, baseline, args.tolerance)
+        for line in regressions:
+            print("REGRESSION", line, file=sys.stderr)
+        sys.exit(1 if regressions else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+import argparse
+import asyncio
+import csv
+import itertools
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from sqlalchemy import insert, select, update
+
+from app.core.errors import AppError
+from app.db.models import Employee, Face
+from app.db.session import SessionLocal
+from app.services import face
+
+# Usage:
+#   python -m scripts.bulk_enroll --dir photos/ [--workers 8] [--batch 500] [--report failures.csv]
+#   python -m scripts.bulk_enroll --manifest photos.csv
+#
+# Offline face enrollment for HR onboarding. Photos are keyed by tab_no:
+#   photos/<tab_no>.jpg, photos/<tab_no>_<n>.jpg or photos/<tab_no>/*.jpg
+# or a CSV manifest with columns tab_no,path (a tab_no that itself ends in
+# _<digits> needs the subdirectory layout or the manifest). Images are encoded
+# on all cores; each employee's photos are averaged into one template like
+# /api/enroll_face, and Face rows are written in batched transactions
+# (previous active faces are deactivated). Per-image failures (FACE_NOT_FOUND, MULTIPLE_FACES, BLURRY, ...)
+# are reported and do not stop the run.
+
+IMAGE_EXT = {".jpg", ".jpeg", ".png"}
+MAX_IMAGES_PER_EMPLOYEE = 10
+
+def scan_dir(root: Path) -> list[tuple[str, str]]:
+    items = []
+    for p in sorted(root.iterdir()):
+        if p.is_dir():
+            items.extend((p.name, str(f)) for f in sorted(p.iterdir()) if f.suffix.lower() in IMAGE_EXT)
+        elif p.suffix.lower() in IMAGE_EXT:
+            items.append((_tab_no(p.stem), str(p)))
+    return items
+
+def _tab_no(stem: str) -> str:
+    # only a trailing numeric _<n> is a photo counter; the rest is the tab_no
+    head, sep, tail = stem.rpartition("_")
+    return head if sep and head and tail.isdigit() else stem
+
+def read_manifest(path: Path) -> list[tuple[str, str]]:
+    with open(path, newline="", encoding="utf-8") as f:
+        return [(row["tab_no"].strip(), row["path"].strip()) for row in csv.DictReader(f)]
+
+def _encode_path(path: str):
+    # runs in a worker process; errors are returned, not raised, so one bad
+    # photo doesn't poison the whole map()
+    try:
+        with open(path, "rb") as f:
+            return face.encode_face_image(f.read()), None
+    except AppError as e:
+        return None, e.code
+    except OSError:
+        return None, "READ_ERROR"
+    except Exception as e:  # cv2.error, ValueError, MemoryError from the decoder or dlib
+        return None, f"ENCODE_ERROR:{type(e).__name__}"
+
+async def write_batch(batch: list[tuple[str, object, float]], failures: list, dry_run: bool) -> int:
+    async with SessionLocal() as db:
+        tab_nos = [t for t, _, _ in batch]
+        ids = dict((await db.execute(select(Employee.tab_no, Employee.id).where(Employee.tab_no.in_(tab_nos)))).all())
+        rows = []
+        for tab_no, emb, quality in batch:
+            if tab_no not in ids:
+                failures.append((tab_no, "", "EMPLOYEE_NOT_FOUND"))
+                continue
+            rows.append({"employee_id": ids[tab_no], "embedding": emb.tolist(), "quality_score": quality, "is_active": True})
+        if not rows or dry_run:
+            return len(rows)
+        emp_ids = [r["employee_id"] for r in rows]
+        await db.execute(
+            update(Face).where(Face.employee_id.in_(emp_ids), Face.is_active == True).values(is_active=False)
+        )
+        await db.execute(insert(Face), rows)
+        await db.commit()
+        return len(rows)
+
+async def main():
+    ap = argparse.ArgumentParser(description="Bulk face enrollment from a photo directory or manifest.")
+    src = ap.add_mutually_exclusive_group(required=True)
+    src.add_argument("--dir", type=Path)
+    src.add_argument("--manifest", type=Path)
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--batch", type=int, default=500, help="employees per transaction")
+    ap.add_argument("--report", default="-", help="CSV of per-image failures")
+    ap.add_argument("--dry-run", action="store_true")
+    args = ap.parse_args()
+
+    items = scan_dir(args.dir) if args.dir else read_manifest(args.manifest)
+    # group by tab_no so each employee's photos come out of map() together
+    items.sort(key=lambda it: it[0])
+    items = [it for _, grp in itertools.groupby(items, key=lambda it: it[0]) for it in list(grp)[:MAX_IMAGES_PER_EMPLOYEE]]
+
+    failures: list[tuple[str, str, str]] = []
+    batch: list[tuple[str, object, float]] = []
+    enrolled = 0
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=face.init_worker) as ex:
+        results = ex.map(_encode_path, [p for _, p in items], chunksize=8)
+        for tab_no, grp in itertools.groupby(zip(items, results), key=lambda x: x[0][0]):
+            embeddings = []
+            for (_, path), (emb, code) in grp:
+                if code:
+                    failures.append((tab_no, path, code))
+                else:
+                    embeddings.append(emb)
+            if not embeddings:
+                continue
+            avg, quality = face.enrollment_template(embeddings)
+            batch.append((tab_no, avg, quality))
+            if len(batch) >= args.batch:
+                enrolled += await write_batch(batch, failures, args.dry_run)
+                batch = []
+        if batch:
+            enrolled += await write_batch(batch, failures, args.dry_run)
+
+    out = sys.stdout if args.report == "-" else open(args.report, "w", newline="", encoding="utf-8")
+    try:
+        w = csv.writer(out)
+        w.writerow(["tab_no", "path", "code"])
+        w.writerows(failures)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    print(f"images={len(items)} enrolled={enrolled} failures={len(failures)}", file=sys.stderr)
+
+if __name__ == "__main__":
+    asyncio.run(main())
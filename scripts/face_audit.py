@@ -0,0 +1,145 @@
+import argparse
+import asyncio
+import csv
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import select
+
+from app.core.config import settings
+from app.db.models import Employee, Face
+from app.db.session import SessionLocal
+from app.services.face_index import pairwise_sq_l2
+
+# Usage:
+#   python -m scripts.face_audit [--threshold 0.45] [--block 4096] [--workers 4] [--out pairs.csv]
+#   python -m scripts.face_audit --incremental [--state .face_audit_state.json]
+#
+# Finds active face templates of *different* employees that are closer than
+# the threshold (duplicate enrollments, shared identities). All active
+# embeddings are streamed into one contiguous float32 matrix and compared in
+# blocks of --block rows, so memory stays at O(N*128 + block^2) for any N.
+# With --incremental only faces created since the previous run are compared
+# against everything.
+
+STATE_FILE = ".face_audit_state.json"
+
+# worker-process globals, set once per worker by _init_worker
+_M: np.ndarray | None = None
+_SQ: np.ndarray | None = None
+_EMP: np.ndarray | None = None
+
+def _init_worker(matrix, sq_norms, emp_codes):
+    global _M, _SQ, _EMP
+    _M, _SQ, _EMP = matrix, sq_norms, emp_codes
+
+def _scan_block(rows: tuple[int, int], cols: tuple[int, int], thr_sq: float, upper_only: bool):
+    # returns (i, j, dist) for pairs under the threshold within one block
+    r0, r1 = rows
+    c0, c1 = cols
+    d2 = pairwise_sq_l2(_M[r0:r1], _M[c0:c1], _SQ[c0:c1])
+    mask = d2 <= thr_sq
+    if upper_only:
+        # diagonal block (rows == cols): keep each unordered pair once
+        mask &= np.triu(np.ones_like(mask, dtype=bool), k=1)
+    mask &= _EMP[r0:r1, None] != _EMP[None, c0:c1]
+    ii, jj = np.nonzero(mask)
+    return [(int(r0 + i), int(c0 + j), float(np.sqrt(d2[i, j]))) for i, j in zip(ii, jj)]
+
+async def load_faces(batch: int = 5000):
+    face_ids, emp_ids, tab_nos, created, vecs = [], [], [], [], []
+    async with SessionLocal() as db:
+        stmt = (
+            select(Face.id, Face.employee_id, Employee.tab_no, Face.created_at, Face.embedding)
+            .join(Employee, Employee.id == Face.employee_id)
+            .where(Face.is_active == True)
+            .order_by(Face.created_at)
+            .execution_options(yield_per=batch)
+        )
+        async for part in (await db.stream(stmt)).partitions(batch):
+            for fid, eid, tab_no, created_at, emb in part:
+                face_ids.append(fid)
+                emp_ids.append(eid)
+                tab_nos.append(tab_no)
+                created.append(created_at)
+                vecs.append(np.asarray(emb, dtype=np.float32))
+    matrix = np.ascontiguousarray(np.stack(vecs)) if vecs else np.zeros((0, 128), dtype=np.float32)
+    return face_ids, emp_ids, tab_nos, created, matrix
+
+def find_pairs(matrix, emp_ids, threshold: float, block: int, workers: int, new_from: int = 0):
+    n = len(matrix)
+    codes = {e: i for i, e in enumerate(dict.fromkeys(emp_ids))}
+    emp_codes = np.fromiter((codes[e] for e in emp_ids), dtype=np.int64, count=n)
+    sq = np.einsum("ij,ij->i", matrix, matrix)
+    thr_sq = threshold * threshold
+
+    # Each row block is compared with all columns before it plus the upper
+    # triangle of its own diagonal block: every unordered pair exactly once.
+    # In incremental mode rows start at the first new face (they sort last by
+    # created_at), so only new-vs-old and new-vs-new pairs are computed.
+    tasks = []
+    for r0 in range(new_from, n, block):
+        r1 = min(n, r0 + block)
+        for c0 in range(0, r0, block):
+            tasks.append(((r0, r1), (c0, min(r0, c0 + block)), thr_sq, False))
+        tasks.append(((r0, r1), (r0, r1), thr_sq, True))
+
+    if workers <= 1:
+        _init_worker(matrix, sq, emp_codes)
+        results = [_scan_block(*t) for t in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(matrix, sq, emp_codes)) as ex:
+            results = list(ex.map(_scan_block, *zip(*tasks))) if tasks else []
+    pairs = [p for part in results for p in part]
+    pairs.sort(key=lambda p: p[2])
+    return pairs
+
+def read_state(path: str) -> datetime | None:
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return datetime.fromisoformat(json.load(f)["last_created_at"])
+
+def write_state(path: str, last_created_at: datetime) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"last_created_at": last_created_at.isoformat()}, f)
+
+async def main():
+    ap = argparse.ArgumentParser(description="Audit enrolled faces for near-duplicate templates across employees.")
+    ap.add_argument("--threshold", type=float, default=settings.FACE_DIST_THRESHOLD)
+    ap.add_argument("--block", type=int, default=4096)
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--incremental", action="store_true")
+    ap.add_argument("--state", default=STATE_FILE)
+    ap.add_argument("--out", default="-")
+    args = ap.parse_args()
+
+    face_ids, emp_ids, tab_nos, created, matrix = await load_faces()
+    new_from = 0
+    if args.incremental:
+        since = read_state(args.state)
+        if since is not None:
+            new_from = next((i for i, c in enumerate(created) if c > since), len(created))
+
+    pairs = find_pairs(matrix, emp_ids, args.threshold, args.block, args.workers, new_from)
+
+    out = sys.stdout if args.out == "-" else open(args.out, "w", newline="", encoding="utf-8")
+    try:
+        w = csv.writer(out)
+        w.writerow(["dist", "face_id_a", "employee_id_a", "tab_no_a", "face_id_b", "employee_id_b", "tab_no_b"])
+        for i, j, dist in pairs:
+            w.writerow([f"{dist:.4f}", face_ids[i], emp_ids[i], tab_nos[i], face_ids[j], emp_ids[j], tab_nos[j]])
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    if created:
+        write_state(args.state, created[-1])
+    print(f"faces={len(face_ids)} compared_from={new_from} suspicious_pairs={len(pairs)}", file=sys.stderr)
+
+if __name__ == "__main__":
+    asyncio.run(main())
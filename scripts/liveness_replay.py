@@ -0,0 +1,137 @@
+import argparse
+import json
+import sys
+import time
+from collections import Counter, defaultdict
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+
+from app.core.config import settings
+from app.core.errors import AppError
+from app.services import face
+from app.services.liveness import advance_session, keyframe_track
+from app.services.liveness_recorder import SessionArchive, list_archives
+
+# Usage:
+#   python -m scripts.liveness_replay /var/lib/meal/liveness [--realtime] [--out report.json]
+#
+# Feeds recorded sessions (LIVENESS_RECORD_DIR, see app.services.liveness_recorder)
+# through the same analysis and state machine as process_frame, in-process and
+# without the database. Frames are replayed at maximum speed by default, or at
+# the recorded pace with --realtime. Prints each session's replayed outcome next
+# to the live one plus per-stage timings, so two pipeline versions can be
+# compared on identical input.
+
+STAGES = ["decode", "locate", "encode", "advance"]
+
+def _new_state(meta: dict) -> SimpleNamespace:
+    return SimpleNamespace(
+        status="IN_PROGRESS", commands=meta["commands"], current_index=0,
+        baseline_pose=None, anchor_pose=None, min_face_dist=None, blink_seen=False,
+        track_state=None, fail_reason_code=None,
+    )
+
+def replay_session(archive: SessionArchive, realtime: bool, timings: dict[str, list[float]]) -> dict:
+    meta = archive.meta
+    sess = _new_state(meta)
+    stored = np.asarray(meta["stored_embedding"], dtype=np.float32)
+    sid = meta["session_id"]
+    scale = settings.CV_FRAME_DECODE_SCALE
+    errors = Counter()
+    keyframes = 0
+    processed = 0
+    t_first = None
+    wall_start = time.perf_counter()
+
+    for i in range(len(archive)):
+        ts, jpeg = archive.frame(i)
+        if t_first is None:
+            t_first = ts
+        if realtime:
+            delay = (ts - t_first) - (time.perf_counter() - wall_start)
+            if delay > 0:
+                time.sleep(delay)
+        if ts - t_first >= settings.LIVENESS_SESSION_TTL_SEC:
+            sess.status = "EXPIRED"
+            break
+        processed += 1
+        try:
+            t0 = time.perf_counter()
+            bgr = face.decode_image(jpeg, scale)
+            t1 = time.perf_counter()
+            a = face.locate_face(bgr, sid, scale)
+            t2 = time.perf_counter()
+            timings["decode"].append((t1 - t0) * 1000)
+            timings["locate"].append((t2 - t1) * 1000)
+            track = keyframe_track(sess)
+            if face.needs_embedding(track, a):
+                native = face.decode_image(jpeg) if scale > 1 else None
+                a.embedding = face.encode_face(bgr, a.bbox, native)
+                timings["encode"].append((time.perf_counter() - t2) * 1000)
+                keyframes += 1
+            sess.track_state = face.next_track(track, a)
+            t3 = time.perf_counter()
+            advance_session(sess, a.pose, a.blink, a.embedding, stored)
+            timings["advance"].append((time.perf_counter() - t3) * 1000)
+        except AppError as e:
+            errors[e.code] += 1
+        if sess.status != "IN_PROGRESS":
+            break
+
+    live = archive.outcome or {}
+    return {
+        "session_id": sid,
+        "frames": len(archive),
+        "processed": processed,
+        "keyframes": keyframes,
+        "status": sess.status,
+        "fail_reason_code": sess.fail_reason_code,
+        "min_face_dist": sess.min_face_dist,
+        "frame_errors": dict(errors),
+        "live_status": live.get("status"),
+        "live_fail_reason_code": live.get("fail_reason_code"),
+        "matches_live": live.get("status") == sess.status if live else None,
+    }
+
+def _summary(ms: list[float]) -> dict:
+    if not ms:
+        return {"n": 0}
+    a = np.asarray(ms)
+    return {"n": len(a), "p50_ms": float(np.percentile(a, 50)), "p95_ms": float(np.percentile(a, 95)),
+            "p99_ms": float(np.percentile(a, 99)), "total_ms": float(a.sum())}
+
+def main():
+    ap = argparse.ArgumentParser(description="Replay recorded liveness sessions offline.")
+    ap.add_argument("archives", type=Path, help="session archive directory or a directory of them")
+    ap.add_argument("--realtime", action="store_true", help="replay at the recorded frame pace")
+    ap.add_argument("--out", default="-")
+    args = ap.parse_args()
+
+    face.init_worker()
+    timings: dict[str, list[float]] = defaultdict(list)
+    sessions = []
+    for path in list_archives(args.archives):
+        archive = SessionArchive.open(path)
+        try:
+            sessions.append(replay_session(archive, args.realtime, timings))
+        finally:
+            archive.close()
+
+    outcomes = Counter(s["status"] for s in sessions)
+    report = {
+        "sessions": sessions,
+        "outcomes": dict(outcomes),
+        "mismatches_vs_live": sum(1 for s in sessions if s["matches_live"] is False),
+        "stages": {st: _summary(timings[st]) for st in STAGES},
+    }
+    text = json.dumps(report, indent=2)
+    if args.out == "-":
+        print(text)
+    else:
+        Path(args.out).write_text(text, encoding="utf-8")
+    print(f"sessions={len(sessions)} " + " ".join(f"{k}={v}" for k, v in outcomes.items()), file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
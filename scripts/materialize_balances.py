@@ -0,0 +1,34 @@
+import argparse
+import asyncio
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo
+
+from app.core.config import settings
+from app.db.session import SessionLocal
+from app.services.balances import materialize_day
+
+# Usage:
+#   python -m scripts.materialize_balances [--date 2025-03-03] [--days 2]
+#
+# Pre-creates daily_balance rows (with the stored subsidy eligibility flag)
+# and monthly_balance rows (limit snapshotted from the employee) for every
+# active employee, for --days days starting at --date (default: today in
+# APP_TZ). The API runs the same job every BALANCE_MATERIALIZE_INTERVAL_SEC;
+# this is for cron or backfills. Safe to re-run.
+
+async def main():
+    ap = argparse.ArgumentParser(description="Pre-create daily/monthly balance rows.")
+    ap.add_argument("--date", type=date.fromisoformat, default=None)
+    ap.add_argument("--days", type=int, default=2)
+    args = ap.parse_args()
+
+    start = args.date or datetime.now(tz=ZoneInfo(settings.APP_TZ)).date()
+    async with SessionLocal() as db:
+        for i in range(args.days):
+            day = start + timedelta(days=i)
+            daily, monthly = await materialize_day(db, day)
+            await db.commit()
+            print(f"{day}: daily_balance rows={daily} monthly_balance rows={monthly}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,72 @@
+import argparse
+import asyncio
+from datetime import datetime, timezone
+
+from sqlalchemy import text
+
+from app.core.config import settings
+from app.db.models import Base
+from app.db.partitions import PARTITIONED_TABLES, create_month_partition, ensure_monthly_partitions, is_partitioned
+from app.db.session import engine
+
+# Usage:
+#   python -m scripts.partition_table transactions [--keep-legacy]
+#   python -m scripts.partition_table liveness_sessions
+#
+# One-off conversion of a table created before it was partitioned by month
+# (create_all never alters an existing table; partition maintenance and the
+# transactions archive only log a warning for it). In one transaction: the
+# plain table and its indexes are renamed to *_legacy, the partitioned table
+# is created from the model, partitions are created for every month in the
+# data plus the usual PARTITION_MONTHS_AHEAD and DEFAULT ones, the rows are
+# copied, and the legacy table is dropped unless --keep-legacy is given.
+# The table is locked exclusively throughout: run it in a maintenance window.
+# No other table has a foreign key to these two.
+
+async def migrate(table: str, keep_legacy: bool) -> None:
+    legacy = f"{table}_legacy"
+    async with engine.begin() as conn:
+        if await is_partitioned(conn, table):
+            print(f"{table} is already partitioned")
+            return
+        await conn.execute(text(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE"))
+        await conn.execute(text(f"ALTER TABLE {table} RENAME TO {legacy}"))
+        # index names (including the primary key's) are schema-wide
+        indexes = (await conn.execute(
+            text("SELECT indexname FROM pg_indexes WHERE schemaname = current_schema() AND tablename = :t"),
+            {"t": legacy},
+        )).scalars().all()
+        for idx in indexes:
+            await conn.execute(text(f'ALTER INDEX "{idx}" RENAME TO "{idx}_legacy"'))
+
+        await conn.run_sync(Base.metadata.tables[table].create)
+        months = (await conn.execute(text(
+            f"SELECT DISTINCT date_trunc('month', created_at AT TIME ZONE 'UTC') FROM {legacy}"
+        ))).scalars().all()
+        for m in sorted(months):
+            await create_month_partition(conn, table, m.date())
+        today = datetime.now(timezone.utc).date()
+        await ensure_monthly_partitions(conn, table, today, settings.PARTITION_MONTHS_AHEAD)
+
+        # columns added to the model since the legacy table was created keep their defaults
+        legacy_cols = set((await conn.execute(
+            text("SELECT column_name FROM information_schema.columns "
+                 "WHERE table_schema = current_schema() AND table_name = :t"),
+            {"t": legacy},
+        )).scalars())
+        cols = ", ".join(c.name for c in Base.metadata.tables[table].columns if c.name in legacy_cols)
+        n = (await conn.execute(text(f"INSERT INTO {table} ({cols}) SELECT {cols} FROM {legacy}"))).rowcount
+        if not keep_legacy:
+            await conn.execute(text(f"DROP TABLE {legacy}"))
+    print(f"{table}: {n} rows copied into {len(months)} monthly partitions"
+          + (f", old table kept as {legacy}" if keep_legacy else ""))
+
+def main():
+    ap = argparse.ArgumentParser(description="Convert a plain table into monthly partitions.")
+    ap.add_argument("table", choices=PARTITIONED_TABLES)
+    ap.add_argument("--keep-legacy", action="store_true")
+    args = ap.parse_args()
+    asyncio.run(migrate(args.table, args.keep_legacy))
+
+if __name__ == "__main__":
+    main()
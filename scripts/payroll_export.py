@@ -0,0 +1,31 @@
+import argparse
+import asyncio
+import sys
+
+from app.services.reports import payroll_export
+
+# Usage:
+#   python -m scripts.payroll_export --year-month 202503 [--format csv|jsonl] [--detail] [--out payroll.csv]
+#
+# Same export as GET /api/reports/payroll: per-employee monthly totals of
+# subsidy and limit deductions (APPROVED meals), or every transaction of the
+# month with --detail. Streams from a server-side cursor to stdout or --out.
+
+async def main():
+    ap = argparse.ArgumentParser(description="Export monthly payroll deductions.")
+    ap.add_argument("--year-month", type=int, required=True, help="YYYYMM")
+    ap.add_argument("--format", choices=["csv", "jsonl"], default="csv")
+    ap.add_argument("--detail", action="store_true")
+    ap.add_argument("--out", default="-")
+    args = ap.parse_args()
+
+    out = sys.stdout if args.out == "-" else open(args.out, "w", encoding="utf-8", newline="")
+    try:
+        async for chunk in payroll_export(args.year_month, args.format, args.detail):
+            out.write(chunk)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
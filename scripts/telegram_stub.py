@@ -0,0 +1,73 @@
+import argparse
+import json
+import random
+import re
+import sys
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Usage:
+#   python -m scripts.telegram_stub [--port 8081] [--fail-rate 0.1] [--rps 30] [--latency-ms 200]
+#   TELEGRAM_API_BASE=http://127.0.0.1:8081 uvicorn app.main:app
+#
+# Local stand-in for the Telegram Bot API sendMessage method, for exercising
+# the notification outbox dispatcher (app.services.telegram) without the real
+# service. Answers 429 with parameters.retry_after above --rps, 500 at
+# --fail-rate, and prints every accepted message to stdout.
+
+SEND_RE = re.compile(r"^/bot[^/]+/sendMessage$")
+
+def make_handler(args):
+    window = {"start": time.monotonic(), "count": 0}
+
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, status: int, body: dict) -> None:
+            raw = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(raw)))
+            self.end_headers()
+            self.wfile.write(raw)
+
+        def do_POST(self):
+            if not SEND_RE.match(self.path):
+                self._reply(404, {"ok": False, "error_code": 404, "description": "Not Found"})
+                return
+            payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if args.latency_ms:
+                time.sleep(args.latency_ms / 1000)
+
+            now = time.monotonic()
+            if now - window["start"] >= 1.0:
+                window["start"], window["count"] = now, 0
+            window["count"] += 1
+            if args.rps and window["count"] > args.rps:
+                self._reply(429, {"ok": False, "error_code": 429, "description": "Too Many Requests",
+                                  "parameters": {"retry_after": 1}})
+                return
+            if random.random() < args.fail_rate:
+                self._reply(500, {"ok": False, "error_code": 500, "description": "Internal Server Error"})
+                return
+            if not payload.get("chat_id"):
+                self._reply(400, {"ok": False, "error_code": 400, "description": "Bad Request: chat not found"})
+                return
+            print(json.dumps({"chat_id": payload["chat_id"], "text": payload.get("text")}, ensure_ascii=False), flush=True)
+            self._reply(200, {"ok": True, "result": {"message_id": int(now * 1000), "chat": {"id": payload["chat_id"]}}})
+
+        def log_message(self, fmt, *a):
+            print(fmt % a, file=sys.stderr)
+
+    return Handler
+
+def main():
+    ap = argparse.ArgumentParser(description="Local stand-in for the Telegram sendMessage API.")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8081)
+    ap.add_argument("--fail-rate", type=float, default=0.0)
+    ap.add_argument("--rps", type=int, default=30, help="requests per second before 429 (0 = unlimited)")
+    ap.add_argument("--latency-ms", type=int, default=0)
+    args = ap.parse_args()
+    ThreadingHTTPServer((args.host, args.port), make_handler(args)).serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import argparse
+import asyncio
+import json
+import sys
+from datetime import date
+from pathlib import Path
+
+import numpy as np
+
+from app.core.config import settings
+from app.db.partitions import partition_name
+from app.services.tx_archive import drop_archived, export_partition, load_archive
+
+# Usage:
+#   python -m scripts.tx_archive export 202501 [--drop]   # needs TRANSACTIONS_ARCHIVE_DIR
+#   python -m scripts.tx_archive summary /var/lib/meal/archive/transactions_202501.npz [--out -]
+#
+# export: writes one month of the partitioned transactions table to the
+# columnar archive (the maintenance job does this automatically for months
+# older than TRANSACTIONS_HOT_MONTHS); --drop then detaches and drops it once
+# the file's row count and amount totals match the partition.
+# summary: per-employee totals of APPROVED meals straight from an archive
+# file, the same columns as the payroll report.
+
+async def cmd_export(ym: int, drop: bool) -> None:
+    if not settings.TRANSACTIONS_ARCHIVE_DIR:
+        raise SystemExit("TRANSACTIONS_ARCHIVE_DIR is not set")
+    month = date(ym // 100, ym % 100, 1)
+    name = partition_name("transactions", month)
+    path, n = await export_partition(name, month)
+    print(f"{name}: {n} rows -> {path}", file=sys.stderr)
+    if drop:
+        await drop_archived(name, path)
+        print(f"{name}: dropped", file=sys.stderr)
+
+def cmd_summary(path: Path, out: str) -> None:
+    manifest, cols = load_archive(path)
+    approved = cols["status"] == "APPROVED"
+    emp, inverse = np.unique(cols["employee_id"][approved], return_inverse=True)
+    report = {
+        "month": manifest["month"],
+        "rows": manifest["rows"],
+        "employees": [],
+    }
+    meals = np.bincount(inverse, minlength=len(emp))
+    sums = {c: np.bincount(inverse, weights=cols[c][approved], minlength=len(emp))
+            for c in ("amount_cents", "subsidy_spent_cents", "monthly_spent_cents")}
+    for i, e in enumerate(emp):
+        report["employees"].append({"employee_id": str(e), "meals": int(meals[i]),
+                                    **{c: int(v[i]) for c, v in sums.items()}})
+    text = json.dumps(report, indent=2)
+    if out == "-":
+        print(text)
+    else:
+        Path(out).write_text(text, encoding="utf-8")
+
+def main():
+    ap = argparse.ArgumentParser(description="Columnar archive of closed transactions months.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    ex = sub.add_parser("export")
+    ex.add_argument("year_month", type=int, help="YYYYMM")
+    ex.add_argument("--drop", action="store_true")
+    sm = sub.add_parser("summary")
+    sm.add_argument("path", type=Path)
+    sm.add_argument("--out", default="-")
+    args = ap.parse_args()
+
+    if args.cmd == "export":
+        asyncio.run(cmd_export(args.year_month, args.drop))
+    else:
+        cmd_summary(args.path, args.out)
+
+if __name__ == "__main__":
+    main()